@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("BOT_STUB_MODEL", "1")
+
+class FakeCursor:
+    def __init__(self, connection, dictionary):
+        self.connection = connection
+        self.dictionary = dictionary
+        self.rows = []
+
+    def execute(self, query, params=()):
+        self.connection.executed.append((query, params))
+        self.rows = self.connection.respond(query, params, self.dictionary)
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    """Stand-in for a mysql.connector connection to one server.
+
+    `respond(query, params, dictionary)` returns the rows of each statement, and
+    every executed (query, params) is appended to `executed`.
+    """
+
+    def __init__(self, host='primary', port='3306', respond=None, executed=None):
+        self.server_host = host
+        self.server_port = port
+        self.respond = respond or (lambda query, params, dictionary: [])
+        self.executed = executed if executed is not None else []
+        self.closed = False
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self, dictionary)
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def fake_connection():
+    return FakeConnection
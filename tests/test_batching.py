@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+from woocommerce_batching import MicroBatcher
+
+def submit_concurrently(batcher, items):
+    """Submit items from one thread each; returns {item: result or exception}"""
+    outcomes = {}
+    start = threading.Barrier(len(items))
+
+    def caller(item):
+        start.wait()
+        try:
+            outcomes[item] = batcher.submit('key', item)
+        except Exception as e:
+            outcomes[item] = e
+
+    threads = [threading.Thread(target=caller, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert not any(thread.is_alive() for thread in threads), "a caller never got its result"
+    return outcomes
+
+def test_every_caller_gets_its_own_result():
+    batcher = MicroBatcher(lambda key, items: [item * 2 for item in items], max_wait=0.05)
+
+    assert submit_concurrently(batcher, [1, 2, 3, 4]) == {1: 2, 2: 4, 3: 6, 4: 8}
+
+@pytest.mark.parametrize('function', [
+    lambda key, items: [0] * (len(items) - 1),
+    lambda key, items: [0] * (len(items) + 1),
+])
+def test_wrong_number_of_results_fails_every_caller(function):
+    batcher = MicroBatcher(function, max_wait=0.05, max_size=4)
+
+    outcomes = submit_concurrently(batcher, [1, 2, 3, 4])
+
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes.values())
+
+def test_batch_function_error_reaches_every_caller():
+    def function(key, items):
+        raise RuntimeError("store down")
+
+    outcomes = submit_concurrently(MicroBatcher(function, max_wait=0.05, max_size=3), [1, 2, 3])
+
+    assert [str(outcome) for outcome in outcomes.values()] == ["store down"] * 3
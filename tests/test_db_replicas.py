@@ -0,0 +1,85 @@
+import time
+from types import SimpleNamespace
+
+import mysql.connector
+import pytest
+
+import woocommerce_db
+from woocommerce_db import Endpoint
+
+class Servers:
+    """A primary and one replica behind fake connections, with a clock the test moves"""
+
+    def __init__(self, monkeypatch, fake_connection):
+        self.fake_connection = fake_connection
+        self.now = 1000.0
+        self.lag = 0
+        self.replica_up = True
+        self.replica_query_error = False
+        self.executed = {'primary': [], 'replica': []}
+        self.primary = Endpoint('primary', '3306', replica=False)
+        self.replica = Endpoint('replica', '3307', replica=True)
+        monkeypatch.setattr(woocommerce_db, 'primary', self.primary)
+        monkeypatch.setattr(woocommerce_db, 'replicas', [self.replica])
+        monkeypatch.setattr(woocommerce_db, '_endpoints', {'primary:3306': self.primary, 'replica:3307': self.replica})
+        monkeypatch.setattr(woocommerce_db, 'connect', self.connect)
+        monkeypatch.setattr(woocommerce_db, 'time',
+                            SimpleNamespace(monotonic=lambda: self.now, perf_counter=time.perf_counter))
+
+    def connect(self, database=None, endpoint=None):
+        endpoint = endpoint or self.primary
+        if endpoint is self.replica and not self.replica_up:
+            raise mysql.connector.Error("connection refused")
+        name = 'replica' if endpoint is self.replica else 'primary'
+
+        def respond(query, params, dictionary):
+            if query.startswith('SHOW'):
+                return [{'Seconds_Behind_Source': self.lag}]
+            if name == 'replica' and self.replica_query_error:
+                raise mysql.connector.Error("lost connection")
+            return [(name,)]
+
+        return self.fake_connection(endpoint.host, endpoint.port, respond, self.executed[name])
+
+    def read(self):
+        return woocommerce_db.read_query('order_status', "SELECT 1", ())[0][0]
+
+@pytest.fixture
+def servers(monkeypatch, fake_connection):
+    return Servers(monkeypatch, fake_connection)
+
+def test_reads_go_to_a_fresh_replica(servers):
+    assert servers.read() == 'replica'
+    assert servers.executed['primary'] == []
+
+def test_lagging_replica_falls_back_to_the_primary(servers):
+    servers.lag = woocommerce_db.DB_REPLICA_MAX_LAG + 100
+
+    assert servers.read() == 'primary'
+    # Skipped without reconnecting until the lag is due for another check
+    servers.now += woocommerce_db.DB_REPLICA_LAG_CHECK_SECONDS / 2
+    assert servers.read() == 'primary'
+    assert len([query for query, _ in servers.executed['replica'] if query.startswith('SHOW')]) == 1
+
+def test_replica_returns_once_it_has_caught_up(servers):
+    servers.lag = woocommerce_db.DB_REPLICA_MAX_LAG + 100
+    assert servers.read() == 'primary'
+
+    servers.lag = 0
+    servers.now += woocommerce_db.DB_REPLICA_LAG_CHECK_SECONDS + 1
+    assert servers.read() == 'replica'
+
+def test_unreachable_replica_is_skipped_until_its_cooldown_ends(servers):
+    servers.replica_up = False
+    assert servers.read() == 'primary'
+
+    servers.replica_up = True
+    assert servers.read() == 'primary'
+    servers.now += woocommerce_db.DB_REPLICA_COOLDOWN
+    assert servers.read() == 'replica'
+
+def test_query_failing_on_the_replica_is_retried_on_the_primary(servers):
+    servers.replica_query_error = True
+
+    assert servers.read() == 'primary'
+    assert servers.replica.down_until > servers.now
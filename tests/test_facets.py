@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import woocommerce_db
+import woocommerce_facets
+from woocommerce_facets import FacetIndex
+
+MODIFIED = datetime(2024, 5, 1, 12, 0, 0)
+
+def build_index():
+    index = FacetIndex()
+    index.apply_changes(
+        [(1, 'Blue Cotton Shirt', 'blue-cotton-shirt', 'publish', MODIFIED),
+         (2, 'Red Linen Shirt', 'red-linen-shirt', 'publish', MODIFIED)],
+        {1: [('pa_color', 'blue')], 2: [('pa_color', 'red')]},
+        {1: {'price': '500', 'stock_status': 'instock'}, 2: {'price': '700', 'stock_status': 'instock'}},
+    )
+    return index
+
+def test_apply_meta_picks_up_stock_and_price_changes():
+    index = build_index()
+
+    changed = index.apply_meta({1: {'price': '450', 'stock_status': 'outofstock'},
+                                2: {'price': '700', 'stock_status': 'instock'}})
+
+    assert changed == 1
+    assert list(index.query([('stock', 'outofstock')])) == [0]
+    assert list(index.query([('stock', 'instock')])) == [1]
+    assert index.product(0).price == '450.00'
+    assert ('stock', 'instock') not in index.product_keys[0]
+
+def test_refresh_rereads_the_watermark_second_without_reapplying_products(monkeypatch):
+    index = build_index()
+    assert index.watermark == MODIFIED and index.watermark_ids == {1, 2}
+    queries = []
+
+    def read_query(name, query, params=(), dictionary=False):
+        queries.append((name, query, params))
+        if name == 'facet_products':
+            # Product 3 was saved in the same second as the watermark, after the last refresh
+            return [(2, 'Red Linen Shirt', 'red-linen-shirt', 'publish', MODIFIED),
+                    (3, 'Green Wool Scarf', 'green-wool-scarf', 'publish', MODIFIED)]
+        return []
+
+    monkeypatch.setattr(woocommerce_db, 'read_query', read_query)
+    products, _, _ = woocommerce_facets.load_changes(since=index.watermark, seen=index.watermark_ids)
+
+    assert 'post_modified >= %s' in queries[0][1]
+    assert [row[0] for row in products] == [3]
+    index.apply_changes(products, {}, {})
+    assert index.watermark_ids == {1, 2, 3}
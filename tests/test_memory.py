@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+import woocommerce_memory
+from woocommerce_memory import MemoryGuard
+
+MB = 1024 * 1024
+
+class Process:
+    """RSS and a monotonic clock the test sets"""
+
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        self.rss = 100 * MB
+        monkeypatch.setattr(woocommerce_memory, 'rss_bytes', lambda: self.rss)
+        monkeypatch.setattr(woocommerce_memory, 'time', SimpleNamespace(monotonic=lambda: self.now))
+
+@pytest.fixture
+def process(monkeypatch):
+    return Process(monkeypatch)
+
+def turn(guard, process, seconds):
+    process.now += seconds
+    with guard.checkout():
+        pass
+
+def guard():
+    return MemoryGuard(lambda: SimpleNamespace(team=[]), max_runs=0, recycle_rss=200 * MB,
+                       check_interval=10, max_backoff=60)
+
+def test_recycles_when_rss_goes_over_the_limit(process):
+    memory = guard()
+    turn(memory, process, 10)
+    assert memory.recycles == 0
+
+    process.rss = 300 * MB
+    turn(memory, process, 10)
+    assert memory.recycles == 1
+    # The recycle freed the memory
+    process.rss = 100 * MB
+    turn(memory, process, 10)
+    process.rss = 300 * MB
+    turn(memory, process, 10)
+    assert memory.recycles == 2
+
+def test_backs_off_while_recycling_does_not_lower_rss(process):
+    memory = guard()
+    process.rss = 300 * MB
+    recycled_at = []
+    for _ in range(30):
+        before = memory.recycles
+        turn(memory, process, 10)
+        if memory.recycles > before:
+            recycled_at.append(process.now - 1000)
+
+    # Waits of 20s, 40s, then the 60s cap, instead of a recycle on every check
+    assert recycled_at == [10, 40, 90, 160, 230, 300]
+
+def test_backoff_resets_once_rss_drops(process):
+    memory = guard()
+    process.rss = 300 * MB
+    turn(memory, process, 10)
+    turn(memory, process, 10)
+    assert memory.rss_backoff == 20
+
+    process.rss = 100 * MB
+    turn(memory, process, 10)
+    assert memory.rss_backoff == 0
+    process.rss = 300 * MB
+    turn(memory, process, 10)
+    assert memory.recycles == 2
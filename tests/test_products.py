@@ -0,0 +1,34 @@
+import pytest
+
+import woocommerce_db
+from woocommerce_products import find_products
+
+ROWS = [
+    (11, 'Blue Cotton Shirt', 'blue-cotton-shirt', '499', 'instock', 'SH-11'),
+    (12, 'Blue Linen Shirt', 'blue-linen-shirt', None, None, None),
+]
+
+@pytest.fixture
+def database(monkeypatch, fake_connection):
+    """Statements executed against a primary that answers every search with ROWS"""
+    executed = []
+    monkeypatch.setattr(woocommerce_db, 'replicas', [])
+    monkeypatch.setattr(woocommerce_db, 'connect', lambda database=None, endpoint=None: fake_connection(
+        respond=lambda query, params, dictionary: ROWS if 'LIKE' in query else [], executed=executed))
+    return executed
+
+def test_cold_search_is_one_round_trip(database):
+    products = find_products('shirt')
+
+    assert len(database) == 1
+    assert database[0][1] == ('%shirt%',)
+    assert [product.product_id for product in products] == [11, 12]
+    assert (products[0].price, products[0].stock_status, products[0].sku) == ('499', 'instock', 'SH-11')
+    assert products[0].link.endswith('/product/blue-cotton-shirt/')
+    assert products[1].price is None
+
+def test_repeated_search_is_one_round_trip(database):
+    find_products('shirt')
+    find_products('shirt')
+
+    assert len(database) == 2
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+
+import woocommerce_session
+from woocommerce_orders import OrderStatus
+from woocommerce_session import SessionStore
+
+EMAIL = 'customer@example.com'
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(woocommerce_session, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+def order(order_id):
+    return OrderStatus(order_id, 'wc-processing', '2024-05-01', 'Ada', 'Lovelace', '499')
+
+def test_session_expires_after_its_ttl(clock):
+    store = SessionStore(ttl=10, max_order_age=60)
+    store.note_message('a', f"my email is {EMAIL}")
+
+    clock.now += 9
+    assert store.identifiers('a')[0] == EMAIL
+    # Every use slides the expiry
+    clock.now += 9
+    assert store.identifiers('a')[0] == EMAIL
+    clock.now += 10
+    assert store.identifiers('a') == (None, None)
+    assert 'a' not in store.sessions
+
+def test_least_recently_used_session_is_evicted(clock):
+    store = SessionStore(max_sessions=2)
+    store.note_message('a', f"my email is {EMAIL}")
+    store.note_message('b', f"my email is {EMAIL}")
+    store.identifiers('a')
+    store.note_message('c', f"my email is {EMAIL}")
+
+    assert list(store.sessions) == ['a', 'c']
+    assert store.identifiers('b') == (None, None)
+
+def test_oldest_lookups_are_dropped_over_the_order_cap(clock):
+    store = SessionStore(max_orders=3)
+    store.remember_orders('a', EMAIL, None, [order(1), order(2)])
+    store.remember_orders('a', None, '3', [order(3)])
+    store.remember_orders('a', None, '4', [order(4)])
+
+    assert store.cached_orders('a', EMAIL, None) is None
+    assert store.cached_orders('a', None, '3') == [order(3)]
+    assert store.cached_orders('a', None, '4') == [order(4)]
+
+def test_single_lookup_over_the_cap_is_kept(clock):
+    store = SessionStore(max_orders=1)
+    store.remember_orders('a', EMAIL, None, [order(1), order(2)])
+
+    assert store.cached_orders('a', EMAIL, None) == [order(1), order(2)]
+    assert store.cached_orders('a', None, '#2') == [order(2)]
+
+def test_orders_expire_in_an_active_session(clock):
+    store = SessionStore(ttl=900, max_order_age=60)
+    store.remember_orders('a', EMAIL, None, [order(1)])
+
+    clock.now += 59
+    assert store.cached_orders('a', EMAIL, None) == [order(1)]
+    clock.now += 2
+    assert store.cached_orders('a', EMAIL, None) is None
+    # The session itself is still alive
+    assert store.identifiers('a') == (EMAIL, None)
@@ -0,0 +1,64 @@
+import pytest
+
+import woocommerce_db
+from woocommerce_db import SlowQueryLog
+
+# What MySQL's EXPLAIN returns for the order lookup without an index on the billing email
+EXPLAIN_FIXTURE = [
+    {'id': 1, 'select_type': 'PRIMARY', 'table': 'p', 'type': 'ref', 'possible_keys': 'PRIMARY,type_status_date',
+     'key': 'type_status_date', 'rows': 1200, 'Extra': 'Using where; Using temporary; Using filesort'},
+    {'id': 2, 'select_type': 'DEPENDENT SUBQUERY', 'table': 'wp_postmeta', 'type': 'ref', 'possible_keys': 'meta_key',
+     'key': 'meta_key', 'rows': 48000, 'Extra': 'Using where'},
+]
+
+@pytest.fixture
+def slow_log(monkeypatch, tmp_path, fake_connection):
+    """Every query counts as slow; EXPLAIN statements get the fixture plan"""
+    executed = []
+
+    def respond(query, params, dictionary):
+        return EXPLAIN_FIXTURE if query.startswith('EXPLAIN') else [(1, 'wc-processing')]
+
+    log = SlowQueryLog(str(tmp_path / 'slow.jsonl'))
+    monkeypatch.setattr(woocommerce_db, 'slow_query_log', log)
+    monkeypatch.setattr(woocommerce_db, 'SLOW_QUERY_SECONDS', 0.0)
+    monkeypatch.setattr(woocommerce_db, 'connect', lambda database=None, endpoint=None: fake_connection(
+        respond=respond, executed=executed))
+    log.executed = executed
+    return log
+
+def run_order_lookup():
+    query, params = woocommerce_db.order_status_query(email='customer@example.com', order_id='1234')
+    connection = woocommerce_db.connect()
+    return woocommerce_db.fetch_all(connection, 'order_status', query, params)
+
+def test_slow_query_is_logged_without_customer_data(slow_log):
+    assert run_order_lookup() == [(1, 'wc-processing')]
+    slow_log.flush()
+
+    [entry] = woocommerce_db.read_slow_log(slow_log.path)
+    assert entry['name'] == 'order_status'
+    assert entry['params'] == ['str(4)', 'str(20)']
+    assert 'customer@example.com' not in open(slow_log.path).read()
+    assert 'explain' not in entry
+
+def test_explain_is_captured_by_the_writer(slow_log, monkeypatch):
+    monkeypatch.setattr(woocommerce_db, 'DB_EXPLAIN_SLOW', True)
+
+    run_order_lookup()
+    slow_log.flush()
+
+    [entry] = woocommerce_db.read_slow_log(slow_log.path)
+    assert entry['explain'] == EXPLAIN_FIXTURE
+    assert [query.split()[0] for query, _ in slow_log.executed] == ['SELECT', 'EXPLAIN']
+
+def test_report_ranks_statements_and_shows_their_plan(slow_log, monkeypatch, capsys):
+    monkeypatch.setattr(woocommerce_db, 'DB_EXPLAIN_SLOW', True)
+    for _ in range(3):
+        run_order_lookup()
+    slow_log.flush()
+
+    [summary] = woocommerce_db.summarize_slow_log(woocommerce_db.read_slow_log(slow_log.path))
+    assert summary['count'] == 3
+    woocommerce_db.print_report([summary])
+    assert "table=wp_postmeta type=ref key=meta_key rows=48000" in capsys.readouterr().out
@@ -0,0 +1,163 @@
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import woocommerce_metrics as metrics
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being queued"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+class AdmissionController:
+    """Global in-flight limit with a bounded wait queue and a token bucket per session"""
+
+    def __init__(self, max_in_flight=8, max_queue=16, queue_timeout=10.0,
+                 session_rate=10 / 60, session_burst=5, max_sessions=10000):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.max_sessions = max_sessions
+        self.in_flight = 0
+        self.waiting = 0
+        self.buckets = OrderedDict()
+        self.condition = threading.Condition()
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge('admission_in_flight', self.in_flight)
+        metrics.set_gauge('admission_queue_depth', self.waiting)
+
+    def _take_token(self, session_id, now):
+        tokens, updated = self.buckets.pop(session_id, (self.session_burst, now))
+        tokens = min(self.session_burst, tokens + (now - updated) * self.session_rate)
+        allowed = tokens >= 1
+        self.buckets[session_id] = (tokens - 1 if allowed else tokens, now)
+        # Forget the least recently seen sessions
+        while len(self.buckets) > self.max_sessions:
+            self.buckets.popitem(last=False)
+        return allowed
+
+    def _reject(self, reason):
+        metrics.increment('admission_shed', labels={'reason': reason})
+        raise AdmissionRejected(reason)
+
+    @contextmanager
+    def admit(self, session_id=None):
+        """Hold an in-flight slot for the duration of the block or raise AdmissionRejected"""
+        with self.condition:
+            now = time.monotonic()
+            if self.session_rate and session_id is not None and not self._take_token(session_id, now):
+                self._reject('session_rate')
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.max_queue:
+                    self._reject('queue_full')
+                self.waiting += 1
+                self._publish()
+                deadline = now + self.queue_timeout
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject('queue_timeout')
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    self._publish()
+                metrics.observe('admission_wait_seconds', time.monotonic() - now)
+            self.in_flight += 1
+            self._publish()
+        metrics.increment('admission_admitted')
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self._publish()
+                self.condition.notify()
+
+def run_load_test(clients, requests_per_client, service_time, capacity, controller=None):
+    """Drive a simulated model backend that slows down once more than `capacity` calls overlap"""
+    active = [0]
+    lock = threading.Lock()
+    latencies = []
+    shed = [0]
+
+    def backend():
+        with lock:
+            active[0] += 1
+            load = active[0]
+        try:
+            # Overlapping calls share the backend, so each one takes proportionally longer
+            time.sleep(service_time * max(1.0, load / capacity))
+        finally:
+            with lock:
+                active[0] -= 1
+
+    def client(number):
+        for _ in range(requests_per_client):
+            start_time = time.perf_counter()
+            try:
+                if controller is None:
+                    backend()
+                else:
+                    with controller.admit(f"session-{number}"):
+                        backend()
+            except AdmissionRejected:
+                with lock:
+                    shed[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    wall_time = time.perf_counter() - start_time
+
+    latencies.sort()
+    def pick(fraction):
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else 0.0
+    return {
+        'served': len(latencies),
+        'shed': shed[0],
+        'p50': pick(0.50),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'throughput': len(latencies) / wall_time,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the admission controller against a simulated backend")
+    parser.add_argument('--clients', type=int, default=64, help="Concurrent simulated users")
+    parser.add_argument('--requests', type=int, default=10, help="Requests per user")
+    parser.add_argument('--service-time', type=float, default=0.05, help="Backend time per request when idle (s)")
+    parser.add_argument('--capacity', type=int, default=8, help="Overlapping calls the backend handles without slowing down")
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--max-queue', type=int, default=8)
+    parser.add_argument('--queue-timeout', type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients x {args.requests} requests, backend capacity {args.capacity}")
+    scenarios = [
+        ('no admission control', None),
+        ('admission control', AdmissionController(
+            max_in_flight=args.max_in_flight, max_queue=args.max_queue,
+            queue_timeout=args.queue_timeout, session_rate=0
+        )),
+    ]
+    for name, controller in scenarios:
+        result = run_load_test(args.clients, args.requests, args.service_time, args.capacity, controller)
+        print(f"{name:>22}: served {result['served']:4d}, shed {result['shed']:4d}, "
+              f"p50 {result['p50'] * 1000:7.1f}ms, p95 {result['p95'] * 1000:7.1f}ms, "
+              f"p99 {result['p99'] * 1000:7.1f}ms, {result['throughput']:.1f} req/s")
+
+if __name__ == "__main__":
+    main()
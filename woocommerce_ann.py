@@ -0,0 +1,218 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from woocommerce_snapshots import load_snapshot, save_snapshot
+
+# Default number of inverted lists probed per query; higher is slower but finds more true neighbours
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# Version of the arrays stored in a saved index; bump it when they change
+IVF_SNAPSHOT_SCHEMA = 1
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _top_k(scores, k):
+    """Indices of the k largest scores, best first"""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind='stable')
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind='stable')]
+
+class IvfIndex:
+    """Inverted-file index for cosine similarity over unit vectors.
+
+    Vectors are clustered around `nlist` centroids (spherical k-means). A query
+    scores the centroids, then only the vectors in its `nprobe` closest lists.
+    Each list keeps its vectors contiguous, so probing a list is one matrix-vector
+    product.
+    """
+
+    def __init__(self, dim, nlist=256, nprobe=IVF_NPROBE):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.trained_rows = 0
+        self.list_vectors = []
+        self.list_ids = []
+
+    @classmethod
+    def from_centroids(cls, other):
+        """An empty index reusing another index's training, for rebuilding without re-clustering"""
+        index = cls(other.dim, other.nlist, other.nprobe)
+        index._set_centroids(other.centroids, other.trained_rows)
+        return index
+
+    def _set_centroids(self, centroids, trained_rows):
+        self.centroids = centroids
+        self.nlist = len(centroids)
+        self.trained_rows = trained_rows
+        self.list_vectors = [np.zeros((0, self.dim), dtype=np.float32) for _ in range(self.nlist)]
+        self.list_ids = [np.zeros(0, dtype=np.int64) for _ in range(self.nlist)]
+
+    def train(self, vectors, iterations=10, sample_size=100000, seed=0):
+        """Learn the centroids from (a sample of) the vectors"""
+        vectors = _normalize(vectors)
+        trained_rows = len(vectors)
+        rng = np.random.default_rng(seed)
+        if len(vectors) > sample_size:
+            vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        self.nlist = min(self.nlist, len(vectors))
+        centroids = vectors[rng.choice(len(vectors), self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            counts = np.bincount(assignment, minlength=self.nlist)
+            # Empty lists keep their old centroid
+            filled = counts > 0
+            centroids[filled] = _normalize(sums[filled])
+        self._set_centroids(centroids, trained_rows)
+        return self
+
+    def _assign(self, vectors, batch_size=65536):
+        return np.concatenate([
+            np.argmax(vectors[start:start + batch_size] @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), batch_size)
+        ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+    def add(self, vectors, ids):
+        """Insert vectors under the given integer ids; only the touched lists are rewritten"""
+        if self.centroids is None:
+            raise ValueError("train() the index before adding vectors")
+        vectors = _normalize(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+        assignment = self._assign(vectors)
+        order = np.argsort(assignment, kind='stable')
+        lists, starts = np.unique(assignment[order], return_index=True)
+        bounds = list(starts) + [len(order)]
+        for number, list_number in enumerate(lists):
+            members = order[bounds[number]:bounds[number + 1]]
+            self.list_vectors[list_number] = np.concatenate([self.list_vectors[list_number], vectors[members]])
+            self.list_ids[list_number] = np.concatenate([self.list_ids[list_number], ids[members]])
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.list_ids)
+
+    def search(self, queries, k=10, nprobe=None):
+        """Return (scores, ids) arrays of shape (len(queries), k); missing hits have id -1"""
+        queries = _normalize(np.atleast_2d(queries))
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, query in enumerate(queries):
+            scores = np.concatenate([self.list_vectors[list_number] @ query for list_number in probes[row]])
+            ids = np.concatenate([self.list_ids[list_number] for list_number in probes[row]])
+            best = _top_k(scores, k)
+            all_scores[row, :len(best)] = scores[best]
+            all_ids[row, :len(best)] = ids[best]
+        return all_scores, all_ids
+
+    def save(self, path):
+        """Write the index to the single file `<path>.ivf`, replaced atomically; vectors are stored list by list"""
+        offsets = np.cumsum([0] + [len(ids) for ids in self.list_ids]).astype(np.int64)
+        # One file, so a reader never maps the vectors of one save with the offsets of another
+        save_snapshot(f"{path}.ivf", 'ivf_index', IVF_SNAPSHOT_SCHEMA, int(offsets[-1]), {
+            'centroids': self.centroids,
+            'vectors': np.concatenate(self.list_vectors) if self.list_vectors else np.zeros((0, self.dim), np.float32),
+            'ids': np.concatenate(self.list_ids) if self.list_ids else np.zeros(0, np.int64),
+            'offsets': offsets,
+        }, meta={'dim': self.dim, 'nlist': self.nlist, 'nprobe': self.nprobe, 'trained_rows': self.trained_rows})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open a saved index, or None if there is none; with mmap the vectors stay on disk and are paged in by probed lists"""
+        snapshot = load_snapshot(f"{path}.ivf", 'ivf_index', IVF_SNAPSHOT_SCHEMA)
+        if snapshot is None:
+            return None
+        meta = snapshot.meta
+        arrays = snapshot.arrays if mmap else {name: np.array(array) for name, array in snapshot.arrays.items()}
+        index = cls(meta['dim'], meta['nlist'], meta['nprobe'])
+        index.centroids = arrays['centroids']
+        index.trained_rows = meta['trained_rows']
+        vectors, ids, offsets = arrays['vectors'], arrays['ids'], arrays['offsets']
+        index.list_vectors = [vectors[offsets[i]:offsets[i + 1]] for i in range(index.nlist)]
+        index.list_ids = [ids[offsets[i]:offsets[i + 1]] for i in range(index.nlist)]
+        return index
+
+def brute_force_search(vectors, queries, k=10, batch_size=256):
+    """Exact top-k by cosine similarity, as the ground truth for recall"""
+    results = []
+    for start in range(0, len(queries), batch_size):
+        scores = queries[start:start + batch_size] @ vectors.T
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        ordered = np.take_along_axis(best, np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1), axis=1)
+        results.append(ordered)
+    return np.vstack(results)
+
+def generate_synthetic(rows, dim, clusters=1000, spread=0.5, seed=0):
+    """Clustered unit vectors, closer to real text embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = _normalize(rng.standard_normal((clusters, dim)))
+    vectors = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 100000):
+        end = min(rows, start + 100000)
+        vectors[start:end] = centers[rng.integers(0, clusters, end - start)] \
+            + spread * rng.standard_normal((end - start, dim)).astype(np.float32) / np.sqrt(dim)
+    return _normalize(vectors)
+
+def run_benchmark(rows, dim, nlist, queries_count=500, k=10, insert_fraction=0.1, path=None):
+    vectors = generate_synthetic(rows, dim)
+    rng = np.random.default_rng(1)
+    queries = _normalize(vectors[rng.choice(rows, queries_count, replace=False)]
+                         + 0.2 * rng.standard_normal((queries_count, dim)).astype(np.float32) / np.sqrt(dim))
+    print(f"{rows} vectors x {dim} dims ({vectors.nbytes / 1e6:.0f} MB), {queries_count} queries, recall@{k}")
+
+    start_time = time.perf_counter()
+    truth = brute_force_search(vectors, queries, k)
+    brute_qps = queries_count / (time.perf_counter() - start_time)
+    print(f"{'brute force':>14}: recall 1.000, {brute_qps:9.0f} QPS (batched)")
+
+    initial = rows - int(rows * insert_fraction)
+    start_time = time.perf_counter()
+    index = IvfIndex(dim, nlist=nlist).train(vectors[:initial])
+    trained = time.perf_counter()
+    index.add(vectors[:initial], np.arange(initial))
+    built = time.perf_counter()
+    index.add(vectors[initial:], np.arange(initial, rows))
+    inserted = time.perf_counter()
+    print(f"train {trained - start_time:.2f}s, add {initial} in {built - trained:.2f}s, "
+          f"insert {rows - initial} more in {inserted - built:.2f}s")
+
+    if path:
+        start_time = time.perf_counter()
+        index.save(path)
+        saved = time.perf_counter()
+        index = IvfIndex.load(path)
+        print(f"save {saved - start_time:.2f}s, mmap load {(time.perf_counter() - saved) * 1000:.1f}ms")
+
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+        if nprobe > index.nlist:
+            break
+        start_time = time.perf_counter()
+        _, found = index.search(queries, k, nprobe=nprobe)
+        qps = queries_count / (time.perf_counter() - start_time)
+        recall = np.mean([len(set(found[row]) & set(truth[row])) / k for row in range(queries_count)])
+        print(f"{'nprobe ' + str(nprobe):>14}: recall {recall:.3f}, {qps:9.0f} QPS")
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k vs QPS benchmark of the IVF index on synthetic vectors")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--nlist', type=int, default=0, help="Inverted lists (default: 4 * sqrt(rows))")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--path', help="Also save and mmap-load the index at this path prefix")
+    args = parser.parse_args()
+    nlist = args.nlist or int(4 * np.sqrt(args.rows))
+    run_benchmark(args.rows, args.dim, nlist, args.queries, args.k, path=args.path)
+
+if __name__ == "__main__":
+    main()
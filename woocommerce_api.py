@@ -0,0 +1,280 @@
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+import woocommerce_bot as bot
+import woocommerce_metrics as metrics
+from woocommerce_admission import AdmissionRejected
+from woocommerce_profiling import profiler
+
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+# Idle HTTP keep-alive connections are closed after this many seconds
+API_KEEP_ALIVE = int(os.getenv("API_KEEP_ALIVE", "30"))
+# SSE comment sent while the model is still working, so proxies don't drop the stream
+SSE_KEEP_ALIVE_SECONDS = float(os.getenv("SSE_KEEP_ALIVE_SECONDS", "10"))
+# Required in the X-Admin-Token header of /admin requests; the /admin endpoints are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+class ChatRequest(BaseModel):
+    message: str
+    # Omit on the first message; reuse the returned value for follow-ups (the server keeps their context)
+    session_id: Optional[str] = None
+
+class MemorySettings(BaseModel):
+    # Omitted fields keep their current value
+    max_runs: Optional[int] = None
+    recycle_turns: Optional[int] = None
+    recycle_rss_mb: Optional[float] = None
+    # Start tracemalloc with this stack depth, or stop it with 0
+    tracemalloc_frames: Optional[int] = None
+    # Replace the agent team now
+    recycle: bool = False
+
+class ProfilingSettings(BaseModel):
+    # Omitted fields keep their current value
+    fraction: Optional[float] = None
+    min_seconds: Optional[float] = None
+    interval_ms: Optional[float] = None
+
+@asynccontextmanager
+async def lifespan(app):
+    bot.faq_reloader.start(bot.FAQ_RELOAD_SECONDS)
+    yield
+
+app = FastAPI(title="WooCommerce support assistant", lifespan=lifespan)
+
+def answer(request, session_id):
+    """Run one turn through admission control and process_query; returns (reply, stats).
+
+    Turns run concurrently in the thread pool, each on an agent team lent to it alone.
+    """
+    stats = {}
+    with bot.admission.admit(session_id):
+        reply = bot.process_query(request.message, [], stats=stats, session_id=session_id)
+    return reply, stats
+
+def busy_response(error, session_id):
+    return JSONResponse(
+        status_code=429,
+        headers={'Retry-After': '5'},
+        content={'session_id': session_id, 'error': error.reason,
+                 'reply': bot.BUSY_MESSAGES.get(error.reason, bot.BUSY_MESSAGES['queue_full'])},
+    )
+
+def turn_summary(session_id, reply, stats):
+    return {
+        'session_id': session_id,
+        'trace_id': stats.get('trace_id'),
+        'reply': reply,
+        'path': stats.get('path'),
+        'latency_ms': round(stats.get('latency', 0.0) * 1000, 1),
+    }
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    session_id = request.session_id or uuid.uuid4().hex
+    try:
+        reply, stats = await run_in_threadpool(answer, request, session_id)
+    except AdmissionRejected as e:
+        return busy_response(e, session_id)
+    metrics.increment('api_requests', labels={'endpoint': 'chat'})
+    return turn_summary(session_id, reply, stats)
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def reply_chunks(reply):
+    """Split a finished reply at sentence and line boundaries; the chunks concatenate back to the reply"""
+    return [chunk for chunk in re.findall(r"[^.!?\n]*(?:[.!?]+\s*|\n+|$)", reply) if chunk]
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Server-sent events: `session`, keep-alive comments while the turn runs, `delta` chunks, then `done`"""
+    session_id = request.session_id or uuid.uuid4().hex
+
+    async def events():
+        yield sse('session', {'session_id': session_id})
+        turn = asyncio.ensure_future(run_in_threadpool(answer, request, session_id))
+        while True:
+            done, _ = await asyncio.wait({turn}, timeout=SSE_KEEP_ALIVE_SECONDS)
+            if done:
+                break
+            yield ": keep-alive\n\n"
+        try:
+            reply, stats = turn.result()
+        except AdmissionRejected as e:
+            busy = bot.BUSY_MESSAGES.get(e.reason, bot.BUSY_MESSAGES['queue_full'])
+            yield sse('error', {'error': e.reason, 'reply': busy})
+            return
+        for chunk in reply_chunks(reply):
+            yield sse('delta', {'text': chunk})
+        summary = turn_summary(session_id, reply, stats)
+        del summary['reply']
+        yield sse('done', summary)
+        metrics.increment('api_requests', labels={'endpoint': 'chat_stream'})
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.get("/healthz")
+async def healthz():
+    return {'status': 'ok', 'faq_entries': bot.faq_reloader.current.entry_count, 'pid': os.getpid()}
+
+@app.get("/metrics")
+async def metrics_text():
+    # Each worker process has its own registry; scrape every worker or run a single one behind the scraper
+    return PlainTextResponse(metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+@app.get("/metrics.json")
+async def metrics_json():
+    return metrics.snapshot()
+
+def check_admin(token):
+    # Constant-time comparison, so response timing doesn't reveal how much of a guess matched
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        raise HTTPException(status_code=403, detail="admin token required")
+
+@app.get("/admin/profiling")
+async def profiling_settings(x_admin_token: str = Header("")):
+    check_admin(x_admin_token)
+    return {'pid': os.getpid(), **profiler.settings()}
+
+@app.post("/admin/profiling")
+async def update_profiling(settings: ProfilingSettings, x_admin_token: str = Header("")):
+    """Change which turns are profiled; applies to the worker process that handles the request"""
+    check_admin(x_admin_token)
+    try:
+        updated = profiler.configure(settings.fraction, settings.min_seconds, settings.interval_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'pid': os.getpid(), **updated}
+
+@app.get("/admin/memory")
+async def memory_report(objects: bool = True, top: int = 10, x_admin_token: str = Header("")):
+    """RSS, agent history, object counts and tracemalloc growth since the previous report, for this worker"""
+    check_admin(x_admin_token)
+    return await run_in_threadpool(bot.team_guard.report, top, objects)
+
+@app.post("/admin/memory")
+async def update_memory(settings: MemorySettings, x_admin_token: str = Header("")):
+    check_admin(x_admin_token)
+    guard = bot.team_guard
+    if settings.max_runs is not None:
+        guard.max_runs = max(0, settings.max_runs)
+    if settings.recycle_turns is not None:
+        guard.recycle_turns = max(0, settings.recycle_turns)
+    if settings.recycle_rss_mb is not None:
+        guard.recycle_rss = max(0.0, settings.recycle_rss_mb) * 1024 * 1024
+    if settings.tracemalloc_frames is not None:
+        if settings.tracemalloc_frames > 0:
+            guard.start_tracing(settings.tracemalloc_frames)
+        else:
+            guard.stop_tracing()
+    if settings.recycle:
+        await run_in_threadpool(guard.recycle)
+    return {'pid': os.getpid(), **guard.settings()}
+
+def run_server(host=API_HOST, port=API_PORT, workers=API_WORKERS):
+    uvicorn.run("woocommerce_api:app", host=host, port=port, workers=workers,
+                timeout_keep_alive=API_KEEP_ALIVE, log_level=os.getenv("LOG_LEVEL", "info").lower())
+
+def drive_load(url, clients, seconds, messages):
+    """Hit /chat from `clients` threads with keep-alive connections; returns (latencies, errors, wall seconds)"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+
+    def client(number):
+        with httpx.Client(base_url=url, timeout=30) as http:
+            session_id = None
+            turn = 0
+            while time.perf_counter() < stop_at:
+                start_time = time.perf_counter()
+                response = http.post('/chat', json={'message': messages[(number + turn) % len(messages)],
+                                                    'session_id': session_id})
+                turn += 1
+                with lock:
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - start_time)
+                        session_id = response.json()['session_id']
+                    else:
+                        errors[0] += 1
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    return latencies, errors[0], time.perf_counter() - start_time
+
+def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/healthz", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"API at {url} did not come up")
+
+def run_benchmark(worker_counts, clients, seconds, stub_latency, port):
+    messages = [entry['question'] for entry in list(bot.faq_reloader.current.data)[:50]]
+    # Unlimited per-session rate so the benchmark measures the server, not the rate limiter
+    env = dict(os.environ, BOT_STUB_MODEL='1', BOT_STUB_LATENCY=str(stub_latency),
+               SESSION_RATE_PER_MINUTE='0', FAQ_RELOAD_SECONDS='0', LOG_LEVEL='warning')
+    url = f"http://127.0.0.1:{port}"
+    print(f"stub model latency {stub_latency * 1000:.0f}ms, {clients} clients, {seconds}s per run")
+    for workers in worker_counts:
+        server = subprocess.Popen([sys.executable, __file__, '--port', str(port), '--workers', str(workers)], env=env)
+        try:
+            wait_until_up(url)
+            latencies, errors, wall = drive_load(url, clients, seconds, messages)
+        finally:
+            server.terminate()
+            server.wait()
+        latencies.sort()
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+        print(f"{workers} worker(s): {len(latencies) / wall:7.1f} req/s, "
+              f"p50 {statistics.median(latencies) * 1000 if latencies else 0:6.1f}ms, p95 {p95 * 1000:6.1f}ms, "
+              f"{errors} rejected")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the assistant as a JSON/SSE chat API")
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--workers', type=int, default=API_WORKERS, help="Worker processes")
+    parser.add_argument('--benchmark', action='store_true', help="Measure throughput against the stub model")
+    parser.add_argument('--benchmark-workers', default='1,2,4', help="Worker counts to compare")
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--stub-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        worker_counts = [int(count) for count in args.benchmark_workers.split(',')]
+        run_benchmark(worker_counts, args.clients, args.seconds, args.stub_latency, args.port)
+    else:
+        run_server(args.host, args.port, args.workers)
+
+if __name__ == "__main__":
+    main()
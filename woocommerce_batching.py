@@ -0,0 +1,145 @@
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import woocommerce_metrics as metrics
+
+# How long the first query of a batch waits for others to join it (0 disables batching)
+RETRIEVAL_BATCH_WAIT_MS = float(os.getenv("RETRIEVAL_BATCH_WAIT_MS", "2"))
+# A batch is scored as soon as it holds this many queries
+RETRIEVAL_BATCH_MAX = int(os.getenv("RETRIEVAL_BATCH_MAX", "32"))
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.full = threading.Event()
+
+class MicroBatcher:
+    """Coalesce concurrent single-item calls into one call of a batch function.
+
+    The first caller for a key becomes the batch leader: it waits up to `max_wait`
+    seconds (less if the batch fills up), then runs `function(key, items)` in its
+    own thread and hands every caller its result. No caller waits longer than
+    `max_wait` plus the time of one batch call, and there is no background thread.
+    Items with different keys (another FAQ version, another top_k) never share a batch.
+    """
+
+    def __init__(self, function, max_wait=RETRIEVAL_BATCH_WAIT_MS / 1000, max_size=RETRIEVAL_BATCH_MAX, name='batch'):
+        self.function = function
+        self.max_wait = max_wait
+        self.max_size = max_size
+        self.name = name
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, item):
+        """Return function(key, [..., item, ...])'s result for item"""
+        if self.max_wait <= 0 or self.max_size <= 1:
+            return self.function(key, [item])[0]
+        future = Future()
+        with self.lock:
+            batch = self.pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self.pending[key] = _Batch()
+            batch.items.append(item)
+            batch.futures.append(future)
+            if len(batch.items) >= self.max_size:
+                # Closed: later callers start the next batch
+                del self.pending[key]
+                batch.full.set()
+        if leader:
+            start_time = time.perf_counter()
+            batch.full.wait(self.max_wait)
+            with self.lock:
+                if self.pending.get(key) is batch:
+                    del self.pending[key]
+            labels = {'batcher': self.name}
+            metrics.observe('batch_wait_seconds', time.perf_counter() - start_time, labels)
+            metrics.observe('batch_size', len(batch.items), labels)
+            self._run(key, batch)
+        return future.result()
+
+    def _run(self, key, batch):
+        # Every future gets a result or an exception, or its caller would wait forever
+        try:
+            results = list(self.function(key, batch.items))
+            if len(results) != len(batch.futures):
+                raise ValueError(f"{self.name}: batch function returned {len(results)} results "
+                                 f"for {len(batch.futures)} items")
+        except Exception as e:
+            metrics.increment('batch_errors', labels={'batcher': self.name})
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+def search_store(key, queries):
+    """Batch function for VectorStore searches keyed by (store, top_k)"""
+    store, top_k = key
+    return store.search_batch(queries, top_k)
+
+def run_benchmark(rows, threads, queries_per_thread, max_wait_ms):
+    from woocommerce_embeddings import noisy_paraphrase
+    from woocommerce_faq_store import FaqStore, generate_synthetic
+    from woocommerce_vector_store import LocalVectorStore
+
+    directory = tempfile.mkdtemp(prefix='batching_benchmark_')
+    try:
+        generate_synthetic(os.path.join(directory, 'faq.csv'), rows)
+        entries = FaqStore.from_csv(os.path.join(directory, 'faq.csv'))
+        store = LocalVectorStore(os.path.join(directory, 'vectors')).sync(entries)
+        rng = random.Random(5)
+        questions = [noisy_paraphrase(entries.question(rng.randrange(rows)), rng)
+                     for _ in range(threads * queries_per_thread)]
+        print(f"{rows} FAQ rows, {threads} concurrent callers x {queries_per_thread} queries")
+
+        batcher = MicroBatcher(search_store, max_wait=max_wait_ms / 1000, name='benchmark')
+        variants = [
+            ('per request', lambda question: store.search(question, 1)),
+            (f'batched {max_wait_ms:g}ms', lambda question: batcher.submit((store, 1), question)),
+        ]
+        for label, search in variants:
+            latencies = []
+            lock = threading.Lock()
+
+            def caller(number):
+                for question in questions[number::threads]:
+                    start_time = time.perf_counter()
+                    search(question)
+                    elapsed = time.perf_counter() - start_time
+                    with lock:
+                        latencies.append(elapsed)
+
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(caller, range(threads)))
+            wall = time.perf_counter() - start_time
+            latencies.sort()
+            print(f"{label:>16}: {len(latencies) / wall:8.0f} queries/s, p50 {statistics.median(latencies) * 1000:7.2f}ms, "
+                  f"p99 {latencies[int(0.99 * (len(latencies) - 1))] * 1000:7.2f}ms")
+        sizes = metrics.snapshot()['histograms'].get('batch_size', {}).get('batcher=benchmark', {})
+        if sizes:
+            print(f"mean batch size {sizes['sum'] / sizes['count']:.1f}")
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of micro-batched vs per-request FAQ vector search")
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=50, help="Queries per caller thread")
+    parser.add_argument('--max-wait-ms', type=float, default=RETRIEVAL_BATCH_WAIT_MS)
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.threads, args.queries, args.max_wait_ms)
+
+if __name__ == "__main__":
+    main()
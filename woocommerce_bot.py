@@ -2,10 +2,35 @@ from agno.agent import Agent
 from agno.models.google.gemini import Gemini
 import os
 from dotenv import load_dotenv
+import contextvars
 import csv
 import mysql.connector
 import gradio as gr
 import re
+import time
+import logging
+import json
+import signal
+import threading
+import uuid
+
+import woocommerce_facets
+from woocommerce_admission import AdmissionController, AdmissionRejected
+from woocommerce_batching import MicroBatcher, search_store
+import woocommerce_metrics as metrics
+from woocommerce_memory import MemoryGuard
+from woocommerce_profiling import profiler
+from woocommerce_faq_reload import FaqReloader
+from woocommerce_pages import KNOWLEDGE_PAGES_FILE
+from woocommerce_vector_store import create_vector_store
+from woocommerce_products import find_products, format_products
+from woocommerce_orders import (
+    fetch_orders, format_order_status, prefetch_orders, render_order_reply, route_order_status, take_prefetched
+)
+from woocommerce_session import current_session, session_store
+from woocommerce_resilience import CircuitBreaker, CircuitOpenError, DeadlineExceededError, ResilientCaller
+from woocommerce_stub import StubAgentTeam, estimate_tokens
+from woocommerce_transcripts import TranscriptSink
 
 load_dotenv()
 
@@ -20,8 +45,56 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 WC_URL = os.getenv("WC_URL")
 
+# Use the offline stub agent team instead of Gemini (evaluation and benchmarks)
+BOT_STUB_MODEL = os.getenv("BOT_STUB_MODEL", "").lower() in ("1", "true", "yes")
+BOT_STUB_LATENCY = float(os.getenv("BOT_STUB_LATENCY", "0"))
+
+# Token accounting: optional per-turn budget ("degrade" answers from the FAQ index, "fail" refuses)
+TURN_TOKEN_BUDGET = int(os.getenv("TURN_TOKEN_BUDGET", "0"))
+TOKEN_BUDGET_MODE = os.getenv("TOKEN_BUDGET_MODE", "degrade")
+# Prices in USD per million tokens, used for the cost estimate
+GEMINI_INPUT_COST_PER_MTOK = float(os.getenv("GEMINI_INPUT_COST_PER_MTOK", "0"))
+GEMINI_OUTPUT_COST_PER_MTOK = float(os.getenv("GEMINI_OUTPUT_COST_PER_MTOK", "0"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Model call resilience: per-call HTTP deadline, per-turn deadline, retries, hedging and circuit breaker
+GEMINI_CALL_TIMEOUT = float(os.getenv("GEMINI_CALL_TIMEOUT", "30"))
+MODEL_TURN_TIMEOUT = float(os.getenv("MODEL_TURN_TIMEOUT", "60"))
+MODEL_MAX_ATTEMPTS = int(os.getenv("MODEL_MAX_ATTEMPTS", "2"))
+MODEL_HEDGE = os.getenv("MODEL_HEDGE", "").lower() in ("1", "true", "yes")
+MODEL_HEDGE_PERCENTILE = float(os.getenv("MODEL_HEDGE_PERCENTILE", "0.95"))
+MODEL_BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "5"))
+MODEL_BREAKER_RESET = float(os.getenv("MODEL_BREAKER_RESET", "30"))
+
+# Admission control for the chat front end
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+SESSION_RATE_PER_MINUTE = float(os.getenv("SESSION_RATE_PER_MINUTE", "10"))
+SESSION_BURST = int(os.getenv("SESSION_BURST", "5"))
+
+# Packed FAQ snapshot file (built from faq.csv when missing or stale); unset loads the CSV into a list
+FAQ_SNAPSHOT = os.getenv("FAQ_SNAPSHOT")
+# Set by the prefork launcher: map the snapshot it publishes instead of reading faq.csv
+FAQ_FOLLOW_SNAPSHOT = os.getenv("FAQ_FOLLOW_SNAPSHOT", "0").lower() in ("1", "true", "yes")
+
+# Path prefix of the local FAQ embedding index used for semantic matching (unset disables it
+# unless VECTOR_STORE=pgvector)
+FAQ_EMBEDDINGS = os.getenv("FAQ_EMBEDDINGS")
+EMBEDDING_MIN_SCORE = float(os.getenv("EMBEDDING_MIN_SCORE", "0.35"))
+# FAQ and policy entries retrieved for the customer's message and put in the FAQ agent's prompt
+FAQ_CONTEXT_ENTRIES = int(os.getenv("FAQ_CONTEXT_ENTRIES", "5"))
+
+# How often faq.csv is checked for edits (0 disables hot reload)
+FAQ_RELOAD_SECONDS = float(os.getenv("FAQ_RELOAD_SECONDS", "5"))
+
+# Answer plain "status of order 1234" questions straight from the database, without the model
+DIRECT_ORDER_RENDERING = os.getenv("DIRECT_ORDER_RENDERING", "1").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("woocommerce_bot")
+
 # Check if all required environment variables are set
-if not GEMINI_API_KEY or not DB_NAME or not DB_USER or not DB_PASSWORD or not DB_HOST or not WC_URL:
+if not BOT_STUB_MODEL and (not GEMINI_API_KEY or not DB_NAME or not DB_USER or not DB_PASSWORD or not DB_HOST or not WC_URL):
     raise ValueError("Missing required environment variables")
 
 def load_faq(csv_file):
@@ -46,84 +119,29 @@ def load_faq(csv_file):
 
 def get_order_status(email: str = None, order_id: str = None) -> str:
     """Tool to retrieve order status based on email or order ID"""
+    session_id = current_session.get()
+    if not email and not order_id:
+        # Follow-up questions: reuse what the customer already told us in this session
+        email, order_id = session_store.identifiers(session_id)
     if not email and not order_id:
         return "Please provide either an email address or order ID."
     
     try:
-        mydb = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            port=DB_PORT
-        )
-        mycursor = mydb.cursor(dictionary=True)
-
-        # Construct the SQL query to retrieve the order status
-        query = """
-        SELECT
-            p.ID as order_id,
-            p.post_status as order_status,
-            p.post_date as order_date,
-            MAX(CASE WHEN pm.meta_key = '_billing_first_name' THEN pm.meta_value END) as first_name,
-            MAX(CASE WHEN pm.meta_key = '_billing_last_name' THEN pm.meta_value END) as last_name,
-            MAX(CASE WHEN pm.meta_key = '_order_total' THEN pm.meta_value END) as total
-        FROM
-            wp_posts p
-        JOIN wp_postmeta pm ON p.ID = pm.post_id
-        WHERE
-            p.post_type = 'shop_order'
-        """
-        
-        params = []
-        if order_id:
-            query += " AND p.ID = %s"
-            params.append(order_id)
-        if email:
-            query += " AND p.ID IN (SELECT post_id FROM wp_postmeta WHERE meta_key = '_billing_email' AND meta_value = %s)"
-            params.append(email)
-            
-        query += " GROUP BY p.ID ORDER BY p.post_date DESC LIMIT 5"
-        
-        mycursor.execute(query, params)
-        myresult = mycursor.fetchall()
-        
-        if myresult:
-            result = ["Here are the order details:"]
-            for row in myresult:
-                order_date = row['order_date'].strftime('%Y-%m-%d %H:%M:%S') if row['order_date'] else 'N/A'
-                status_mapping = {
-                    'wc-pending': 'Pending payment',
-                    'wc-processing': 'Processing',
-                    'wc-on-hold': 'On hold',
-                    'wc-completed': 'Completed',
-                    'wc-cancelled': 'Cancelled',
-                    'wc-refunded': 'Refunded',
-                    'wc-failed': 'Failed'
-                }
-                status = status_mapping.get(row['order_status'], row['order_status'])
-                
-                result.append(f"Order #{row['order_id']}")
-                result.append(f"Date: {order_date}")
-                result.append(f"Customer: {row.get('first_name', '')} {row.get('last_name', '')}")
-                result.append(f"Total: ${row.get('total', 'N/A')}")
-                result.append(f"Status: {status}")
-                result.append("---")
-            
-            return "\n".join(result)
-        else:
-            if order_id:
-                return f"No order found with ID {order_id}."
-            else:
-                return f"No orders found for email {email}."
+        orders = session_store.cached_orders(session_id, email, order_id)
+        if orders is not None:
+            metrics.increment('session_context_hits')
+            return format_order_status(orders, email, order_id)
+        # Served from the speculative lookup started when the message arrived, if it matches
+        orders = take_prefetched(email, order_id)
+        if orders is None:
+            orders = fetch_orders(email, order_id)
+        session_store.remember_orders(session_id, email, order_id, orders)
+        return format_order_status(orders, email, order_id)
 
     except mysql.connector.Error as e:
         return f"Database error: {e}"
     except Exception as e:
         return f"An error occurred: {e}"
-    finally:
-        if 'mydb' in locals() and mydb:
-            mydb.close()
 
 def search_products(product_name: str) -> str:
     """Tool to search for products by name"""
@@ -131,142 +149,194 @@ def search_products(product_name: str) -> str:
         return "Please provide a product name to search for."
     
     try:
-        mydb = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            port=DB_PORT
+        products = find_products(product_name)
+        return format_products(products, product_name)
+
+    except mysql.connector.Error as e:
+        return f"Database error: {e}"
+    except Exception as e:
+        return f"An error occurred: {e}"
+
+def browse_products(category: str = None, attributes: str = None, min_price: float = None,
+                    max_price: float = None, keywords: str = None) -> str:
+    """Tool to browse products by category, attributes and price range.
+
+    attributes is a comma-separated list of "name:value" pairs or bare values,
+    e.g. "color:blue, cotton"; keywords must all appear in the product title.
+    """
+    if not any([category, attributes, min_price, max_price, keywords]):
+        return "Please provide a category, attribute, price range or keywords to browse by."
+
+    try:
+        index = woocommerce_facets.get_index()
+        positions = index.query(
+            woocommerce_facets.parse_filters(category, attributes),
+            min_price=min_price,
+            max_price=max_price,
+            keywords=keywords
         )
-        mycursor = mydb.cursor()
-
-        # Use parameterized query for security
-        query = """
-        SELECT
-            ID,
-            post_title
-        FROM
-            wp_posts
-        WHERE
-            post_type = 'product'
-            AND post_status = 'publish'
-            AND post_title LIKE %s
-        LIMIT 10;
-        """
-        
-        # Add wildcards for the LIKE query
-        search_term = f"%{product_name}%"
-        mycursor.execute(query, (search_term,))
-        
-        myresult = mycursor.fetchall()
-        
-        if myresult:
-            result = ["Here are the products that match your search:"]
-            for row in myresult:
-                product_id = row[0]
-                product_title = row[1]
-                product_link = f"{WC_URL}/product/{product_title.lower().replace(' ', '-')}"
-                result.append(f"Product: {product_title}")
-                result.append(f"Link: {product_link}")
-                result.append("---")
-            
-            return "\n".join(result)
-        else:
-            return f"No products found with the name '{product_name}'."
+        products = [index.product(position) for position in positions]
+        return format_products(products, ', '.join(filter(None, [category, attributes, keywords])) or 'your filters')
 
     except mysql.connector.Error as e:
         return f"Database error: {e}"
     except Exception as e:
         return f"An error occurred: {e}"
-    finally:
-        if 'mydb' in locals() and mydb:
-            mydb.close()
 
 # Load FAQ data
-faq_data = load_faq('faq.csv')
+# Current FAQ data and index, swapped atomically when faq.csv changes.
+# A packed, memory-mapped snapshot (FAQ_SNAPSHOT) keeps very large knowledge bases compact.
+# Chunks of ingested store policy pages (python woocommerce_pages.py) are served alongside the FAQ.
+faq_reloader = FaqReloader('faq.csv', snapshot_path=FAQ_SNAPSHOT, vector_store=create_vector_store(FAQ_EMBEDDINGS),
+                           extra_paths=[KNOWLEDGE_PAGES_FILE], follow_snapshot=FAQ_FOLLOW_SNAPSHOT)
 
-# Create the FAQ Agent
-faq_agent = Agent(
-    name="FAQ Agent",
-    role="Answer questions based on the provided FAQ data",
-    model=Gemini(
-        id="gemini-2.0-flash-exp",
-        api_key=GEMINI_API_KEY,
-        generative_model_kwargs={},
-        generation_config={}
-    ),
-    instructions=f"""You are an FAQ assistant for an e-commerce store. 
-    Use the following FAQ data to answer questions: {faq_data}
-    If you don't find a direct answer in the FAQ data, provide a helpful response based on general e-commerce knowledge.
-    Always be polite and professional.""",
-    show_tool_calls=False,  # Hide tool calls
-    markdown=True,
-)
+# Concurrent semantic FAQ lookups (retrieval for every turn, and every fallback answer) are scored as one matrix product
+semantic_batcher = MicroBatcher(search_store, name='faq_semantic')
 
-# Create the Order Status Agent
-order_status_agent = Agent(
-    name="Order Status Agent",
-    role="Retrieve order status based on email or order ID",
-    model=Gemini(
-        id="gemini-2.0-flash-exp",
-        api_key=GEMINI_API_KEY,
-        generative_model_kwargs={},
-        generation_config={}
-    ),
-    tools=[get_order_status],
-    instructions="""You are an order status assistant. 
-    Use the get_order_status tool to retrieve order status information.
-    Always ask for either an email address or order ID if the user doesn't provide one.
-    Explain what each order status means in customer-friendly language.""",
-    show_tool_calls=False,  # Hide tool calls
-    markdown=True,
-)
+# The customer message of the turn being handled, with the FAQ entries retrieved for it once known;
+# copied into the model worker threads, where the FAQ agent renders its instructions
+current_faq_context = contextvars.ContextVar('current_faq_context', default=None)
+
+def retrieve_faq(message, top_k=FAQ_CONTEXT_ENTRIES):
+    """Up to top_k FAQ entries for a message, from the vector store when there is one, else the lexical index"""
+    faq = faq_reloader.current
+    if faq.embeddings is not None:
+        # The lexical index scans every row, too slow per turn at the sizes the vector store is there for
+        hits = [hit for hit in semantic_batcher.submit((faq.embeddings, top_k), message) if hit[0] >= EMBEDDING_MIN_SCORE]
+    else:
+        hits = faq.index.search(message, top_k)
+    entries = {}
+    for _, entry in hits:
+        entries.setdefault(entry['question'], {'question': entry['question'], 'answer': entry['answer']})
+    metrics.observe('faq_context_entries', min(len(entries), top_k))
+    return list(entries.values())[:top_k]
 
-# Create the Product Search Agent
-product_search_agent = Agent(
-    name="Product Search Agent",
-    role="Search for products by name",
-    model=Gemini(
+def turn_faq_entries():
+    """The FAQ entries retrieved for the current turn's message; retrieved once, on first use"""
+    context = current_faq_context.get()
+    if context is None:
+        return []
+    if 'entries' not in context:
+        context['entries'] = retrieve_faq(context['message'])
+    return context['entries']
+
+def faq_instructions(agent=None):
+    """FAQ agent instructions with the entries retrieved for the current message, rendered on every run"""
+    return f"""You are an FAQ assistant for an e-commerce store. 
+        Use the following FAQ data, the entries closest to the customer's question, to answer questions: {turn_faq_entries()}
+        If you don't find a direct answer in the FAQ data, provide a helpful response based on general e-commerce knowledge.
+        Always be polite and professional."""
+
+def gemini_model():
+    """Gemini model with a per-call HTTP deadline"""
+    return Gemini(
         id="gemini-2.0-flash-exp",
         api_key=GEMINI_API_KEY,
         generative_model_kwargs={},
-        generation_config={}
-    ),
-    tools=[search_products],
-    instructions="""You are a product search assistant.
-    Use the search_products tool to find products based on the user's query.
-    If the user asks about products or mentions looking for something, help them find it.
-    Always ask for clarification if the product name is ambiguous.""",
-    show_tool_calls=False,  # Hide tool calls
-    markdown=True,
+        generation_config={},
+        client_params={'http_options': {'timeout': int(GEMINI_CALL_TIMEOUT * 1000)}}
+    )
+
+def create_agent_team():
+    """Build the team leader together with fresh sub-agents"""
+    if BOT_STUB_MODEL:
+        return StubAgentTeam(faq_reloader.current.data, latency=BOT_STUB_LATENCY)
+
+    # Create the FAQ Agent
+    faq_agent = Agent(
+        name="FAQ Agent",
+        role="Answer questions based on the provided FAQ data",
+        model=gemini_model(),
+        instructions=faq_instructions,
+        show_tool_calls=False,  # Hide tool calls
+        markdown=True,
+    )
+
+    # Create the Order Status Agent
+    order_status_agent = Agent(
+        name="Order Status Agent",
+        role="Retrieve order status based on email or order ID",
+        model=gemini_model(),
+        tools=[get_order_status],
+        instructions="""You are an order status assistant. 
+        Use the get_order_status tool to retrieve order status information.
+        Always ask for either an email address or order ID if the user doesn't provide one.
+        For follow-up questions about orders already discussed, call get_order_status without arguments: it remembers the customer's email and order ID for this conversation.
+        Explain what each order status means in customer-friendly language.""",
+        show_tool_calls=False,  # Hide tool calls
+        markdown=True,
+    )
+
+    # Create the Product Search Agent
+    product_search_agent = Agent(
+        name="Product Search Agent",
+        role="Search for products by name",
+        model=gemini_model(),
+        tools=[search_products, browse_products],
+        instructions="""You are a product search assistant.
+        Use the search_products tool to find products based on the user's query.
+        Use the browse_products tool when the user filters by category, attributes (color, size, material...) or price, e.g. "cotton shirts under 500".
+        If the user asks about products or mentions looking for something, help them find it.
+        Include the price, stock status and link of each product so the customer doesn't need to ask again.
+        Always ask for clarification if the product name is ambiguous.""",
+        show_tool_calls=False,  # Hide tool calls
+        markdown=True,
+    )
+
+    # Create the Agent Team
+    return Agent(
+        team=[faq_agent, order_status_agent, product_search_agent],
+        model=gemini_model(),
+        instructions="""You are an e-commerce assistant for our WooCommerce store.
+        
+        Your capabilities include:
+        1. Answering frequently asked questions about our store, products, shipping, returns, etc.
+        2. Checking order status when customers provide their email or order ID
+        3. Helping customers find products by searching our product catalog
+        
+        Delegate tasks to the appropriate sub-agent based on the user's query.
+        
+        Always be helpful, friendly, and professional. If you're unsure about something, acknowledge that and offer alternative assistance.
+        
+        Start conversations by introducing yourself as the store's virtual assistant and briefly mentioning what you can help with.
+        """,
+        show_tool_calls=False,  # Hide tool calls
+        markdown=True,
+    )
+
+# agno keeps per-run state on the Agent, so each in-flight turn gets a team of its own from this pool;
+# their run history is trimmed and the teams recycled to keep memory bounded
+team_guard = MemoryGuard(create_agent_team, max_idle=ADMISSION_MAX_IN_FLIGHT)
+
+# Caps concurrent model work for the web UI and sheds load with a fast "busy" reply
+admission = AdmissionController(
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    session_rate=SESSION_RATE_PER_MINUTE / 60,
+    session_burst=SESSION_BURST
 )
 
-# Create the Agent Team
-agent_team = Agent(
-    team=[faq_agent, order_status_agent, product_search_agent],
-    model=Gemini(
-        id="gemini-2.0-flash-exp",
-        api_key=GEMINI_API_KEY,
-        generative_model_kwargs={},
-        generation_config={}
-    ),
-    instructions="""You are an e-commerce assistant for our WooCommerce store.
-    
-    Your capabilities include:
-    1. Answering frequently asked questions about our store, products, shipping, returns, etc.
-    2. Checking order status when customers provide their email or order ID
-    3. Helping customers find products by searching our product catalog
-    
-    Delegate tasks to the appropriate sub-agent based on the user's query.
-    
-    Always be helpful, friendly, and professional. If you're unsure about something, acknowledge that and offer alternative assistance.
-    
-    Start conversations by introducing yourself as the store's virtual assistant and briefly mentioning what you can help with.
-    """,
-    show_tool_calls=False,  # Hide tool calls
-    markdown=True,
+BUSY_MESSAGES = {
+    'session_rate': "You're sending messages faster than I can answer. Please wait a moment and try again.",
+    'queue_full': "I'm helping a lot of customers right now. Please try again in a few seconds.",
+    'queue_timeout': "I'm helping a lot of customers right now. Please try again in a few seconds.",
+}
+
+# Guards every team run: overall deadline, retries, optional hedging and a circuit breaker
+model_breaker = CircuitBreaker('gemini', failure_threshold=MODEL_BREAKER_FAILURES, reset_timeout=MODEL_BREAKER_RESET)
+model_caller = ResilientCaller(
+    'agent_team',
+    timeout=MODEL_TURN_TIMEOUT,
+    max_attempts=MODEL_MAX_ATTEMPTS,
+    hedge=MODEL_HEDGE,
+    hedge_percentile=MODEL_HEDGE_PERCENTILE,
+    breaker=model_breaker
 )
 
+# Every turn (message, reply, route, tool calls, latency, tokens) for QA, written behind the replies
+transcript_sink = TranscriptSink()
+
 # Function to clean agent status messages from the response
 def clean_agent_status(text):
     # Remove lines that contain agent status messages
@@ -284,11 +354,230 @@ def clean_agent_status(text):
     
     return text.strip()
 
+def snapshot_member_runs(team):
+    """Remember the last run ID of every sub-agent before a turn starts"""
+    return {agent.name: getattr(agent, 'run_id', None) for agent in (team.team or [])}
+
+def member_responses_since(team, snapshot):
+    """Return the run responses of sub-agents that ran since the snapshot was taken"""
+    responses = []
+    for agent in (team.team or []):
+        run_response = getattr(agent, 'run_response', None)
+        if run_response is not None and getattr(agent, 'run_id', None) != snapshot.get(agent.name):
+            responses.append((agent.name, run_response))
+    return responses
+
+def count_calls(response):
+    """Count model calls and tool calls recorded on a run response"""
+    # agno adds one metrics entry per model reply, whatever role the model gives them ("model" for Gemini)
+    llm_calls = len(response_token_calls(response))
+    tool_calls = len(getattr(response, 'tools', None) or [])
+    return llm_calls, tool_calls
+
+def tool_calls_of(response):
+    """[{'name': ..., 'args': ...}] for the tool calls recorded on a run response"""
+    return [{'name': tool.get('tool_name'), 'args': tool.get('tool_args')}
+            for tool in getattr(response, 'tools', None) or [] if isinstance(tool, dict)]
+
+def response_token_calls(response):
+    """Per model call token usage from the metrics of a run response"""
+    run_metrics = getattr(response, 'metrics', None) or {}
+
+    def as_list(key):
+        value = run_metrics.get(key) or []
+        return value if isinstance(value, list) else [value]
+
+    input_tokens = as_list('input_tokens') or as_list('prompt_tokens')
+    output_tokens = as_list('output_tokens') or as_list('completion_tokens')
+    calls = []
+    for position in range(max(len(input_tokens), len(output_tokens))):
+        input_count = input_tokens[position] if position < len(input_tokens) else 0
+        output_count = output_tokens[position] if position < len(output_tokens) else 0
+        calls.append({'input_tokens': input_count or 0, 'output_tokens': output_count or 0})
+    return calls
+
+def token_cost(input_tokens, output_tokens):
+    """Estimated USD cost of a number of prompt and completion tokens"""
+    return (input_tokens * GEMINI_INPUT_COST_PER_MTOK + output_tokens * GEMINI_OUTPUT_COST_PER_MTOK) / 1_000_000
+
+def collect_token_usage(team, response, members):
+    """Aggregate token usage per model call, per agent and for the whole turn"""
+    usage = {'calls': [], 'agents': {}, 'input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0}
+    leader_name = getattr(team, 'name', None) or 'Agent Team'
+    for agent_name, agent_response in [(leader_name, response)] + list(members):
+        agent_usage = usage['agents'].setdefault(agent_name, {'calls': 0, 'input_tokens': 0, 'output_tokens': 0})
+        for call in response_token_calls(agent_response):
+            usage['calls'].append(dict(call, agent=agent_name))
+            agent_usage['calls'] += 1
+            agent_usage['input_tokens'] += call['input_tokens']
+            agent_usage['output_tokens'] += call['output_tokens']
+            usage['input_tokens'] += call['input_tokens']
+            usage['output_tokens'] += call['output_tokens']
+    usage['total_tokens'] = usage['input_tokens'] + usage['output_tokens']
+    usage['cost'] = token_cost(usage['input_tokens'], usage['output_tokens'])
+    return usage
+
+def record_token_usage(usage):
+    """Feed a turn's token usage into the rolling metrics"""
+    metrics.increment('turns')
+    metrics.increment('input_tokens', usage['input_tokens'])
+    metrics.increment('output_tokens', usage['output_tokens'])
+    metrics.increment('cost_usd', usage['cost'])
+    metrics.observe('turn_tokens', usage['total_tokens'])
+    metrics.observe('turn_model_calls', len(usage['calls']))
+    for agent_name, agent_usage in usage['agents'].items():
+        labels = {'agent': agent_name}
+        metrics.increment('agent_model_calls', agent_usage['calls'], labels)
+        metrics.increment('agent_input_tokens', agent_usage['input_tokens'], labels)
+        metrics.increment('agent_output_tokens', agent_usage['output_tokens'], labels)
+    for call in usage['calls']:
+        metrics.observe('call_input_tokens', call['input_tokens'], {'agent': call['agent']})
+    logger.info(
+        "turn tokens: input=%d output=%d calls=%d cost=$%.6f agents=%s",
+        usage['input_tokens'], usage['output_tokens'], len(usage['calls']), usage['cost'],
+        ','.join(name for name, agent_usage in usage['agents'].items() if agent_usage['calls'])
+    )
+
+# id(agent) -> (its static instructions, their estimated tokens)
+_instruction_token_cache = {}
+
+def instruction_tokens(agent):
+    """Estimated prompt tokens contributed by an agent's instructions.
+
+    Static instructions are measured once per agent. Callable ones are rendered
+    for the current turn, from the FAQ entries already retrieved for its message.
+    """
+    instructions = getattr(agent, 'instructions', None)
+    if callable(instructions):
+        return estimate_tokens(instructions(agent=agent))
+    cached = _instruction_token_cache.get(id(agent))
+    if cached is None or cached[0] is not instructions:
+        text = '\n'.join(instructions) if isinstance(instructions, list) else instructions
+        cached = _instruction_token_cache[id(agent)] = (instructions, estimate_tokens(text))
+    return cached[1]
+
+def estimate_turn_tokens(message):
+    """Lower-bound prompt estimate: the leader runs twice around one sub-agent call"""
+    message_tokens = estimate_tokens(message)
+    agent_team = team_guard.reference
+    leader_tokens = instruction_tokens(agent_team) + message_tokens
+    member_tokens = max((instruction_tokens(agent) for agent in (agent_team.team or [])), default=0)
+    return 2 * leader_tokens + member_tokens + message_tokens
+
+def fallback_response(message):
+    """Answer from the FAQ index (or a canned reply) without calling the model"""
+    faq = faq_reloader.current
+    if faq.embeddings is not None:
+        # Semantic matching also catches paraphrases that share no keywords with the stored question
+        hits = semantic_batcher.submit((faq.embeddings, 1), message)
+        if hits and hits[0][0] >= EMBEDDING_MIN_SCORE:
+            metrics.increment('faq_semantic_matches')
+            return hits[0][1]['answer']
+    answer = faq.index.top_answer(message)
+    if answer:
+        return answer
+    return "I'm unable to look into that in detail right now. Please contact our support team for help."
+
+def over_budget_response(message):
+    """Answer without calling the model when a turn would exceed the token budget"""
+    metrics.increment('token_budget_rejections', labels={'mode': TOKEN_BUDGET_MODE})
+    if TOKEN_BUDGET_MODE == 'fail':
+        return "Sorry, this request is too large for me to handle right now. Please try a shorter question."
+    return fallback_response(message)
+
+def direct_order_response(message):
+    """Render a plain order status lookup without any model call, or return None"""
+    route = route_order_status(message)
+    if route is None:
+        return None
+    email, order_id = route
+    session_id = current_session.get()
+    orders = session_store.cached_orders(session_id, email, order_id)
+    if orders is None:
+        try:
+            orders = fetch_orders(email, order_id)
+        except mysql.connector.Error as e:
+            # Let the agents handle it (and explain the problem) instead
+            logger.warning("direct order lookup failed, falling back to the agents: %s", e)
+            return None
+        session_store.remember_orders(session_id, email, order_id, orders)
+    else:
+        metrics.increment('session_context_hits')
+    return render_order_reply(orders, email, order_id)
+
+def record_direct_render(latency):
+    """Count a turn answered without the model and estimate the time it saved"""
+    metrics.increment('direct_render_turns')
+    # The team leader plus the order agent make at least two model calls for a lookup
+    metrics.increment('model_calls_saved', 2)
+    model_latency = metrics.percentile('turn_latency_seconds', 0.5, {'path': 'model'})
+    if model_latency is not None:
+        metrics.increment('direct_render_seconds_saved', max(0.0, model_latency - latency))
+
+def run_team(message):
+    """Run the agent team once, on a team lent to this attempt alone.
+
+    Retries and hedges get a team of their own too. An attempt abandoned after a
+    hedge or the deadline keeps its team until it finishes in the ResilientCaller
+    pool, so later turns never run on it at the same time.
+    """
+    with team_guard.checkout() as team:
+        member_runs = snapshot_member_runs(team)
+        response = team.run(message)
+        # Read while the team is still ours: its next run replaces every run_response
+        return team, member_responses_since(team, member_runs), response
+
 # Function to process user queries for Gradio
-def process_query(message, history):
+def process_query(message, history, stats=None, session_id=None):
+    """Run one chat turn through the agent team.
+
+    When a stats dict is passed it is filled with the turn's trace id, latency,
+    the model and tool calls, and the sub-agents that were involved. session_id
+    scopes the remembered customer context used by follow-up questions. Every
+    turn is handed to the transcript log, which writes it after the reply.
+    Turns picked by the profiler are sampled, and slow ones leave a flamegraph
+    profile whose path is stats['profile'].
+    """
+    stats = {} if stats is None else stats
+    stats['trace_id'] = uuid.uuid4().hex
+    with profiler.profile_turn(stats['trace_id'], stats):
+        reply = run_turn(message, history, stats, session_id)
+    transcript_sink.record({'ts': time.time(), 'session_id': session_id, 'message': message, 'reply': reply, **stats})
+    return reply
+
+def run_turn(message, history, stats, session_id):
+    start_time = time.perf_counter()
+    path = 'model'
+    # Tools read the session through this context variable, also from the model worker threads
+    session_token = current_session.set(session_id)
+    faq_token = current_faq_context.set({'message': message})
     try:
+        session_store.note_message(session_id, message)
+        if DIRECT_ORDER_RENDERING:
+            direct_text = direct_order_response(message)
+            if direct_text is not None:
+                path = 'direct'
+                record_direct_render(time.perf_counter() - start_time)
+                stats.update(llm_calls=0, tool_calls=1, agents=[])
+                return direct_text
+
+        if TURN_TOKEN_BUDGET and estimate_turn_tokens(message) > TURN_TOKEN_BUDGET:
+            path = 'budget'
+            stats['budget_exceeded'] = True
+            return over_budget_response(message)
+
+        # Look up orders mentioned in the message while the model decides what to do
+        prefetch_orders(message)
+
         # Get the response from the agent
-        response = agent_team.run(message)
+        try:
+            team, members, response = model_caller.call(lambda attempt: run_team(message))
+        except (CircuitOpenError, DeadlineExceededError) as e:
+            logger.warning("serving fallback answer: %s", e)
+            path = 'fallback'
+            metrics.increment('fallback_responses', labels={'reason': type(e).__name__})
+            stats['fallback'] = type(e).__name__
+            return fallback_response(message)
         
         # Extract just the content from the RunResponse object
         if hasattr(response, 'content'):
@@ -300,11 +589,36 @@ def process_query(message, history):
         
         # Clean any agent status messages from the response
         response_text = clean_agent_status(response_text)
+
+        usage = collect_token_usage(team, response, members)
+        record_token_usage(usage)
+        if TURN_TOKEN_BUDGET and usage['total_tokens'] > TURN_TOKEN_BUDGET:
+            metrics.increment('token_budget_overruns')
+            logger.warning("turn used %d tokens, over the budget of %d", usage['total_tokens'], TURN_TOKEN_BUDGET)
+
+        llm_calls, tool_calls = count_calls(response)
+        stats['tokens'] = usage
+        for _, member_response in members:
+            member_llm_calls, member_tool_calls = count_calls(member_response)
+            llm_calls += member_llm_calls
+            tool_calls += member_tool_calls
+        stats['llm_calls'] = llm_calls
+        stats['tool_calls'] = tool_calls
+        stats['agents'] = [name for name, _ in members]
+        stats['tools'] = [tool for run in [response] + [member for _, member in members] for tool in tool_calls_of(run)]
             
         # Return the user message and bot response as a tuple
         return response_text
     except Exception as e:
+        stats['error'] = str(e)
         return f"An error occurred: {e}\nPlease try again with a different query."
+    finally:
+        current_faq_context.reset(faq_token)
+        current_session.reset(session_token)
+        latency = time.perf_counter() - start_time
+        metrics.observe('turn_latency_seconds', latency, {'path': path})
+        stats['latency'] = latency
+        stats['path'] = path
 
 # Create Gradio interface
 def create_gradio_interface():
@@ -370,11 +684,16 @@ def create_gradio_interface():
             # Add user message to history
             return "", history + [[user_message, None]]
         
-        def bot_response(history):
+        def bot_response(history, request: gr.Request):
             # Process the last user message
             if history and history[-1][1] is None:
                 user_message = history[-1][0]
-                bot_message = process_query(user_message, history[:-1])
+                session_id = getattr(request, 'session_hash', None)
+                try:
+                    with admission.admit(session_id):
+                        bot_message = process_query(user_message, history[:-1], session_id=session_id)
+                except AdmissionRejected as e:
+                    bot_message = BUSY_MESSAGES.get(e.reason, BUSY_MESSAGES['queue_full'])
                 history[-1][1] = bot_message
             return history
         
@@ -386,7 +705,10 @@ def create_gradio_interface():
         ).then(
             bot_response,
             inputs=[chatbot],
-            outputs=[chatbot]
+            outputs=[chatbot],
+            # Let requests reach the admission controller, which sheds load instead of queueing it
+            concurrency_limit=ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE,
+            concurrency_id="bot_response"
         )
         
         msg.submit(
@@ -397,7 +719,10 @@ def create_gradio_interface():
         ).then(
             bot_response,
             inputs=[chatbot],
-            outputs=[chatbot]
+            outputs=[chatbot],
+            # Let requests reach the admission controller, which sheds load instead of queueing it
+            concurrency_limit=ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE,
+            concurrency_id="bot_response"
         )
         
         clear.click(lambda: None, None, chatbot, queue=False)
@@ -407,7 +732,17 @@ def create_gradio_interface():
     
     return demo
 
+def log_memory_report():
+    logger.info("memory report: %s", json.dumps(team_guard.report()))
+
 def main():
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    if METRICS_PORT:
+        metrics.start_metrics_server(METRICS_PORT)
+    faq_reloader.start(FAQ_RELOAD_SECONDS)
+    # kill -USR1 <pid> logs a memory report (RSS, agent history, object counts, tracemalloc growth)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=log_memory_report, daemon=True).start())
+
     # Create and launch the Gradio interface
     demo = create_gradio_interface()
     demo.launch(share=True)  # Set share=False in production
@@ -0,0 +1,460 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import mysql.connector
+from dotenv import load_dotenv
+
+import woocommerce_metrics as metrics
+
+load_dotenv()
+
+# Database credentials
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+
+# Queries slower than this (seconds) are written to the slow query log
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.2"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.jsonl")
+# Capture the EXPLAIN plan of every slow query automatically
+DB_EXPLAIN_SLOW = os.getenv("DB_EXPLAIN_SLOW", "").lower() in ("1", "true", "yes")
+# Slow queries waiting for the log writer; beyond this they are dropped and counted
+SLOW_QUERY_QUEUE_SIZE = int(os.getenv("SLOW_QUERY_QUEUE_SIZE", "1000"))
+
+# Read replicas for the bot's read-only tool queries, e.g. "replica1:3306,replica2:3306"
+DB_READ_REPLICAS = os.getenv("DB_READ_REPLICAS", "")
+# Replicas lagging more than this many seconds behind the primary are skipped
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "10"))
+# How long a failed replica is kept out of rotation
+DB_REPLICA_COOLDOWN = float(os.getenv("DB_REPLICA_COOLDOWN", "30"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+
+logger = logging.getLogger("woocommerce_db")
+
+class Endpoint:
+    """A database server with its health, replication lag and latency estimate"""
+
+    def __init__(self, host, port, replica):
+        self.host = host
+        self.port = port
+        self.replica = replica
+        self.name = f"{host}:{port}"
+        self.down_until = 0.0
+        self.lag = None
+        self.lag_checked_at = 0.0
+        self.latency = 0.0
+        self.lock = threading.Lock()
+
+    def available(self, now):
+        if now < self.down_until:
+            return False
+        # A lag measurement older than the check interval no longer counts, so a lagging
+        # replica is picked again, re-measured, and back in rotation once it has caught up
+        return self.lag is None or self.lag <= DB_REPLICA_MAX_LAG or self.lag_due(now)
+
+    def lag_due(self, now):
+        # Strict, so a lag measured at `now` counts even with a check interval of 0
+        return now - self.lag_checked_at > DB_REPLICA_LAG_CHECK_SECONDS
+
+    def record_latency(self, seconds):
+        # Exponentially weighted moving average used for load balancing
+        with self.lock:
+            self.latency = seconds if not self.latency else 0.8 * self.latency + 0.2 * seconds
+
+    def mark_down(self, reason):
+        with self.lock:
+            self.down_until = time.monotonic() + DB_REPLICA_COOLDOWN
+        metrics.increment('db_endpoint_failures', labels={'endpoint': self.name})
+        metrics.set_gauge('db_endpoint_healthy', 0, {'endpoint': self.name})
+        logger.warning("database endpoint %s taken out of rotation: %s", self.name, reason)
+
+def parse_endpoints(spec, default_port):
+    """Parse "host[:port],host[:port]" into replica endpoints"""
+    endpoints = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        host, _, port = item.partition(':')
+        endpoints.append(Endpoint(host, port or default_port or '3306', replica=True))
+    return endpoints
+
+primary = Endpoint(DB_HOST, DB_PORT or '3306', replica=False)
+replicas = parse_endpoints(DB_READ_REPLICAS, DB_PORT)
+_endpoints = {endpoint.name: endpoint for endpoint in [primary] + replicas}
+
+def connect(database=None, endpoint=None):
+    """Open a connection to the WordPress database (the primary unless an endpoint is given)"""
+    endpoint = endpoint or primary
+    return mysql.connector.connect(
+        host=endpoint.host,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=database or DB_NAME,
+        port=endpoint.port,
+        connection_timeout=DB_CONNECT_TIMEOUT
+    )
+
+def replication_lag(connection):
+    """Seconds the replica is behind its source, or None if it cannot be determined"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except mysql.connector.Error:
+            cursor.execute("SHOW SLAVE STATUS")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not row:
+        return None
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    # NULL lag means replication is stopped, which makes the replica unusable
+    return float('inf') if lag is None else float(lag)
+
+def _check_lag(endpoint, connection, now):
+    if not endpoint.lag_due(now):
+        return
+    endpoint.lag_checked_at = now
+    try:
+        endpoint.lag = replication_lag(connection)
+    except mysql.connector.Error as e:
+        # Without REPLICATION CLIENT privilege the lag is unknown; keep serving from the replica
+        logger.debug("could not read replication lag of %s: %s", endpoint.name, e)
+        endpoint.lag = None
+    if endpoint.lag is not None:
+        metrics.set_gauge('db_replica_lag_seconds', endpoint.lag if endpoint.lag != float('inf') else -1,
+                          {'endpoint': endpoint.name})
+
+def choose_replicas(now=None):
+    """Order available replicas: the faster of two random picks first, then the rest by latency"""
+    now = now if now is not None else time.monotonic()
+    candidates = [endpoint for endpoint in replicas if endpoint.available(now)]
+    random.shuffle(candidates)
+    by_latency = lambda endpoint: endpoint.latency
+    return sorted(candidates[:2], key=by_latency) + sorted(candidates[2:], key=by_latency)
+
+def connect_read():
+    """Connect to a healthy, fresh replica, falling back to the primary"""
+    now = time.monotonic()
+    for endpoint in choose_replicas(now):
+        try:
+            connection = connect(endpoint=endpoint)
+        except mysql.connector.Error as e:
+            endpoint.mark_down(e)
+            continue
+        _check_lag(endpoint, connection, now)
+        if endpoint.available(now):
+            metrics.set_gauge('db_endpoint_healthy', 1, {'endpoint': endpoint.name})
+            return connection
+        connection.close()
+        metrics.increment('db_replica_stale_skips', labels={'endpoint': endpoint.name})
+    if replicas:
+        metrics.increment('db_replica_fallbacks')
+    return connect()
+
+def read_query(name, query, params=(), dictionary=False):
+    """Run a read-only tool query on a replica, retrying on the primary if the replica fails"""
+    connection = connect_read()
+    try:
+        return fetch_all(connection, name, query, params, dictionary=dictionary)
+    except mysql.connector.Error as e:
+        endpoint = _endpoints.get(endpoint_name(connection))
+        if endpoint is None or not endpoint.replica:
+            raise
+        endpoint.mark_down(e)
+        metrics.increment('db_replica_fallbacks')
+    finally:
+        connection.close()
+
+    connection = connect()
+    try:
+        return fetch_all(connection, name, query, params, dictionary=dictionary)
+    finally:
+        connection.close()
+
+def endpoint_name(connection):
+    """host:port label of the server behind a connection"""
+    return f"{getattr(connection, 'server_host', DB_HOST)}:{getattr(connection, 'server_port', DB_PORT or '3306')}"
+
+def order_status_query(email=None, order_id=None):
+    """Build the order lookup used by get_order_status"""
+    query = """
+    SELECT
+        p.ID as order_id,
+        p.post_status as order_status,
+        p.post_date as order_date,
+        MAX(CASE WHEN pm.meta_key = '_billing_first_name' THEN pm.meta_value END) as first_name,
+        MAX(CASE WHEN pm.meta_key = '_billing_last_name' THEN pm.meta_value END) as last_name,
+        MAX(CASE WHEN pm.meta_key = '_order_total' THEN pm.meta_value END) as total
+    FROM
+        wp_posts p
+    JOIN wp_postmeta pm ON p.ID = pm.post_id
+    WHERE
+        p.post_type = 'shop_order'
+    """
+
+    params = []
+    if order_id:
+        query += " AND p.ID = %s"
+        params.append(order_id)
+    if email:
+        query += " AND p.ID IN (SELECT post_id FROM wp_postmeta WHERE meta_key = '_billing_email' AND meta_value = %s)"
+        params.append(email)
+
+    query += " GROUP BY p.ID ORDER BY p.post_date DESC LIMIT 5"
+    return query, params
+
+def product_search_query(product_name):
+    """Build the title search used by search_products, with price, stock status and SKU pivoted in"""
+    query = """
+    SELECT
+        p.ID,
+        p.post_title,
+        p.post_name,
+        MAX(CASE WHEN pm.meta_key = '_price' THEN pm.meta_value END) as price,
+        MAX(CASE WHEN pm.meta_key = '_stock_status' THEN pm.meta_value END) as stock_status,
+        MAX(CASE WHEN pm.meta_key = '_sku' THEN pm.meta_value END) as sku
+    FROM
+        (
+            SELECT ID, post_title, post_name
+            FROM wp_posts
+            WHERE
+                post_type = 'product'
+                AND post_status = 'publish'
+                AND post_title LIKE %s
+            LIMIT 10
+        ) p
+    LEFT JOIN wp_postmeta pm
+        ON pm.post_id = p.ID AND pm.meta_key IN ('_price', '_stock_status', '_sku')
+    GROUP BY p.ID, p.post_title, p.post_name
+    """
+    # Add wildcards for the LIKE query
+    return query, (f"%{product_name}%",)
+
+def fingerprint(query):
+    """Normalize a statement so different literals group together"""
+    text = re.sub(r"'(?:[^'\\]|\\.)*'", "?", query)
+    text = re.sub(r"\b\d+\b", "?", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip().rstrip(';')
+
+def params_shape(params):
+    """Describe parameters by type and size without logging customer data"""
+    shape = []
+    for value in params or ():
+        if isinstance(value, str):
+            shape.append(f"str({len(value)})")
+        elif isinstance(value, (list, tuple)):
+            shape.append(f"{type(value).__name__}({len(value)})")
+        else:
+            shape.append(type(value).__name__)
+    return shape
+
+def explain(connection, query, params=()):
+    """Return the EXPLAIN plan of a statement as a list of dicts"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute(f"EXPLAIN {query}", params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+class SlowQueryLog:
+    """Slow query entries appended to a JSONL file by a writer thread, off the request path.
+
+    record() only queues the entry. The writer captures the EXPLAIN plan when asked
+    to, on a connection of its own to the server that ran the query, and appends
+    the line. When the queue is full an entry is dropped and counted, so a slow
+    disk or a slow EXPLAIN never holds up a tool call.
+    """
+
+    def __init__(self, path=SLOW_QUERY_LOG, queue_size=SLOW_QUERY_QUEUE_SIZE):
+        self.path = path
+        self.queue_size = queue_size
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+    def _start(self):
+        # Lazily, and again after a fork: the writer thread doesn't survive it
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.thread = threading.Thread(target=self._run, name='slow-query-writer', daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+            self.pid = os.getpid()
+
+    def record(self, entry, explain_on=None):
+        """Queue an entry; explain_on=(endpoint name, database, query, params) also captures its plan"""
+        if not self.path:
+            return False
+        if self.pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait((entry, explain_on))
+        except queue.Full:
+            metrics.increment('db_slow_queries_dropped')
+            return False
+        return True
+
+    def _explain(self, entry, endpoint_label, database, query, params):
+        try:
+            connection = connect(database, endpoint=_endpoints.get(endpoint_label))
+            try:
+                entry['explain'] = explain(connection, query, params)
+            finally:
+                connection.close()
+        except mysql.connector.Error as e:
+            entry['explain_error'] = str(e)
+
+    def _run(self):
+        while True:
+            entry, explain_on = self.queue.get()
+            try:
+                if explain_on is not None:
+                    self._explain(entry, *explain_on)
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(entry, default=str) + '\n')
+            except Exception as e:
+                metrics.increment('db_slow_query_log_errors')
+                logger.error("Writing the slow query log failed: %s", e)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until every queued entry is written"""
+        if self.pid == os.getpid():
+            self.queue.join()
+
+slow_query_log = SlowQueryLog()
+
+def fetch_all(connection, name, query, params=(), dictionary=False, capture_explain=False):
+    """Execute a tool query, time it and return all rows.
+
+    Queries slower than SLOW_QUERY_SECONDS are logged with the shape of their
+    parameters; their EXPLAIN plan is captured when DB_EXPLAIN_SLOW is set or
+    capture_explain is requested. The log is written by slow_query_log's thread.
+    """
+    cursor = connection.cursor(dictionary=dictionary)
+    start_time = time.perf_counter()
+    try:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    except mysql.connector.Error:
+        metrics.increment('db_query_errors', labels={'query': name})
+        metrics.increment('db_endpoint_errors', labels={'endpoint': endpoint_name(connection)})
+        raise
+    finally:
+        elapsed = time.perf_counter() - start_time
+        cursor.close()
+
+    endpoint = endpoint_name(connection)
+    if endpoint in _endpoints:
+        _endpoints[endpoint].record_latency(elapsed)
+    metrics.observe('db_query_seconds', elapsed, {'query': name})
+    metrics.observe('db_endpoint_latency_seconds', elapsed, {'endpoint': endpoint})
+    metrics.increment('db_queries', labels={'query': name})
+
+    if elapsed >= SLOW_QUERY_SECONDS or capture_explain:
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'name': name,
+            'seconds': round(elapsed, 6),
+            'rows': len(rows),
+            'params': params_shape(params),
+            'statement': fingerprint(query),
+        }
+        if elapsed >= SLOW_QUERY_SECONDS:
+            metrics.increment('db_slow_queries', labels={'query': name})
+            logger.warning("slow query %s took %.3fs (%d rows, params %s)", name, elapsed, len(rows), entry['params'])
+        if DB_EXPLAIN_SLOW or capture_explain:
+            explain_on = (endpoint, getattr(connection, 'database', None), query, params)
+        else:
+            explain_on = None
+        slow_query_log.record(entry, explain_on)
+    return rows
+
+def read_slow_log(path):
+    """Read slow query log entries, skipping malformed lines"""
+    entries = []
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        print(f"Error: slow query log '{path}' not found.")
+    return entries
+
+def summarize_slow_log(entries, top=10):
+    """Group slow log entries by statement and rank them by total time"""
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault((entry['name'], entry['statement']), {
+            'name': entry['name'],
+            'statement': entry['statement'],
+            'seconds': [],
+            'rows': 0,
+            'explain': None,
+        })
+        group['seconds'].append(entry['seconds'])
+        group['rows'] += entry.get('rows', 0)
+        if entry.get('explain'):
+            group['explain'] = entry['explain']
+
+    summary = []
+    for group in groups.values():
+        seconds = sorted(group['seconds'])
+        summary.append({
+            'name': group['name'],
+            'statement': group['statement'],
+            'count': len(seconds),
+            'total_seconds': round(sum(seconds), 3),
+            'p95_seconds': seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))],
+            'max_seconds': seconds[-1],
+            'avg_rows': round(group['rows'] / len(seconds), 1),
+            'explain': group['explain'],
+        })
+    summary.sort(key=lambda item: item['total_seconds'], reverse=True)
+    return summary[:top]
+
+def print_report(summary):
+    """Print the worst statements with their last captured plan"""
+    if not summary:
+        print("No slow queries recorded.")
+        return
+    for rank, item in enumerate(summary, 1):
+        print(f"{rank}. {item['name']}: {item['count']} slow runs, total {item['total_seconds']}s, "
+              f"p95 {item['p95_seconds']}s, max {item['max_seconds']}s, avg rows {item['avg_rows']}")
+        print(f"   {item['statement'][:200]}")
+        for step in item['explain'] or []:
+            print(f"   plan: table={step.get('table')} type={step.get('type')} key={step.get('key')} "
+                  f"rows={step.get('rows')} extra={step.get('Extra')}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the bot's slow tool queries")
+    parser.add_argument('command', choices=['report'], help="What to do")
+    parser.add_argument('--log', default=SLOW_QUERY_LOG, help="Slow query log to read")
+    parser.add_argument('--top', type=int, default=10, help="Number of statements to show")
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        print_report(summarize_slow_log(read_slow_log(args.log), top=args.top))
+
+if __name__ == "__main__":
+    main()
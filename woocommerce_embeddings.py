@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import zlib
+
+import numpy as np
+
+from woocommerce_ann import IvfIndex
+from woocommerce_faq_search import STOP_WORDS, FaqIndex
+
+# Paraphrase groups common in shop support questions; every word maps to the group's first word
+SYNONYM_GROUPS = [
+    ['return', 'send back', 'give back', 'returns', 'returning'],
+    ['refund', 'money back', 'reimburse', 'reimbursement', 'refunds'],
+    ['cancel', 'call off', 'cancellation', 'withdraw'],
+    ['ship', 'shipping', 'deliver', 'delivery', 'dispatch', 'dispatched', 'courier', 'shipment'],
+    ['order', 'purchase', 'bought', 'orders'],
+    ['pay', 'payment', 'paying', 'checkout'],
+    ['price', 'cost', 'charge', 'charges', 'fee', 'fees'],
+    ['change', 'modify', 'update', 'edit'],
+    ['account', 'profile', 'login', 'sign in'],
+    ['password', 'passcode', 'pin'],
+    ['contact', 'reach', 'call', 'email', 'support'],
+    ['damaged', 'broken', 'defective', 'faulty'],
+    ['time', 'long', 'days', 'when'],
+    ['address', 'location'],
+    ['product', 'item', 'items', 'products'],
+]
+SYNONYMS = {word: group[0] for group in SYNONYM_GROUPS for word in group}
+PHRASE_PATTERN = re.compile(r"\b(" + "|".join(
+    re.escape(phrase) for phrase in sorted((word for word in SYNONYMS if ' ' in word), key=len, reverse=True)
+) + r")\b")
+
+# Embedding dimension and storage type of the persisted vectors
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "512"))
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float16")
+# Above this many rows, queries go through an IVF index instead of scoring every vector
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "50000"))
+# Share of an entry's vector that comes from its answer rather than its question
+ANSWER_WEIGHT = 0.3
+
+class HashingEmbedder:
+    """Deterministic CPU-only text embedder.
+
+    Words (after synonym folding), word bigrams and character trigrams are hashed
+    into a fixed number of signed buckets and the vector is L2-normalized. Trigrams
+    make it tolerant of typos and inflections; synonym folding covers the common
+    paraphrases a purely lexical match misses.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        # Stored with the index; vectors from a different embedder are never reused
+        self.signature = f"hashing-v1-{dim}-{ANSWER_WEIGHT}"
+
+    def features(self, text):
+        # Fold phrases after dropping stop words, so "send it back" matches "send back"
+        text = ' '.join(word for word in re.findall(r"[a-z0-9]+", (text or '').lower()) if word not in STOP_WORDS)
+        text = PHRASE_PATTERN.sub(lambda match: SYNONYMS[match.group(0)], text)
+        words = [SYNONYMS.get(word, word) for word in text.split()]
+        features = [(f"w:{word}", 1.0) for word in words]
+        features += [(f"b:{first} {second}", 0.5) for first, second in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [(f"c:{padded[i:i + 3]}", 0.25) for i in range(len(padded) - 2)]
+        return features
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self.features(text):
+            bucket = zlib.crc32(feature.encode('utf-8'))
+            vector[bucket % self.dim] += weight if bucket & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_batch(self, texts):
+        return np.vstack([self.embed(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+def content_hash(entry):
+    return hashlib.sha1(f"{entry['question']}\t{entry['answer']}".encode('utf-8')).hexdigest()
+
+def embed_entry(embedder, entry):
+    # The question carries the intent; the answer only adds vocabulary customers may use
+    vector = embedder.embed(entry['question']) + ANSWER_WEIGHT * embedder.embed(entry['answer'])
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+class EmbeddingIndex:
+    """FAQ vectors in a memory-mapped matrix (`<path>.vectors`) with row hashes in `<path>.json`"""
+
+    def __init__(self, path, embedder=None, dtype=EMBEDDING_DTYPE):
+        self.path = path
+        self.embedder = embedder or HashingEmbedder()
+        self.dtype = np.dtype(dtype)
+        self.hashes = []
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=self.dtype)
+        self.ann = None
+        self._open()
+
+    def _open(self):
+        try:
+            with open(f"{self.path}.json") as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return
+        if meta.get('embedder') != self.embedder.signature or meta.get('dtype') != self.dtype.name or not meta.get('hashes'):
+            return
+        self.hashes = meta['hashes']
+        self.vectors = np.memmap(f"{self.path}.vectors", dtype=self.dtype, mode='r',
+                                 shape=(len(self.hashes), self.embedder.dim))
+        if len(self.hashes) >= ANN_MIN_ROWS:
+            ann = IvfIndex.load(self.path)
+            self.ann = ann if ann is not None and len(ann) == len(self.hashes) else None
+
+    def _build_ann(self, previous):
+        """Re-assign all rows to the previous centroids; re-cluster only once the data has doubled"""
+        if previous is not None and len(self.hashes) <= 2 * previous.trained_rows:
+            ann = IvfIndex.from_centroids(previous)
+        else:
+            vectors = np.asarray(self.vectors, dtype=np.float32)
+            ann = IvfIndex(self.embedder.dim, nlist=int(4 * np.sqrt(len(self.hashes)))).train(vectors)
+        for start in range(0, len(self.hashes), 100000):
+            chunk = np.asarray(self.vectors[start:start + 100000], dtype=np.float32)
+            ann.add(chunk, np.arange(start, start + len(chunk)))
+        ann.save(self.path)
+        self.ann = ann
+
+    def build(self, entries):
+        """Bring the index in line with entries, embedding only rows whose content changed.
+
+        Returns (embedded, reused) row counts.
+        """
+        hashes = [content_hash(entry) for entry in entries]
+        if hashes and hashes == self.hashes and (len(hashes) < ANN_MIN_ROWS or self.ann is not None):
+            # Nothing changed (e.g. a restart): keep the mapped files instead of rewriting them
+            return 0, len(hashes)
+        known = {row_hash: position for position, row_hash in enumerate(self.hashes)}
+        missing = [position for position, row_hash in enumerate(hashes) if row_hash not in known]
+        new_vectors = [embed_entry(self.embedder, entries[position]) for position in missing]
+
+        # Write the new matrix beside the old one and swap it in, so a mapped index stays valid
+        temp_path = f"{self.path}.vectors.tmp"
+        matrix = np.memmap(temp_path, dtype=self.dtype, mode='w+', shape=(max(1, len(hashes)), self.embedder.dim))
+        for position, row_hash in enumerate(hashes):
+            if row_hash in known:
+                matrix[position] = self.vectors[known[row_hash]]
+        if missing:
+            matrix[missing] = np.vstack(new_vectors).astype(self.dtype)
+        matrix.flush()
+        del matrix
+        os.replace(temp_path, f"{self.path}.vectors")
+        with open(f"{self.path}.json.tmp", 'w') as file:
+            json.dump({'embedder': self.embedder.signature, 'dtype': self.dtype.name, 'hashes': hashes}, file)
+        os.replace(f"{self.path}.json.tmp", f"{self.path}.json")
+        previous_ann, changed = self.ann, hashes != self.hashes
+        self.hashes = []
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=self.dtype)
+        self.ann = None
+        self._open()
+        if len(self.hashes) >= ANN_MIN_ROWS and (changed or self.ann is None):
+            self._build_ann(previous_ann or self.ann)
+        return len(missing), len(hashes) - len(missing)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def search_batch(self, queries, top_k=3):
+        """Return, per query, up to top_k (score, position) pairs by cosine similarity"""
+        if not len(self) or not queries:
+            return [[] for _ in queries]
+        query_matrix = self.embedder.embed_batch(queries)
+        if self.ann is not None:
+            scores, positions = self.ann.search(query_matrix, top_k)
+            return [
+                [(float(score), int(position)) for score, position in zip(scores[row], positions[row]) if position >= 0]
+                for row in range(len(queries))
+            ]
+        scores = query_matrix @ np.asarray(self.vectors, dtype=np.float32).T
+        top_k = min(top_k, scores.shape[1])
+        best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        results = []
+        for row, candidates in enumerate(best):
+            ordered = candidates[np.argsort(-scores[row, candidates], kind='stable')]
+            results.append([(float(scores[row, position]), int(position)) for position in ordered])
+        return results
+
+    def search(self, query, top_k=3):
+        return self.search_batch([query], top_k)[0]
+
+# Rewrites for the benchmark that the embedder was not built with: no word here is in SYNONYM_GROUPS
+HELD_OUT_GROUPS = [
+    ['get', 'receive', 'obtain'],
+    ['have', 'possess'],
+    ['place', 'make', 'submit'],
+    ['placed', 'made', 'submitted'],
+    ['request', 'ask for'],
+    ['offer', 'provide', 'sell'],
+    ['take', 'need'],
+    ['track', 'follow', 'trace'],
+    ['know', 'find out', 'learn'],
+    ['service', 'assistance'],
+    ['available', 'in stock'],
+    ['problem', 'issue', 'trouble'],
+    ['gift', 'present'],
+    ['delay', 'hold up'],
+    ['bulk', 'wholesale', 'large quantity'],
+    ['outside', 'beyond'],
+    ['choose', 'pick', 'select'],
+    ['find', 'locate'],
+]
+
+def noisy_paraphrase(question, rng, groups=SYNONYM_GROUPS):
+    """A harder paraphrase than the eval variants: word swaps within `groups`, dropped words and a typo"""
+    words = re.findall(r"[A-Za-z0-9']+", question.lower())
+    group_of = {word: group for group in groups for word in group}
+    rewritten = []
+    for word in words:
+        group = group_of.get(word)
+        if group and rng.random() < 0.7:
+            word = rng.choice(group)
+        elif word in STOP_WORDS and rng.random() < 0.3:
+            continue
+        rewritten.append(word)
+    longest = max(range(len(rewritten)), key=lambda i: len(rewritten[i]), default=None)
+    if longest is not None and len(rewritten[longest]) > 4:
+        word = rewritten[longest]
+        cut = rng.randrange(1, len(word) - 2)
+        rewritten[longest] = word[:cut] + word[cut + 1] + word[cut] + word[cut + 2:]
+    return ' '.join(rewritten)
+
+def run_benchmark(faq_data, path, variants=3, seed=7):
+    overlap = {word for group in HELD_OUT_GROUPS for word in group} & set(SYNONYMS)
+    if overlap:
+        raise ValueError(f"held-out rewrites overlap the embedder's synonyms: {sorted(overlap)}")
+
+    entries = list(faq_data)
+    index = EmbeddingIndex(path)
+    start_time = time.perf_counter()
+    embedded, reused = index.build(entries)
+    print(f"built {len(index)} vectors in {(time.perf_counter() - start_time) * 1000:.1f}ms "
+          f"({embedded} embedded, {reused} reused), {index.vectors.nbytes / 1024:.0f} KiB {index.dtype.name}")
+    start_time = time.perf_counter()
+    embedded, reused = index.build(entries)
+    print(f"rebuild without changes: {(time.perf_counter() - start_time) * 1000:.1f}ms ({embedded} embedded)")
+
+    lexical = FaqIndex(entries)
+    by_question = {entry['question']: position for position, entry in enumerate(entries)}
+    def lexical_search(text, top_k):
+        return [by_question[entry['question']] for _, entry in lexical.search(text, top_k)]
+
+    # The embedder folds SYNONYM_GROUPS, so paraphrases built from them only give an upper bound;
+    # the held-out rewrites are words it has no special knowledge of
+    for label, groups in [('held-out rewrites', HELD_OUT_GROUPS),
+                          ("embedder's own synonyms (upper bound)", SYNONYM_GROUPS)]:
+        rng = random.Random(seed)
+        queries = [(position, noisy_paraphrase(entry['question'], rng, groups))
+                   for position, entry in enumerate(entries) for _ in range(variants)]
+        texts = [text for _, text in queries]
+
+        start_time = time.perf_counter()
+        lexical_hits = [lexical_search(text, 3) for text in texts]
+        lexical_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        single_hits = [[position for _, position in index.search(text, 3)] for text in texts]
+        single_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        batch_hits = [[position for _, position in hits] for hits in index.search_batch(texts, 3)]
+        batch_seconds = time.perf_counter() - start_time
+        assert batch_hits == single_hits
+
+        print(f"{len(queries)} noisy paraphrases of {len(entries)} FAQ questions, {label}")
+        for name, hits, seconds in [('lexical tf-idf', lexical_hits, lexical_seconds),
+                                    ('embedding', single_hits, single_seconds),
+                                    ('embedding batched', batch_hits, batch_seconds)]:
+            recall_1 = sum(hit[:1] == [expected] for hit, (expected, _) in zip(hits, queries)) / len(queries)
+            recall_3 = sum(expected in hit for hit, (expected, _) in zip(hits, queries)) / len(queries)
+            print(f"{name:>18}: recall@1 {recall_1:.3f}, recall@3 {recall_3:.3f}, "
+                  f"{seconds / len(queries) * 1e6:8.1f}us/query")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the FAQ embedding index or benchmark it against lexical search")
+    parser.add_argument('--faq', default='faq.csv', help="Tab-separated question/answer file")
+    parser.add_argument('--index', default='faq_embeddings', help="Index path prefix")
+    parser.add_argument('--benchmark', action='store_true', help="Report recall and latency on noisy paraphrases")
+    args = parser.parse_args()
+
+    from woocommerce_faq_store import FaqStore
+    faq_data = FaqStore.from_csv(args.faq)
+    if args.benchmark:
+        run_benchmark(faq_data, args.index)
+    else:
+        embedded, reused = EmbeddingIndex(args.index).build(list(faq_data))
+        print(f"{args.index}: {embedded} rows embedded, {reused} reused")
+
+if __name__ == "__main__":
+    main()
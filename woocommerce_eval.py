@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from woocommerce_faq_search import answer_similarity, tokenize
+
+def paraphrase_variants(question):
+    """Build deterministic paraphrases of an FAQ question"""
+    plain = question.strip().rstrip('?').strip()
+    variants = [
+        ('original', question),
+        ('lowercase', plain.lower()),
+        ('polite', f"Hi, could you please tell me: {plain[:1].lower() + plain[1:]}?"),
+        ('keywords', ' '.join(tokenize(question))),
+    ]
+    # Drop variants that collapse to the same text (e.g. very short questions)
+    seen = set()
+    unique = []
+    for name, text in variants:
+        if text and text not in seen:
+            seen.add(text)
+            unique.append((name, text))
+    return unique
+
+def build_cases(faq_data, with_variants=True):
+    """Expand FAQ rows into evaluation cases"""
+    cases = []
+    for position, entry in enumerate(faq_data):
+        variants = paraphrase_variants(entry['question']) if with_variants else [('original', entry['question'])]
+        for variant, text in variants:
+            cases.append({
+                'id': position,
+                'variant': variant,
+                'question': text,
+                'expected': entry['answer'],
+            })
+    return cases
+
+def run_case(bot, case, threshold):
+    """Run a single case through process_query and score the answer.
+
+    Cases run in parallel: each turn gets an agent team of its own from the bot's
+    pool, and each case its own session so no remembered customer context leaks between cases.
+    """
+    stats = {}
+    answer = bot.process_query(case['question'], [], stats=stats, session_id=f"eval-{case['id']}-{case['variant']}")
+    agreement = answer_similarity(answer, case['expected'])
+    return {
+        'id': case['id'],
+        'variant': case['variant'],
+        'question': case['question'],
+        'latency_ms': round(stats.get('latency', 0.0) * 1000, 1),
+        'llm_calls': stats.get('llm_calls', 0),
+        'tool_calls': stats.get('tool_calls', 0),
+        'total_tokens': stats.get('tokens', {}).get('total_tokens', 0),
+        'agents': stats.get('agents', []),
+        'path': stats.get('path'),
+        'agreement': round(agreement, 3),
+        'agrees': agreement >= threshold,
+        'error': stats.get('error'),
+    }
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(results):
+    """Aggregate per-case results into run level numbers"""
+    latencies = [r['latency_ms'] for r in results]
+    return {
+        'cases': len(results),
+        'agreement_rate': round(sum(r['agrees'] for r in results) / len(results), 3) if results else 0.0,
+        'mean_agreement': round(statistics.mean(r['agreement'] for r in results), 3) if results else 0.0,
+        'errors': sum(1 for r in results if r['error']),
+        'latency_p50_ms': percentile(latencies, 0.50),
+        'latency_p95_ms': percentile(latencies, 0.95),
+        'latency_max_ms': max(latencies) if latencies else 0.0,
+        'llm_calls': sum(r['llm_calls'] for r in results),
+        'tool_calls': sum(r['tool_calls'] for r in results),
+        'total_tokens': sum(r['total_tokens'] for r in results),
+        'direct_turns': sum(1 for r in results if r['path'] == 'direct'),
+    }
+
+def compare_reports(previous, current):
+    """Print the differences between two evaluation reports"""
+    print("Summary changes:")
+    for key, value in current['summary'].items():
+        old_value = previous['summary'].get(key)
+        if old_value != value:
+            print(f"  {key}: {old_value} -> {value}")
+
+    old_results = {(r['id'], r['variant']): r for r in previous['results']}
+    flipped = []
+    for result in current['results']:
+        old = old_results.get((result['id'], result['variant']))
+        if old and old['agrees'] != result['agrees']:
+            flipped.append((result, old))
+    print(f"Cases that changed agreement: {len(flipped)}")
+    for result, old in flipped:
+        state = "now agrees" if result['agrees'] else "no longer agrees"
+        print(f"  #{result['id']} [{result['variant']}] {state} ({old['agreement']} -> {result['agreement']}): {result['question']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every FAQ question through the bot and score the answers")
+    parser.add_argument('--faq', default='faq.csv', help="Tab-separated FAQ file to evaluate")
+    parser.add_argument('--workers', type=int, default=4, help="Number of questions evaluated in parallel")
+    parser.add_argument('--stub', action='store_true', help="Use the offline stub model instead of Gemini")
+    parser.add_argument('--stub-latency', type=float, default=0.0, help="Artificial latency per stub call in seconds")
+    parser.add_argument('--no-variants', action='store_true', help="Only evaluate the original questions")
+    parser.add_argument('--limit', type=int, default=0, help="Only evaluate the first N FAQ rows")
+    parser.add_argument('--threshold', type=float, default=0.5, help="Agreement score that counts as a match")
+    parser.add_argument('--output', default='eval_report.json', help="Where to write the JSON report")
+    parser.add_argument('--compare', help="Previous report to diff the new run against")
+    args = parser.parse_args()
+
+    if args.stub:
+        os.environ['BOT_STUB_MODEL'] = '1'
+        os.environ['BOT_STUB_LATENCY'] = str(args.stub_latency)
+
+    # Imported late so the stub settings are picked up when the agents are built
+    import woocommerce_bot as bot
+
+    faq_data = bot.load_faq(args.faq)
+    if args.limit:
+        faq_data = faq_data[:args.limit]
+    cases = build_cases(faq_data, with_variants=not args.no_variants)
+    print(f"Evaluating {len(cases)} cases from {len(faq_data)} FAQ rows with {args.workers} workers...")
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda case: run_case(bot, case, args.threshold), cases))
+    wall_time = time.perf_counter() - start_time
+
+    results.sort(key=lambda r: (r['id'], r['variant']))
+    report = {
+        'config': {
+            'faq': args.faq,
+            'model': 'stub' if args.stub else 'gemini',
+            'variants': not args.no_variants,
+            'threshold': args.threshold,
+            'workers': args.workers,
+        },
+        'summary': summarize(results),
+        'results': results,
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+    summary = report['summary']
+    print(f"Finished in {wall_time:.1f}s ({len(cases) / wall_time:.1f} cases/s)")
+    print(f"Agreement: {summary['agreement_rate']:.1%} (mean score {summary['mean_agreement']})")
+    print(f"Latency p50/p95: {summary['latency_p50_ms']}ms / {summary['latency_p95_ms']}ms")
+    print(f"Model calls: {summary['llm_calls']}, tool calls: {summary['tool_calls']}, errors: {summary['errors']}")
+    print(f"Tokens: {summary['total_tokens']}")
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare_reports(json.load(file), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+import argparse
+import logging
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+
+import woocommerce_db
+import woocommerce_metrics as metrics
+from woocommerce_products import Product
+from woocommerce_snapshots import load_snapshot, pack_strings, save_snapshot, unpack_strings
+
+load_dotenv()
+
+# How often the facet index catches up with product changes (seconds)
+FACET_REFRESH_SECONDS = float(os.getenv("FACET_REFRESH_SECONDS", "300"))
+# Snapshot file the index is saved to after each refresh and loaded from on startup (unset disables)
+FACET_SNAPSHOT = os.getenv("FACET_SNAPSHOT")
+# Bump when the arrays written by FacetIndex.save change
+FACET_SNAPSHOT_SCHEMA = 1
+
+logger = logging.getLogger("woocommerce_facets")
+
+EMPTY = np.empty(0, dtype=np.int32)
+
+def normalize_value(text):
+    """Lowercase facet value with a trailing plural 's' removed"""
+    value = re.sub(r"[^a-z0-9]+", "-", (text or '').lower()).strip('-')
+    if len(value) > 3 and value.endswith('s') and not value.endswith('ss'):
+        value = value[:-1]
+    return value
+
+def facet_name(taxonomy):
+    """Map a WooCommerce taxonomy to a facet name: product_cat -> category, pa_color -> color"""
+    if taxonomy == 'product_cat':
+        return 'category'
+    return taxonomy[3:] if taxonomy.startswith('pa_') else taxonomy
+
+class FacetIndex:
+    """Sorted position arrays per (facet, value) for fast conjunctive product filtering.
+
+    Only one refresh writes the index at a time (refresh() holds its lock). A write
+    builds new lists and arrays on the side and swaps all of them in under `lock`,
+    so a query reads either the old or the new index, never half of each. Positions
+    are never reused, so a position read from one version names the same product in
+    any later one.
+    """
+
+    def __init__(self):
+        self.positions = {}
+        self.ids = []
+        self.titles = []
+        self.search_titles = []
+        self.slugs = []
+        self.prices = np.empty(0, dtype=np.float64)
+        self.stock = []
+        self.alive = np.empty(0, dtype=bool)
+        self.product_keys = []
+        self.postings = {}
+        self.watermark = None
+        # Products already applied with post_modified == watermark; the next refresh reads
+        # that second again (rows saved later in the same second) and skips these
+        self.watermark_ids = set()
+        self.lock = threading.Lock()
+
+    def _merged_postings(self, added, removed):
+        postings = dict(self.postings)
+        for key in set(added) | set(removed):
+            current = postings.get(key, EMPTY)
+            if key in removed:
+                current = np.setdiff1d(current, np.array(removed[key], dtype=np.int32), assume_unique=True)
+            if key in added:
+                current = np.union1d(current, np.array(added[key], dtype=np.int32)).astype(np.int32)
+            if len(current):
+                postings[key] = current
+            else:
+                postings.pop(key, None)
+        return postings
+
+    def apply_changes(self, products, terms_by_id, meta_by_id):
+        """Insert, update or retire products; only the touched posting arrays are rebuilt"""
+        added, removed = {}, {}
+        positions = dict(self.positions)
+        ids, titles, search_titles = list(self.ids), list(self.titles), list(self.search_titles)
+        slugs, stock, product_keys = list(self.slugs), list(self.stock), list(self.product_keys)
+        watermark, watermark_ids = self.watermark, set(self.watermark_ids)
+        new_prices = []
+        price_updates = {}
+        for product_id, title, slug, status, modified in products:
+            position = positions.get(product_id)
+            if position is None:
+                if status != 'publish':
+                    continue
+                position = len(ids)
+                positions[product_id] = position
+                ids.append(product_id)
+                titles.append(title)
+                search_titles.append(title.lower())
+                slugs.append(slug)
+                stock.append(None)
+                product_keys.append(())
+                new_prices.append(np.nan)
+            for key in product_keys[position]:
+                removed.setdefault(key, []).append(position)
+            product_keys[position] = ()
+            if modified is not None:
+                if watermark is None or modified > watermark:
+                    watermark, watermark_ids = modified, {product_id}
+                elif modified == watermark:
+                    watermark_ids.add(product_id)
+            if status != 'publish':
+                continue
+
+            meta = meta_by_id.get(product_id, {})
+            keys = {(facet_name(taxonomy), normalize_value(value)) for taxonomy, value in terms_by_id.get(product_id, ())}
+            if meta.get('stock_status'):
+                keys.add(('stock', normalize_value(meta['stock_status'])))
+            product_keys[position] = tuple(keys)
+            for key in keys:
+                added.setdefault(key, []).append(position)
+            titles[position] = title
+            search_titles[position] = title.lower()
+            slugs[position] = slug
+            stock[position] = meta.get('stock_status')
+            price_updates[position] = _to_float(meta.get('price'))
+
+        prices = np.concatenate([self.prices, np.array(new_prices, dtype=np.float64)])
+        alive = np.concatenate([self.alive, np.ones(len(new_prices), dtype=bool)])
+        for position, price in price_updates.items():
+            prices[position] = price
+        for product_id, _, _, status, _ in products:
+            position = positions.get(product_id)
+            if position is not None:
+                alive[position] = status == 'publish'
+        postings = self._merged_postings(added, removed)
+        # Swap everything in at once so concurrent queries see a consistent index
+        with self.lock:
+            self.positions, self.ids, self.titles, self.search_titles = positions, ids, titles, search_titles
+            self.slugs, self.stock, self.product_keys = slugs, stock, product_keys
+            self.prices, self.alive, self.postings = prices, alive, postings
+            self.watermark, self.watermark_ids = watermark, watermark_ids
+
+    def apply_meta(self, meta_by_id):
+        """Update prices and stock statuses that changed without a post_modified bump.
+
+        WooCommerce writes stock decrements and many price changes straight to
+        wp_postmeta, so the watermark never sees them. Returns how many products changed.
+        """
+        prices, stock, product_keys = None, None, None
+        added, removed = {}, {}
+        changed = 0
+        for product_id, meta in meta_by_id.items():
+            position = self.positions.get(product_id)
+            if position is None or not self.alive[position]:
+                continue
+            price, old_price = _to_float(meta.get('price')), self.prices[position]
+            price_changed = not (price == old_price or (np.isnan(price) and np.isnan(old_price)))
+            stock_changed = meta.get('stock_status') != self.stock[position]
+            if price_changed:
+                if prices is None:
+                    prices = self.prices.copy()
+                prices[position] = price
+            if stock_changed:
+                if stock is None:
+                    stock, product_keys = list(self.stock), list(self.product_keys)
+                stock[position] = meta.get('stock_status')
+                keys = [key for key in product_keys[position] if key[0] != 'stock']
+                for key in product_keys[position]:
+                    if key[0] == 'stock':
+                        removed.setdefault(key, []).append(position)
+                if stock[position]:
+                    key = ('stock', normalize_value(stock[position]))
+                    keys.append(key)
+                    added.setdefault(key, []).append(position)
+                product_keys[position] = tuple(keys)
+            changed += price_changed or stock_changed
+        if not changed:
+            return 0
+        postings = self._merged_postings(added, removed)
+        with self.lock:
+            if prices is not None:
+                self.prices = prices
+            if stock is not None:
+                self.stock, self.product_keys = stock, product_keys
+            self.postings = postings
+        return changed
+
+    def facet_values(self):
+        """{facet: [values]} currently present in the index"""
+        values = {}
+        for facet, value in self.postings:
+            values.setdefault(facet, []).append(value)
+        return {facet: sorted(items) for facet, items in values.items()}
+
+    def query(self, filters=(), min_price=None, max_price=None, keywords=None, limit=10):
+        """Positions matching every (facet, value) filter, the price range and title keywords"""
+        with self.lock:
+            postings, prices, alive, search_titles = self.postings, self.prices, self.alive, self.search_titles
+        lists = []
+        for facet, value in filters:
+            if facet is None:
+                # Bare value: any facet carrying it matches
+                keys = [key for key in postings if key[1] == normalize_value(value)]
+                candidates = [postings[key] for key in keys]
+                lists.append(np.unique(np.concatenate(candidates)) if candidates else EMPTY)
+            else:
+                lists.append(postings.get((facet, normalize_value(value)), EMPTY))
+
+        if lists:
+            # Intersect the shortest lists first
+            lists.sort(key=len)
+            result = lists[0]
+            for other in lists[1:]:
+                if not len(result):
+                    break
+                result = np.intersect1d(result, other, assume_unique=True)
+        else:
+            result = np.arange(len(alive), dtype=np.int32)
+
+        result = result[alive[result]]
+        if min_price is not None:
+            result = result[prices[result] >= min_price]
+        if max_price is not None:
+            result = result[prices[result] <= max_price]
+        if keywords:
+            words = keywords.lower().split()
+            result = np.array([position for position in result
+                               if all(word in search_titles[position] for word in words)], dtype=np.int32)
+        return result[:limit] if limit else result
+
+    def product(self, position):
+        """Product record for a position"""
+        with self.lock:
+            ids, titles, slugs, prices, stock = self.ids, self.titles, self.slugs, self.prices, self.stock
+        price = prices[position]
+        return Product(
+            product_id=ids[position],
+            title=titles[position],
+            slug=slugs[position],
+            price=None if np.isnan(price) else f"{price:.2f}",
+            stock_status=stock[position],
+        )
+
+    def save(self, path):
+        """Write the index and its post_modified watermark to a snapshot file"""
+        with self.lock:
+            prices, alive, postings = self.prices, self.alive, self.postings
+        keys = sorted(set(postings) | {key for keys in self.product_keys for key in keys})
+        key_ids = {key: number for number, key in enumerate(keys)}
+        facet_buffer, facet_offsets = pack_strings([facet for facet, _ in keys])
+        value_buffer, value_offsets = pack_strings([value for _, value in keys])
+        title_buffer, title_offsets = pack_strings(self.titles)
+        slug_buffer, slug_offsets = pack_strings(self.slugs)
+        # Products without a stock status are stored as ''
+        stock_buffer, stock_offsets = pack_strings([stock or '' for stock in self.stock])
+        product_key_ids = [key_ids[key] for keys in self.product_keys for key in keys]
+        posting_keys = [key_ids[key] for key in keys if key in postings]
+        save_snapshot(path, 'facet_index', FACET_SNAPSHOT_SCHEMA,
+                      self.watermark.isoformat() if self.watermark is not None else None, {
+            'ids': np.array(self.ids, dtype=np.int64),
+            'titles': title_buffer, 'title_offsets': title_offsets,
+            'slugs': slug_buffer, 'slug_offsets': slug_offsets,
+            'stock': stock_buffer, 'stock_offsets': stock_offsets,
+            'prices': prices, 'alive': alive,
+            'facets': facet_buffer, 'facet_offsets': facet_offsets,
+            'values': value_buffer, 'value_offsets': value_offsets,
+            'product_keys': np.array(product_key_ids, dtype=np.int32),
+            'product_key_offsets': np.cumsum([0] + [len(keys) for keys in self.product_keys]).astype(np.int64),
+            'posting_keys': np.array(posting_keys, dtype=np.int32),
+            'postings': np.concatenate([postings[keys[number]] for number in posting_keys]) if posting_keys else EMPTY,
+            'posting_offsets': np.cumsum([0] + [len(postings[keys[number]]) for number in posting_keys]).astype(np.int64),
+        })
+
+    @classmethod
+    def load(cls, path):
+        """Index from a snapshot file, or None if there is no usable one.
+
+        Price, liveness and posting arrays stay read-only views of the mapped file;
+        apply_changes replaces them with new arrays rather than writing to them.
+        """
+        snapshot = load_snapshot(path, 'facet_index', FACET_SNAPSHOT_SCHEMA)
+        if snapshot is None:
+            return None
+        arrays = snapshot.arrays
+        index = cls()
+        index.ids = arrays['ids'].tolist()
+        index.positions = {product_id: position for position, product_id in enumerate(index.ids)}
+        index.titles = unpack_strings(arrays['titles'], arrays['title_offsets'])
+        index.search_titles = [title.lower() for title in index.titles]
+        index.slugs = unpack_strings(arrays['slugs'], arrays['slug_offsets'])
+        index.stock = [stock or None for stock in unpack_strings(arrays['stock'], arrays['stock_offsets'])]
+        index.prices = arrays['prices']
+        index.alive = arrays['alive']
+        keys = list(zip(unpack_strings(arrays['facets'], arrays['facet_offsets']),
+                        unpack_strings(arrays['values'], arrays['value_offsets'])))
+        product_keys, bounds = arrays['product_keys'].tolist(), arrays['product_key_offsets'].tolist()
+        index.product_keys = [tuple(keys[number] for number in product_keys[bounds[position]:bounds[position + 1]])
+                              for position in range(len(index.ids))]
+        postings, bounds = arrays['postings'], arrays['posting_offsets'].tolist()
+        index.postings = {keys[number]: postings[bounds[slot]:bounds[slot + 1]]
+                          for slot, number in enumerate(arrays['posting_keys'].tolist())}
+        index.watermark = datetime.fromisoformat(snapshot.watermark) if snapshot.watermark else None
+        return index
+
+    def memory_bytes(self):
+        """Bytes held by the posting and price arrays"""
+        return sum(array.nbytes for array in self.postings.values()) + self.prices.nbytes + self.alive.nbytes
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def load_changes(since=None, seen=(), batch=5000):
+    """Read products changed since a post_modified watermark, with their terms and meta.
+
+    The watermark second itself is read again, since post_modified has one-second
+    resolution and more rows may have been saved in that second; products in `seen`
+    were already applied at the watermark and are left out.
+    """
+    query = "SELECT ID, post_title, post_name, post_status, post_modified FROM wp_posts WHERE post_type = 'product'"
+    params = []
+    if since is None:
+        query += " AND post_status = 'publish'"
+    else:
+        query += " AND post_modified >= %s"
+        params.append(since)
+    products = [row for row in woocommerce_db.read_query('facet_products', query, params)
+                if not (row[4] == since and row[0] in seen)]
+
+    terms_by_id, meta_by_id = {}, {}
+    product_ids = [row[0] for row in products]
+    for offset in range(0, len(product_ids), batch):
+        chunk = product_ids[offset:offset + batch]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        for object_id, taxonomy, name in woocommerce_db.read_query('facet_terms', f"""
+            SELECT tr.object_id, tt.taxonomy, t.name
+            FROM wp_term_relationships tr
+            JOIN wp_term_taxonomy tt ON tt.term_taxonomy_id = tr.term_taxonomy_id
+            JOIN wp_terms t ON t.term_id = tt.term_id
+            WHERE tr.object_id IN ({placeholders})
+              AND (tt.taxonomy = 'product_cat' OR tt.taxonomy LIKE 'pa\\_%%')
+        """, chunk):
+            terms_by_id.setdefault(object_id, []).append((taxonomy, name))
+        for post_id, price, stock_status in woocommerce_db.read_query('facet_meta', f"""
+            SELECT post_id,
+                MAX(CASE WHEN meta_key = '_price' THEN meta_value END),
+                MAX(CASE WHEN meta_key = '_stock_status' THEN meta_value END)
+            FROM wp_postmeta
+            WHERE post_id IN ({placeholders}) AND meta_key IN ('_price', '_stock_status')
+            GROUP BY post_id
+        """, chunk):
+            meta_by_id[post_id] = {'price': price, 'stock_status': stock_status}
+    return products, terms_by_id, meta_by_id
+
+def load_meta():
+    """Price and stock status of every published product, in one pivot query"""
+    rows = woocommerce_db.read_query('facet_meta_all', """
+        SELECT pm.post_id,
+            MAX(CASE WHEN pm.meta_key = '_price' THEN pm.meta_value END),
+            MAX(CASE WHEN pm.meta_key = '_stock_status' THEN pm.meta_value END)
+        FROM wp_postmeta pm
+        JOIN wp_posts p ON p.ID = pm.post_id
+        WHERE p.post_type = 'product' AND p.post_status = 'publish'
+          AND pm.meta_key IN ('_price', '_stock_status')
+        GROUP BY pm.post_id
+    """)
+    return {post_id: {'price': price, 'stock_status': stock_status} for post_id, price, stock_status in rows}
+
+facet_index = None
+_refresh_lock = threading.Lock()
+_last_refresh = 0.0
+
+def refresh():
+    """Build the index on first use (from FACET_SNAPSHOT when there is one), afterwards
+    catch up from the post_modified watermark and re-read every price and stock status"""
+    global facet_index, _last_refresh
+    with _refresh_lock:
+        start_time = time.perf_counter()
+        index = facet_index
+        if index is None and FACET_SNAPSHOT:
+            index = FacetIndex.load(FACET_SNAPSHOT)
+            if index is not None:
+                logger.info("facet index loaded from %s, catching up from %s", FACET_SNAPSHOT, index.watermark)
+        index = index or FacetIndex()
+        incremental = index.watermark is not None
+        changes = load_changes(since=index.watermark, seen=index.watermark_ids)
+        index.apply_changes(*changes)
+        # Stock and price edits don't move post_modified; a full build has just read them
+        meta_changes = index.apply_meta(load_meta()) if incremental else 0
+        if meta_changes:
+            metrics.increment('facet_meta_updates', meta_changes)
+        if FACET_SNAPSHOT and (changes[0] or meta_changes):
+            index.save(FACET_SNAPSHOT)
+        facet_index = index
+        _last_refresh = time.monotonic()
+        elapsed = time.perf_counter() - start_time
+    metrics.observe('facet_refresh_seconds', elapsed)
+    metrics.set_gauge('facet_index_products', int(index.alive.sum()))
+    logger.info("facet index refreshed: %d changed products, %d price/stock updates in %.2fs",
+                len(changes[0]), meta_changes, elapsed)
+    return index
+
+def get_index():
+    """Current index; a stale one keeps serving while a background refresh runs"""
+    if facet_index is None:
+        return refresh()
+    if time.monotonic() - _last_refresh > FACET_REFRESH_SECONDS and not _refresh_lock.locked():
+        threading.Thread(target=refresh, name='facet-refresh', daemon=True).start()
+    return facet_index
+
+def parse_filters(category=None, attributes=None):
+    """Turn tool arguments into (facet, value) filters; attributes are 'name:value' or bare values"""
+    filters = []
+    if category:
+        filters.append(('category', category))
+    for item in filter(None, (part.strip() for part in (attributes or '').split(','))):
+        name, _, value = item.rpartition(':')
+        filters.append((name.strip().lower() or None, value.strip()))
+    return filters
+
+def generate_synthetic(count, seed=3):
+    """Synthetic catalog rows in the shape load_changes returns"""
+    rng = random.Random(seed)
+    categories = [f"Category {number}" for number in range(50)]
+    colors = ['red', 'blue', 'green', 'black', 'white', 'yellow', 'pink', 'grey', 'navy', 'brown', 'orange', 'purple']
+    sizes = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+    materials = ['cotton', 'linen', 'wool', 'silk', 'polyester', 'denim', 'leather', 'rayon', 'nylon', 'khadi']
+    now = datetime(2024, 1, 1)
+    products, terms_by_id, meta_by_id = [], {}, {}
+    for product_id in range(1, count + 1):
+        material, color = rng.choice(materials), rng.choice(colors)
+        products.append((product_id, f"{color.title()} {material} item {product_id}", f"item-{product_id}", 'publish', now))
+        terms_by_id[product_id] = [('product_cat', rng.choice(categories)), ('product_cat', rng.choice(categories)),
+                                   ('pa_color', color), ('pa_size', rng.choice(sizes)), ('pa_material', material)]
+        meta_by_id[product_id] = {'price': f"{rng.uniform(100, 5000):.2f}",
+                                  'stock_status': 'instock' if rng.random() < 0.8 else 'outofstock'}
+    return products, terms_by_id, meta_by_id
+
+def run_benchmark(count, queries=2000):
+    """Build, query and incrementally refresh a synthetic catalog"""
+    products, terms_by_id, meta_by_id = generate_synthetic(count)
+    index = FacetIndex()
+    start_time = time.perf_counter()
+    index.apply_changes(products, terms_by_id, meta_by_id)
+    build_time = time.perf_counter() - start_time
+    print(f"Built index for {count} products in {build_time:.2f}s, "
+          f"{len(index.postings)} facet values, {index.memory_bytes() / 1e6:.1f} MB of arrays")
+
+    rng = random.Random(11)
+    facets = index.facet_values()
+    timings = []
+    matched = 0
+    for _ in range(queries):
+        filters = [('category', rng.choice(facets['category'])), ('material', rng.choice(facets['material']))]
+        if rng.random() < 0.5:
+            filters.append(('color', rng.choice(facets['color'])))
+        start_time = time.perf_counter()
+        result = index.query(filters, max_price=rng.choice([500, 1000, 2500]), limit=0)
+        timings.append(time.perf_counter() - start_time)
+        matched += len(result)
+    timings.sort()
+    print(f"{queries} conjunctive queries: p50 {timings[len(timings) // 2] * 1e6:.0f}us, "
+          f"p95 {timings[int(0.95 * len(timings))] * 1e6:.0f}us, avg {matched / queries:.0f} hits")
+
+    changed = rng.sample(range(count), min(1000, count))
+    updates = [(products[i][0], products[i][1], products[i][2], 'publish' if rng.random() < 0.9 else 'draft', products[i][4])
+               for i in changed]
+    for product_id, *_ in updates:
+        terms_by_id[product_id] = [('pa_color', rng.choice(['red', 'blue'])), ('product_cat', 'Sale')]
+    start_time = time.perf_counter()
+    index.apply_changes(updates, terms_by_id, meta_by_id)
+    print(f"Incremental refresh of {len(updates)} products in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Category/attribute facet index for product browsing")
+    parser.add_argument('--benchmark', type=int, metavar='PRODUCTS', help="Benchmark on a synthetic catalog")
+    args = parser.parse_args()
+    if args.benchmark:
+        run_benchmark(args.benchmark)
+    else:
+        index = refresh()
+        print(f"Indexed {int(index.alive.sum())} products")
+        for facet, values in sorted(index.facet_values().items()):
+            print(f"{facet}: {', '.join(values[:20])}{' ...' if len(values) > 20 else ''}")
+
+if __name__ == "__main__":
+    main()
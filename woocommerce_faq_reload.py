@@ -0,0 +1,245 @@
+import csv
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import woocommerce_metrics as metrics
+from woocommerce_faq_search import FaqIndex
+from woocommerce_faq_store import FaqStore
+from woocommerce_vector_store import VectorStore
+
+logger = logging.getLogger("woocommerce_faq_reload")
+
+@dataclass(frozen=True)
+class FaqVersion:
+    """One consistent generation of the FAQ data and everything derived from it"""
+    data: object
+    index: FaqIndex
+    digest: str
+    # (mtime, size) of every source file, to skip hashing when nothing was touched
+    stamp: tuple
+    embeddings: VectorStore = None
+    # Rows in this version; data is left empty when the vector store holds the entries
+    entry_count: int = None
+
+    def __post_init__(self):
+        if self.entry_count is None:
+            object.__setattr__(self, 'entry_count', len(self.data))
+
+class FaqReloader:
+    """Watch the FAQ file (plus any extra knowledge files in the same format) and swap in
+    a new FaqVersion when their content changes.
+
+    Readers grab `reloader.current` once per request; a reload builds the next
+    version on the side and replaces that single reference, so in-flight requests
+    keep the version they started with and never wait on a reload.
+
+    With follow_snapshot the sources are left alone: another process (the prefork
+    launcher) owns them and publishes each version as `snapshot_path` plus the
+    vector store files, and this reloader only re-maps the snapshot when it is
+    replaced.
+
+    When the vector store holds the entries itself (pgvector), a version keeps no
+    FAQ data or lexical index: the sources are parsed to sync the store and then
+    dropped, and a follower only attaches to the store.
+    """
+
+    def __init__(self, path, snapshot_path=None, vector_store=None, extra_paths=(), follow_snapshot=False):
+        if follow_snapshot and not snapshot_path:
+            raise ValueError("follow_snapshot needs a snapshot_path")
+        self.path = path
+        self.follow_snapshot = follow_snapshot
+        # Optional files, e.g. chunks of ingested policy pages; missing ones are ignored
+        self.paths = [snapshot_path] if follow_snapshot else [path, *extra_paths]
+        self.snapshot_path = snapshot_path
+        # The lexical index is saved beside the snapshot, tagged with the same source digest
+        self.index_path = f"{snapshot_path}.index" if snapshot_path else None
+        self.vector_store = vector_store
+        self.external = vector_store is not None and vector_store.holds_entries
+        # Hashes of the (question, answer) rows of the last version, to count unchanged rows
+        self.previous_rows = set()
+        self.reload_lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.current = None
+        self.current = self._load_initial()
+        metrics.set_gauge('faq_entries', self.current.entry_count)
+
+    def _stat(self):
+        stamp = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_mtime, stat.st_size))
+            except FileNotFoundError:
+                stamp.append((0.0, 0))
+        return tuple(stamp)
+
+    def _read(self):
+        """Contents of the source files that exist, and a digest over all of them"""
+        contents = []
+        digest = hashlib.sha256()
+        for path in self.paths:
+            try:
+                with open(path, 'rb') as file:
+                    content = file.read()
+            except FileNotFoundError:
+                continue
+            digest.update(path.encode('utf-8') + b'\0' + content + b'\0')
+            contents.append(content)
+        return contents, digest.hexdigest()
+
+    def _load_initial(self):
+        stamp = self._stat()
+        if self.follow_snapshot:
+            return self._follow(stamp) or FaqVersion([], FaqIndex([]), '', stamp)
+        snapshot = self._map_snapshot() if self.snapshot_path and stamp[0][1] and not self.external else None
+        if snapshot is not None:
+            _, digest = self._read()
+            index = FaqIndex.load(self.index_path, snapshot, snapshot.digest)
+            if snapshot.digest == digest:
+                # Sources haven't changed since the snapshot was written: map it instead of parsing
+                if index is None:
+                    index = FaqIndex(snapshot)
+                    index.save(self.index_path, digest)
+                logger.info("Mapped %d FAQ entries from %s", len(snapshot), self.snapshot_path)
+                return FaqVersion(snapshot, index, digest, stamp, self._embed(snapshot))
+            if index is not None:
+                # Edited while we were down: catch up from the saved version, so only
+                # changed questions are tokenized and only changed rows embedded
+                self.current = FaqVersion(snapshot, index, snapshot.digest, ())
+        version = self._build(stamp)
+        if version is None:
+            return FaqVersion([], FaqIndex([]), '', stamp)
+        return version
+
+    def _map_snapshot(self):
+        try:
+            return FaqStore.load(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.info("Rebuilding FAQ snapshot: %s", e)
+            return None
+
+    def _parse(self, texts):
+        """(question, answer) rows of every source, plus how many were already in the previous version.
+
+        Each text goes through one csv.reader pass, so quoted answers may span lines
+        and a stray quote inside a field is handled the way load_faq handles it.
+        """
+        rows = []
+        for text in texts:
+            reader = csv.reader(io.StringIO(text), delimiter='\t')
+            next(reader, None)  # Skip header row
+            for fields in reader:
+                if len(fields) < 2:
+                    if any(field.strip() for field in fields):
+                        logger.warning("Skipping FAQ row with missing values: %r", fields)
+                    continue
+                rows.append((fields[0], fields[1]))
+        row_hashes = {hash(row) for row in rows}
+        reused = len(row_hashes & self.previous_rows)
+        self.previous_rows = row_hashes
+        return rows, reused
+
+    def _build(self, stamp):
+        if not stamp[0][1]:
+            logger.error("FAQ file '%s' not found or empty", self.path)
+            return None
+        contents, digest = self._read()
+        if self.current is not None and self.current.digest == digest:
+            return None
+        rows, reused = self._parse([content.decode('utf-8') for content in contents])
+        if self.external:
+            embeddings = self._embed([{'question': question, 'answer': answer} for question, answer in rows])
+            logger.info("Synced %d FAQ entries from %s to the vector store (%d unchanged rows)",
+                        len(rows), ', '.join(self.paths), reused)
+            return FaqVersion([], FaqIndex([]), digest, stamp, embeddings, len(rows))
+        if self.snapshot_path:
+            store = FaqStore.from_rows(rows)
+            # Vectors are written before the snapshot is replaced, so a process following
+            # the snapshot always finds vectors for the version it maps
+            self._embed(store)
+            store.save(self.snapshot_path, digest)
+            data = FaqStore.load(self.snapshot_path)
+            embeddings = self.vector_store.attach(data) if self.vector_store is not None else None
+        else:
+            data = [{'question': question, 'answer': answer} for question, answer in rows]
+            embeddings = self._embed(data)
+        index = FaqIndex(data, previous=self.current.index if self.current else None)
+        if self.snapshot_path:
+            # Written after the snapshot; a follower that maps the snapshot first builds its own index
+            index.save(self.index_path, digest)
+        logger.info("Loaded %d FAQ entries from %s (%d unchanged rows reused)", len(rows), ', '.join(self.paths), reused)
+        return FaqVersion(data, index, digest, stamp, embeddings)
+
+    def _follow(self, stamp):
+        """Map the snapshot another process published, with the vectors written alongside it"""
+        if self.external:
+            # The publisher syncs the shared store; there is nothing here to map
+            if self.current is not None:
+                return None
+            return FaqVersion([], FaqIndex([]), '', stamp, self.vector_store.attach([]), 0)
+        if not stamp[0][1]:
+            logger.error("FAQ snapshot '%s' not found or empty", self.snapshot_path)
+            return None
+        # The snapshot is only ever replaced whole, so its (mtime, size) identifies the version
+        digest = repr(stamp)
+        if self.current is not None and self.current.digest == digest:
+            return None
+        data = FaqStore.load(self.snapshot_path)
+        embeddings = self.vector_store.attach(data) if self.vector_store is not None else None
+        index = FaqIndex.load(self.index_path, data, data.digest) \
+            or FaqIndex(data, previous=self.current.index if self.current else None)
+        logger.info("Mapped %d FAQ entries from %s", len(data), self.snapshot_path)
+        return FaqVersion(data, index, digest, stamp, embeddings)
+
+    def _embed(self, data):
+        return self.vector_store.sync(data) if self.vector_store is not None else None
+
+    def check(self):
+        """Reload if the file changed; returns True when a new version was swapped in"""
+        stamp = self._stat()
+        current = self.current
+        if stamp == current.stamp:
+            return False
+        with self.reload_lock:
+            current = self.current
+            start_time = time.perf_counter()
+            try:
+                version = self._follow(stamp) if self.follow_snapshot else self._build(stamp)
+            except Exception as e:
+                # Keep serving the previous version
+                metrics.increment('faq_reload_errors')
+                logger.error("FAQ reload failed: %s", e)
+                return False
+            if version is None:
+                # Touched but identical (or unreadable): remember the stat so we don't re-hash every poll
+                self.current = FaqVersion(current.data, current.index, current.digest, stamp, current.embeddings,
+                                          current.entry_count)
+                return False
+            self.current = version
+            elapsed = time.perf_counter() - start_time
+        metrics.observe('faq_reload_seconds', elapsed)
+        metrics.increment('faq_reloads')
+        metrics.set_gauge('faq_entries', version.entry_count)
+        return True
+
+    def _watch(self, interval):
+        while not self.stopping.wait(interval):
+            self.check()
+
+    def start(self, interval):
+        """Poll the file every `interval` seconds in a daemon thread"""
+        if self.thread is None and interval > 0:
+            self.thread = threading.Thread(target=self._watch, args=(interval,), name="faq-reload", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
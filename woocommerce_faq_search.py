@@ -0,0 +1,119 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+from woocommerce_faq_store import FaqStore
+from woocommerce_snapshots import load_snapshot, pack_strings, save_snapshot, unpack_strings
+
+# Bump when the arrays written by FaqIndex.save change (or tokenize() does)
+FAQ_INDEX_SCHEMA = 1
+
+# Words that carry no meaning for FAQ matching
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'can', 'do', 'does', 'for', 'how', 'i', 'if', 'in', 'is', 'it',
+    'me', 'my', 'of', 'on', 'or', 'the', 'to', 'what', 'when', 'where', 'which', 'will',
+    'with', 'you', 'your', 'we', 'our', 'be', 'there', 'any', 'this', 'that'
+}
+
+def tokenize(text):
+    """Split text into lowercase word tokens without stop words"""
+    if not text:
+        return []
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOP_WORDS]
+
+class FaqIndex:
+    """Lexical TF-IDF index over FAQ questions for quick top-hit lookups"""
+
+    def __init__(self, faq_data, previous=None):
+        # A packed store is indexed in place instead of being expanded into dicts
+        self.entries = faq_data if isinstance(faq_data, FaqStore) else list(faq_data)
+        # On reloads, questions that didn't change keep their tokens from the previous index
+        known = previous.tokens_by_question() if previous is not None else {}
+        self.doc_tokens = [
+            known.get(entry['question']) or Counter(tokenize(entry['question'])) for entry in self.entries
+        ]
+        doc_freq = Counter()
+        for tokens in self.doc_tokens:
+            doc_freq.update(tokens.keys())
+        total = len(self.entries) or 1
+        self.idf = {word: math.log(1 + total / count) for word, count in doc_freq.items()}
+        self.norms = [self._norm(tokens) for tokens in self.doc_tokens]
+
+    def save(self, path, watermark):
+        """Write the token counts, IDF and norms to a snapshot tagged with the FAQ digest"""
+        words = sorted(self.idf)
+        word_ids = {word: number for number, word in enumerate(words)}
+        word_buffer, word_offsets = pack_strings(words)
+        save_snapshot(path, 'faq_index', FAQ_INDEX_SCHEMA, watermark, {
+            'words': word_buffer, 'word_offsets': word_offsets,
+            'idf': np.array([self.idf[word] for word in words], dtype=np.float64),
+            'tokens': np.array([word_ids[word] for tokens in self.doc_tokens for word in tokens], dtype=np.int32),
+            'counts': np.array([count for tokens in self.doc_tokens for count in tokens.values()], dtype=np.int32),
+            'token_offsets': np.cumsum([0] + [len(tokens) for tokens in self.doc_tokens]).astype(np.int64),
+            'norms': np.array(self.norms, dtype=np.float64),
+        }, meta={'entries': len(self.entries)})
+
+    @classmethod
+    def load(cls, path, faq_data, watermark):
+        """Index over faq_data from a snapshot saved for the same FAQ digest, or None"""
+        snapshot = load_snapshot(path, 'faq_index', FAQ_INDEX_SCHEMA)
+        if snapshot is None or snapshot.watermark != watermark or snapshot.meta.get('entries') != len(faq_data):
+            return None
+        arrays = snapshot.arrays
+        words = unpack_strings(arrays['words'], arrays['word_offsets'])
+        tokens, counts = arrays['tokens'].tolist(), arrays['counts'].tolist()
+        bounds = arrays['token_offsets'].tolist()
+        index = cls.__new__(cls)
+        index.entries = faq_data if isinstance(faq_data, FaqStore) else list(faq_data)
+        # Plain dicts: search only looks counts up, and building 100k Counters doubles the load time
+        index.doc_tokens = [
+            dict(zip([words[number] for number in tokens[start:end]], counts[start:end]))
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        index.idf = dict(zip(words, arrays['idf'].tolist()))
+        index.norms = arrays['norms'].tolist()
+        return index
+
+    def tokens_by_question(self):
+        return {entry['question']: tokens for entry, tokens in zip(self.entries, self.doc_tokens)}
+
+    def _norm(self, tokens):
+        return math.sqrt(sum((self.idf.get(word, 0.0) * count) ** 2 for word, count in tokens.items())) or 1.0
+
+    def search(self, query, top_k=3):
+        """Return up to top_k (score, entry) pairs ordered by cosine similarity"""
+        query_tokens = Counter(tokenize(query))
+        if not query_tokens:
+            return []
+        query_norm = self._norm(query_tokens)
+        scored = []
+        for position, tokens in enumerate(self.doc_tokens):
+            shared = query_tokens.keys() & tokens.keys()
+            if not shared:
+                continue
+            dot = sum(self.idf[word] ** 2 * query_tokens[word] * tokens[word] for word in shared)
+            scored.append((dot / (query_norm * self.norms[position]), position))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, self.entries[position]) for score, position in scored[:top_k]]
+
+    def top_answer(self, query, min_score=0.3):
+        """Return the best matching FAQ answer, or None if nothing is close enough"""
+        hits = self.search(query, top_k=1)
+        if hits and hits[0][0] >= min_score:
+            return hits[0][1]['answer']
+        return None
+
+def answer_similarity(answer, expected):
+    """Token-level F1 between a generated answer and the stored FAQ answer"""
+    answer_tokens = Counter(tokenize(answer))
+    expected_tokens = Counter(tokenize(expected))
+    if not answer_tokens or not expected_tokens:
+        return 0.0
+    overlap = sum((answer_tokens & expected_tokens).values())
+    if overlap == 0:
+        return 0.0
+    precision = overlap / sum(answer_tokens.values())
+    recall = overlap / sum(expected_tokens.values())
+    return 2 * precision * recall / (precision + recall)
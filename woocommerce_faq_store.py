@@ -0,0 +1,197 @@
+import argparse
+import csv
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Snapshot layout: header, int64 offsets (2 per entry + 1), then the UTF-8 text buffer.
+# The header carries the sha256 of the sources the snapshot was built from (zeros if unknown).
+SNAPSHOT_MAGIC = b'FAQS'
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct('<4sIQQ32s')
+# Entries decoded per offset conversion while iterating
+ITER_BLOCK = 4096
+
+class FaqStore:
+    """FAQ entries packed into one UTF-8 buffer with an offset array.
+
+    Question i spans offsets[2i]:offsets[2i+1] and its answer offsets[2i+1]:offsets[2i+2].
+    Iterating or indexing yields {'question': ..., 'answer': ...} dicts built on access,
+    so it can stand in for the list returned by load_faq.
+    """
+
+    def __init__(self, buffer, offsets, source=None, digest=''):
+        self.buffer = buffer
+        self.offsets = offsets
+        # Keeps a snapshot's mmap (and file) alive as long as the views into it
+        self.source = source
+        # Hex digest of the source files, as recorded in the snapshot
+        self.digest = digest
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Pack an iterable of (question, answer) pairs"""
+        chunks = []
+        offsets = [0]
+        position = 0
+        for question, answer in rows:
+            for text in (question, answer):
+                data = text.encode('utf-8')
+                chunks.append(data)
+                position += len(data)
+                offsets.append(position)
+        return cls(b''.join(chunks), np.array(offsets, dtype=np.int64))
+
+    @classmethod
+    def from_csv(cls, csv_file):
+        """Read the same tab-separated question/answer file as load_faq"""
+        with open(csv_file, 'r', encoding='utf-8') as file:
+            reader = csv.reader(file, delimiter='\t')
+            next(reader, None)  # Skip header row
+            return cls.from_rows((row[0], row[1]) for row in reader if len(row) >= 2)
+
+    @classmethod
+    def load(cls, path):
+        """Map a snapshot written by save(); the text is paged in lazily and shared between processes"""
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, buffer_size, digest = SNAPSHOT_HEADER.unpack_from(mapped, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            mapped.close()
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} FAQ snapshot")
+        offsets_start = SNAPSHOT_HEADER.size
+        offsets = np.frombuffer(mapped, dtype='<i8', count=2 * count + 1, offset=offsets_start)
+        buffer_start = offsets_start + offsets.nbytes
+        buffer = memoryview(mapped)[buffer_start:buffer_start + buffer_size]
+        return cls(buffer, offsets, source=mapped, digest=digest.hex() if any(digest) else '')
+
+    def save(self, path, digest=''):
+        """Write a snapshot atomically so readers never map a half-written file.
+
+        `digest` (hex sha256 of the sources) lets a later load tell whether the snapshot is current.
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self), len(self.buffer),
+                                            bytes.fromhex(digest) if digest else b''))
+            file.write(self.offsets.astype('<i8').tobytes())
+            file.write(self.buffer)
+        os.replace(temp_path, path)
+
+    def _text(self, slot):
+        start, end = int(self.offsets[slot]), int(self.offsets[slot + 1])
+        return str(self.buffer[start:end], 'utf-8')
+
+    def question(self, position):
+        return self._text(2 * position)
+
+    def answer(self, position):
+        return self._text(2 * position + 1)
+
+    def __len__(self):
+        return (len(self.offsets) - 1) // 2
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("FAQ entry out of range")
+        return {'question': self.question(position), 'answer': self.answer(position)}
+
+    def __iter__(self):
+        # Convert offsets a block at a time; per-entry numpy indexing dominates a full scan otherwise
+        buffer = self.buffer
+        for block_start in range(0, len(self.offsets) - 1, 2 * ITER_BLOCK):
+            bounds = self.offsets[block_start:block_start + 2 * ITER_BLOCK + 1].tolist()
+            for slot in range(0, len(bounds) - 1, 2):
+                yield {
+                    'question': str(buffer[bounds[slot]:bounds[slot + 1]], 'utf-8'),
+                    'answer': str(buffer[bounds[slot + 1]:bounds[slot + 2]], 'utf-8'),
+                }
+
+    def __repr__(self):
+        # Same text as the list of dicts, so prompts built from it don't change
+        return repr(list(self))
+
+def generate_synthetic(path, rows):
+    """Write a tab-separated FAQ file with support-macro sized entries"""
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, delimiter='\t')
+        writer.writerow(['question', 'answer'])
+        for number in range(rows):
+            writer.writerow([
+                f"How do I handle request type {number} for product line {number % 97}?",
+                f"For request type {number}, open your account page, choose order {number % 1000} and follow "
+                f"the steps shown. Contact support if product line {number % 97} still shows an error.",
+            ])
+
+def _rss_bytes():
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def _measure(variant, csv_file, snapshot_path):
+    """Load one variant in this (fresh) process and print load seconds and RSS growth"""
+    before = _rss_bytes()
+    start_time = time.perf_counter()
+    if variant == 'dicts':
+        faq = []
+        with open(csv_file, 'r', encoding='utf-8') as file:
+            reader = csv.reader(file, delimiter='\t')
+            next(reader)
+            for row in reader:
+                faq.append({'question': row[0], 'answer': row[1]})
+    elif variant == 'packed':
+        faq = FaqStore.from_csv(csv_file)
+    else:
+        faq = FaqStore.load(snapshot_path)
+    load_seconds = time.perf_counter() - start_time
+    loaded = _rss_bytes()
+    # Touch every entry the way a full scan (e.g. building an index) would
+    scan_start = time.perf_counter()
+    characters = sum(len(entry['question']) + len(entry['answer']) for entry in faq)
+    scan_seconds = time.perf_counter() - scan_start
+    print(f"{load_seconds} {loaded - before} {scan_seconds} {_rss_bytes() - before} {characters}")
+
+def run_benchmark(rows, directory):
+    csv_file = os.path.join(directory, f'faq_benchmark_{rows}.csv')
+    snapshot_path = csv_file + '.snapshot'
+    generate_synthetic(csv_file, rows)
+    FaqStore.from_csv(csv_file).save(snapshot_path)
+    print(f"{rows} rows, csv {os.path.getsize(csv_file) / 1e6:.1f} MB, snapshot {os.path.getsize(snapshot_path) / 1e6:.1f} MB")
+    for variant, label in [('dicts', 'list of dicts'), ('packed', 'packed from csv'), ('snapshot', 'mmap snapshot')]:
+        # Each variant runs in its own interpreter so RSS numbers don't bleed into each other
+        output = subprocess.run(
+            [sys.executable, __file__, '--measure', variant, csv_file, snapshot_path],
+            check=True, capture_output=True, text=True
+        ).stdout.split()
+        load_seconds, load_rss, scan_seconds, scan_rss = (float(value) for value in output[:4])
+        print(f"{label:>16}: load {load_seconds * 1000:8.1f}ms, RSS +{load_rss / 1e6:7.1f} MB, "
+              f"full scan {scan_seconds * 1000:7.1f}ms (RSS +{scan_rss / 1e6:.1f} MB after)")
+    os.remove(csv_file)
+    os.remove(snapshot_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a packed FAQ snapshot or benchmark it against a list of dicts")
+    parser.add_argument('--csv', default='faq.csv', help="Tab-separated question/answer file")
+    parser.add_argument('--output', default='faq.snapshot', help="Snapshot file to write")
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', help="Benchmark load time and RSS with ROWS synthetic rows")
+    parser.add_argument('--directory', default='.', help="Where benchmark files are written")
+    parser.add_argument('--measure', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        _measure(*args.measure)
+    elif args.benchmark:
+        run_benchmark(args.benchmark, args.directory)
+    else:
+        store = FaqStore.from_csv(args.csv)
+        store.save(args.output)
+        print(f"Wrote {len(store)} entries to {args.output} ({os.path.getsize(args.output)} bytes)")
+
+if __name__ == "__main__":
+    main()
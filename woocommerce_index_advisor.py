@@ -0,0 +1,288 @@
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+import woocommerce_db
+
+# Query patterns the bot sends to MySQL and the index that serves each of them best
+QUERY_PATTERNS = [
+    {
+        'name': 'order_by_email',
+        'description': "get_order_status: wp_postmeta WHERE meta_key = '_billing_email' AND meta_value = %s",
+        'table': 'wp_postmeta',
+        'columns': ['meta_key', 'meta_value'],
+        'index_name': 'bot_meta_key_value',
+        'index_definition': '(meta_key(191), meta_value(100))',
+        'stats_query': """
+            SELECT COUNT(*) AS matching_rows, COUNT(DISTINCT LEFT(meta_value, 100)) AS distinct_values
+            FROM wp_postmeta WHERE meta_key = '_billing_email'
+        """,
+    },
+    {
+        'name': 'order_meta_pivot',
+        'description': "get_order_status: wp_postmeta joined on post_id for the billing pivot",
+        'table': 'wp_postmeta',
+        'columns': ['post_id'],
+        'index_name': 'bot_post_id',
+        'index_definition': '(post_id)',
+    },
+    {
+        'name': 'orders_by_type',
+        'description': "get_order_status: wp_posts WHERE post_type = 'shop_order' ORDER BY post_date",
+        'table': 'wp_posts',
+        'columns': ['post_type', 'post_status', 'post_date'],
+        'index_name': 'bot_type_status_date',
+        'index_definition': '(post_type, post_status, post_date, ID)',
+    },
+    {
+        'name': 'product_title_search',
+        'description': "search_products: post_title LIKE '%term%' (leading wildcard, no B-tree index can help)",
+        'table': 'wp_posts',
+        'columns': ['post_title'],
+        'leading_wildcard': True,
+    },
+]
+
+def table_indexes(connection, table):
+    """Return {index_name: [(column, sub_part, cardinality), ...]} from information_schema"""
+    rows = woocommerce_db.fetch_all(connection, 'advisor_statistics', """
+        SELECT INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME, SUB_PART, CARDINALITY
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,), dictionary=True)
+    indexes = {}
+    for row in rows:
+        indexes.setdefault(row['INDEX_NAME'], []).append(
+            (row['COLUMN_NAME'], row['SUB_PART'], row['CARDINALITY'] or 0)
+        )
+    return indexes
+
+def table_rows(connection, table):
+    """Approximate row count from table statistics"""
+    rows = woocommerce_db.fetch_all(connection, 'advisor_tables', """
+        SELECT TABLE_ROWS FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,), dictionary=True)
+    return (rows[0]['TABLE_ROWS'] or 0) if rows else 0
+
+def best_prefix_match(indexes, columns):
+    """Find the index covering the longest leading prefix of the pattern columns"""
+    best_name, best_length, best_cardinality = None, 0, 0
+    for name, index_columns in indexes.items():
+        length = 0
+        for (column, _, _), wanted in zip(index_columns, columns):
+            if column != wanted:
+                break
+            length += 1
+        if length > best_length:
+            best_name, best_length = name, length
+            best_cardinality = index_columns[length - 1][2]
+    return best_name, best_length, best_cardinality
+
+def analyze_pattern(connection, pattern):
+    """Check one query pattern against the live schema and estimate the benefit of its index"""
+    result = {'pattern': pattern['name'], 'description': pattern['description']}
+    if pattern.get('leading_wildcard'):
+        result['status'] = 'unindexable'
+        result['advice'] = "Leading-wildcard LIKE scans every row; consider a FULLTEXT index or the in-memory product index."
+        return result
+
+    rows = table_rows(connection, pattern['table'])
+    indexes = table_indexes(connection, pattern['table'])
+    index_name, matched, cardinality = best_prefix_match(indexes, pattern['columns'])
+    result['table_rows'] = rows
+    result['index'] = index_name
+
+    if matched == len(pattern['columns']):
+        result['status'] = 'ok'
+        result['advice'] = f"Served by index {index_name}."
+        return result
+
+    # Rows examined with the current best index (or a full scan) versus the recommended index
+    rows_now = rows / cardinality if matched and cardinality else rows
+    rows_after = 1.0
+    if pattern.get('stats_query'):
+        stats = woocommerce_db.fetch_all(connection, f"advisor_{pattern['name']}", pattern['stats_query'], dictionary=True)
+        if stats and stats[0]['matching_rows']:
+            rows_now = stats[0]['matching_rows'] if matched else rows
+            rows_after = stats[0]['matching_rows'] / max(1, stats[0]['distinct_values'])
+
+    result['status'] = 'ineffective' if matched else 'missing'
+    result['rows_examined_now'] = round(rows_now)
+    result['rows_examined_after'] = round(rows_after, 1)
+    result['estimated_speedup'] = round(rows_now / max(rows_after, 1.0), 1)
+    result['recommendation'] = f"ALTER TABLE {pattern['table']} ADD INDEX {pattern['index_name']} {pattern['index_definition']}"
+    if matched:
+        result['advice'] = (f"Index {index_name} only covers {', '.join(pattern['columns'][:matched])}; "
+                            f"about {result['rows_examined_now']} rows are read per lookup.")
+    else:
+        result['advice'] = "No usable index; every lookup scans the table."
+    return result
+
+def apply_recommendations(connection, results):
+    """Create the recommended indexes"""
+    cursor = connection.cursor()
+    try:
+        for result in results:
+            if result.get('recommendation'):
+                print(f"Creating: {result['recommendation']}")
+                start_time = time.perf_counter()
+                cursor.execute(result['recommendation'])
+                print(f"  done in {time.perf_counter() - start_time:.1f}s")
+    finally:
+        cursor.close()
+
+def drop_bot_indexes(connection):
+    """Remove indexes created by this tool (used to repeat before/after runs)"""
+    cursor = connection.cursor()
+    try:
+        for pattern in QUERY_PATTERNS:
+            if pattern.get('index_name') and pattern['index_name'] in table_indexes(connection, pattern['table']):
+                print(f"Dropping index {pattern['index_name']} on {pattern['table']}")
+                cursor.execute(f"ALTER TABLE {pattern['table']} DROP INDEX {pattern['index_name']}")
+    finally:
+        cursor.close()
+
+def benchmark_order_lookups(connection, samples=20, repeats=3):
+    """Median latency of the bot's order-by-email query over sample customers"""
+    emails = [row[0] for row in woocommerce_db.fetch_all(connection, 'advisor_sample_emails', """
+        SELECT meta_value FROM wp_postmeta WHERE meta_key = '_billing_email' LIMIT %s
+    """, (samples,))]
+    if not emails:
+        return None
+    timings = []
+    for email in emails:
+        query, params = woocommerce_db.order_status_query(email=email)
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            woocommerce_db.fetch_all(connection, 'advisor_benchmark', query, params, dictionary=True)
+            timings.append(time.perf_counter() - start_time)
+    query, params = woocommerce_db.order_status_query(email=emails[0])
+    plan = woocommerce_db.explain(connection, query, params)
+    keys = sorted({str(step.get('key')) for step in plan if step.get('table') in ('wp_postmeta', 'pm')})
+    return {'median_ms': round(statistics.median(timings) * 1000, 2), 'queries': len(timings), 'keys': keys}
+
+def create_fixture(connection, orders, meta_per_order=20, seed=7):
+    """Build synthetic stock-schema wp_posts/wp_postmeta tables filled with orders"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS wp_posts (
+                ID bigint unsigned NOT NULL AUTO_INCREMENT,
+                post_date datetime NOT NULL,
+                post_title text NOT NULL,
+                post_status varchar(20) NOT NULL DEFAULT 'publish',
+                post_name varchar(200) NOT NULL DEFAULT '',
+                post_modified datetime NOT NULL,
+                post_type varchar(20) NOT NULL DEFAULT 'post',
+                PRIMARY KEY (ID),
+                KEY post_name (post_name(191)),
+                KEY type_status_date (post_type, post_status, post_date, ID)
+            ) DEFAULT CHARSET=utf8mb4
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS wp_postmeta (
+                meta_id bigint unsigned NOT NULL AUTO_INCREMENT,
+                post_id bigint unsigned NOT NULL DEFAULT 0,
+                meta_key varchar(255) DEFAULT NULL,
+                meta_value longtext,
+                PRIMARY KEY (meta_id),
+                KEY post_id (post_id),
+                KEY meta_key (meta_key(191))
+            ) DEFAULT CHARSET=utf8mb4
+        """)
+        cursor.execute("SELECT COUNT(*) FROM wp_posts")
+        if cursor.fetchone()[0]:
+            print("Fixture tables already contain data; skipping generation.")
+            return
+
+        rng = random.Random(seed)
+        statuses = ['wc-pending', 'wc-processing', 'wc-on-hold', 'wc-completed', 'wc-cancelled', 'wc-refunded']
+        start_date = datetime(2023, 1, 1)
+        batch = 1000
+        for offset in range(0, orders, batch):
+            count = min(batch, orders - offset)
+            posts = []
+            for number in range(offset, offset + count):
+                date = start_date + timedelta(minutes=number * 7)
+                posts.append((number + 1, date, f"Order {number + 1}", rng.choice(statuses), date, 'shop_order'))
+            cursor.executemany("""
+                INSERT INTO wp_posts (ID, post_date, post_title, post_status, post_modified, post_type)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, posts)
+
+            meta = []
+            for post_id, *_ in posts:
+                customer = rng.randrange(max(1, orders // 3))
+                meta.extend([
+                    (post_id, '_billing_email', f"customer{customer}@example.com"),
+                    (post_id, '_billing_first_name', f"First{customer}"),
+                    (post_id, '_billing_last_name', f"Last{customer}"),
+                    (post_id, '_order_total', f"{rng.uniform(5, 500):.2f}"),
+                ])
+                meta.extend((post_id, f"_filler_{key}", str(rng.random())) for key in range(meta_per_order - 4))
+            cursor.executemany("INSERT INTO wp_postmeta (post_id, meta_key, meta_value) VALUES (%s, %s, %s)", meta)
+            connection.commit()
+        cursor.execute("ANALYZE TABLE wp_posts, wp_postmeta")
+        cursor.fetchall()
+        print(f"Created fixture with {orders} orders and {orders * meta_per_order} meta rows.")
+    finally:
+        cursor.close()
+
+def print_results(results):
+    for result in results:
+        print(f"[{result['status'].upper()}] {result['pattern']}: {result['description']}")
+        print(f"  {result['advice']}")
+        if result.get('recommendation'):
+            print(f"  rows examined now ~{result['rows_examined_now']}, after ~{result['rows_examined_after']} "
+                  f"(estimated {result['estimated_speedup']}x fewer)")
+            print(f"  recommended: {result['recommendation']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the indexes behind the bot's order and product lookups")
+    parser.add_argument('--database', help="Database to inspect (defaults to DB_NAME)")
+    parser.add_argument('--apply', action='store_true', help="Create the recommended indexes")
+    parser.add_argument('--benchmark', action='store_true', help="Time order lookups before and after --apply")
+    parser.add_argument('--fixture', type=int, default=0, help="Fill an empty scratch database with N synthetic orders")
+    parser.add_argument('--drop', action='store_true', help="Drop indexes previously created by this tool and exit")
+    args = parser.parse_args()
+
+    if args.fixture and not args.database:
+        parser.error("--fixture needs an explicit --database so the shop database is never touched")
+
+    try:
+        connection = woocommerce_db.connect(database=args.database)
+    except mysql.connector.Error as e:
+        print(f"Error connecting to MySQL database: {e}")
+        return
+
+    try:
+        if args.drop:
+            drop_bot_indexes(connection)
+            return
+        if args.fixture:
+            create_fixture(connection, args.fixture)
+
+        results = [analyze_pattern(connection, pattern) for pattern in QUERY_PATTERNS]
+        print_results(results)
+
+        before = benchmark_order_lookups(connection) if args.benchmark else None
+        if args.apply:
+            apply_recommendations(connection, results)
+        if before:
+            print(f"Order lookup before: median {before['median_ms']}ms over {before['queries']} queries (keys {before['keys']})")
+            if args.apply:
+                after = benchmark_order_lookups(connection)
+                print(f"Order lookup after:  median {after['median_ms']}ms over {after['queries']} queries (keys {after['keys']})")
+    except mysql.connector.Error as e:
+        print(f"Database error: {e}")
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import woocommerce_metrics as metrics
+
+load_dotenv()
+
+# Runs (and their messages) each agent keeps in memory; 0 keeps everything, as agno does
+AGENT_MAX_RUNS = int(os.getenv("AGENT_MAX_RUNS", "20"))
+# Replace the agent team with fresh instances after this many turns (0 disables)
+AGENT_RECYCLE_TURNS = int(os.getenv("AGENT_RECYCLE_TURNS", "0"))
+# Replace the agent team when the process RSS exceeds this (0 disables)
+AGENT_RECYCLE_RSS_MB = float(os.getenv("AGENT_RECYCLE_RSS_MB", "0"))
+# Longest wait between RSS recycles while recycling does not bring RSS under the limit
+AGENT_RECYCLE_RSS_MAX_BACKOFF = float(os.getenv("AGENT_RECYCLE_RSS_MAX_BACKOFF", "3600"))
+# RSS is read, and the gauges updated, at most this often
+MEMORY_CHECK_SECONDS = float(os.getenv("MEMORY_CHECK_SECONDS", "30"))
+# Stack depth recorded by tracemalloc from startup (0 leaves it off; it can be started on demand)
+MEMORY_TRACEMALLOC_FRAMES = int(os.getenv("MEMORY_TRACEMALLOC_FRAMES", "0"))
+
+# The soak test fails when the guarded bot's RSS grows faster than this over its second half
+SOAK_MAX_GROWTH_PER_TURN = 100
+
+# Types whose live instance counts are reported: agno run state and the stub's stand-ins
+TRACKED_TYPES = ('Message', 'AgentRun', 'RunResponse', 'SimpleNamespace', 'Agent', 'StubAgentTeam')
+
+logger = logging.getLogger("woocommerce_memory")
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def rss_bytes():
+    """Resident set size of this process (Linux); 0 when unknown"""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except (FileNotFoundError, IndexError, ValueError):
+        return 0
+
+def team_agents(team):
+    """The team leader followed by its sub-agents"""
+    return [team, *(getattr(team, 'team', None) or [])]
+
+def agent_history(team):
+    """{agent name: {'runs': ..., 'messages': ...}} held in each agent's memory"""
+    history = {}
+    for agent in team_agents(team):
+        memory = getattr(agent, 'memory', None)
+        history[getattr(agent, 'name', None) or 'team'] = {
+            'runs': len(getattr(memory, 'runs', None) or []),
+            'messages': len(getattr(memory, 'messages', None) or []),
+        }
+    return history
+
+def trim_history(agent, max_runs):
+    """Drop all but the last max_runs runs of an agent, and the messages of the dropped runs.
+
+    Only call it on an agent no turn is running on: agno appends to the same
+    lists during a run. The bot doesn't add history to prompts (add_history_to_messages is off), so
+    old runs are only kept for agno's session metrics, which are recomputed over
+    every remembered message on each run. Returns the number of runs dropped.
+    """
+    memory = getattr(agent, 'memory', None)
+    runs = getattr(memory, 'runs', None)
+    if not runs or len(runs) <= max_runs:
+        return 0
+    dropped = len(runs) - max_runs
+    del runs[:dropped]
+    kept = {id(message) for run in runs
+            for message in (getattr(run.response, 'messages', None) or []) + (getattr(run, 'messages', None) or [])}
+    memory.messages[:] = [message for message in memory.messages
+                          if getattr(message, 'role', None) == 'system' or id(message) in kept]
+    return dropped
+
+def object_counts(types=TRACKED_TYPES):
+    """Live objects per type name, for the given names and the ten most common types (walks the gc heap)"""
+    counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+    tracked = {name: counts.get(name, 0) for name in types}
+    return {'tracked': tracked, 'most_common': dict(counts.most_common(10))}
+
+class PooledTeam:
+    """An agent team with the number of turns it served and the pool generation it was built in"""
+
+    def __init__(self, team, generation):
+        self.team = team
+        self.turns = 0
+        self.generation = generation
+
+class MemoryGuard:
+    """Lends every turn an agent team of its own and keeps the teams' memory bounded.
+
+    agno keeps the state of a run (run_id, run_response) on the Agent instance, so
+    two turns must never run on the same team at once. checkout() hands out an
+    idle team, or builds one with `factory` when all are busy, and takes it back
+    when the turn is over; at most `max_idle` teams are kept for reuse.
+
+    agno agents also append every run and its messages to their memory, so a
+    team grows for as long as it is used. When a team comes back, its agents are
+    trimmed to their last `max_runs` runs. A team is dropped instead after
+    `recycle_turns` turns, and every team is replaced when the process RSS is
+    above `recycle_rss` bytes (checked at most every `check_interval` seconds);
+    teams still lent out are dropped when they come back. If RSS is still above
+    the limit at the next check, the memory is held elsewhere: RSS recycles then
+    back off, doubling the wait up to `max_backoff` seconds until RSS drops again.
+
+    report() gives RSS, the history held by each agent, live object counts and,
+    when tracemalloc is on, the allocation sites that grew since the previous report.
+    """
+
+    def __init__(self, factory, max_idle=8, max_runs=AGENT_MAX_RUNS, recycle_turns=AGENT_RECYCLE_TURNS,
+                 recycle_rss=AGENT_RECYCLE_RSS_MB * 1024 * 1024, check_interval=MEMORY_CHECK_SECONDS,
+                 max_backoff=AGENT_RECYCLE_RSS_MAX_BACKOFF, tracemalloc_frames=MEMORY_TRACEMALLOC_FRAMES):
+        self.factory = factory
+        self.max_idle = max_idle
+        self.max_runs = max_runs
+        self.recycle_turns = recycle_turns
+        self.recycle_rss = recycle_rss
+        self.check_interval = check_interval
+        self.max_backoff = max_backoff
+        # Whether the last RSS check recycled, the current backoff and when RSS may recycle again
+        self.rss_recycled = False
+        self.rss_backoff = 0.0
+        self.rss_retry_at = 0.0
+        self.generation = 0
+        # Only read for what every team shares (names, instructions); it also serves turns from the pool
+        self.reference = factory()
+        self.idle = [PooledTeam(self.reference, self.generation)]
+        self.busy = set()
+        self.turns = 0
+        self.recycles = 0
+        self.checked_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.baseline = None
+        if tracemalloc_frames:
+            self.start_tracing(tracemalloc_frames)
+
+    def settings(self):
+        return {'max_idle': self.max_idle, 'max_runs': self.max_runs, 'recycle_turns': self.recycle_turns,
+                'recycle_rss_mb': self.recycle_rss / (1024 * 1024), 'check_seconds': self.check_interval,
+                'recycle_rss_max_backoff': self.max_backoff,
+                'tracemalloc': tracemalloc.is_tracing()}
+
+    @contextmanager
+    def checkout(self):
+        """Lend a team to the enclosed turn; nothing else runs on it until the block exits"""
+        with self.lock:
+            pooled = self.idle.pop() if self.idle else None
+        if pooled is None:
+            pooled = PooledTeam(self.factory(), self.generation)
+            metrics.increment('agent_teams_created')
+        with self.lock:
+            self.busy.add(pooled)
+        try:
+            yield pooled.team
+        finally:
+            self._return(pooled)
+
+    def _return(self, pooled):
+        pooled.turns += 1
+        # Nothing else uses the team until it is back in the idle list
+        if self.max_runs:
+            trimmed = sum(trim_history(agent, self.max_runs) for agent in team_agents(pooled.team))
+            if trimmed:
+                metrics.increment('agent_runs_trimmed', trimmed)
+        retired = False
+        with self.lock:
+            self.busy.discard(pooled)
+            self.turns += 1
+            now = time.monotonic()
+            check = now - self.checked_at >= self.check_interval
+            if check:
+                self.checked_at = now
+            if self.recycle_turns and pooled.turns >= self.recycle_turns:
+                retired = True
+                self.recycles += 1
+            elif pooled.generation == self.generation and len(self.idle) < self.max_idle:
+                self.idle.append(pooled)
+        if retired:
+            metrics.increment('agent_recycles', labels={'reason': 'turns'})
+        if check:
+            rss = self.publish()
+            if self.recycle_rss > 0:
+                self._check_rss(rss, now)
+
+    def _check_rss(self, rss, now):
+        """Recycle when RSS is over the limit, backing off while recycling does not bring it down"""
+        if rss <= self.recycle_rss:
+            self.rss_recycled = False
+            self.rss_backoff = 0.0
+            return
+        if self.rss_recycled:
+            self.rss_recycled = False
+            self.rss_backoff = min(2 * (self.rss_backoff or max(self.check_interval, 1.0)), self.max_backoff)
+            self.rss_retry_at = now + self.rss_backoff
+            metrics.increment('agent_recycles_ineffective')
+            logger.warning("RSS still %.0f MB after recycling the agent teams, next RSS recycle in %.0fs at the earliest",
+                           rss / (1024 * 1024), self.rss_backoff)
+        if now < self.rss_retry_at:
+            return
+        self.rss_recycled = True
+        self.recycle('rss')
+
+    def teams(self):
+        with self.lock:
+            return [pooled.team for pooled in self.idle] + [pooled.team for pooled in self.busy]
+
+    def history(self):
+        """Runs and messages held per agent name, summed over every team"""
+        totals = {}
+        for team in self.teams():
+            for name, held in agent_history(team).items():
+                total = totals.setdefault(name, {'runs': 0, 'messages': 0})
+                total['runs'] += held['runs']
+                total['messages'] += held['messages']
+        return totals
+
+    def publish(self):
+        """Update the memory gauges; returns the RSS"""
+        rss = rss_bytes()
+        metrics.set_gauge('process_rss_bytes', rss)
+        for name, held in self.history().items():
+            metrics.set_gauge('agent_runs_retained', held['runs'], {'agent': name})
+            metrics.set_gauge('agent_messages_retained', held['messages'], {'agent': name})
+        return rss
+
+    def recycle(self, reason='manual'):
+        """Replace every team: idle ones now, lent ones when they come back"""
+        with self.lock:
+            dropped = len(self.idle) + len(self.busy)
+            self.idle = []
+            self.generation += 1
+            self.recycles += 1
+        gc.collect()
+        metrics.increment('agent_recycles', labels={'reason': reason})
+        logger.info("agent teams recycled (%s), %d teams dropped", reason, dropped)
+
+    def start_tracing(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.baseline = tracemalloc.take_snapshot()
+
+    def stop_tracing(self):
+        tracemalloc.stop()
+        self.baseline = None
+
+    def report(self, top=10, objects=True):
+        """RSS, retained agent history and, on request, object counts and tracemalloc growth"""
+        with self.lock:
+            pool = {'idle': len(self.idle), 'busy': len(self.busy)}
+        report = {'pid': os.getpid(), 'rss_bytes': self.publish(), 'turns': self.turns, 'recycles': self.recycles,
+                  'teams': pool, 'agents': self.history(), 'settings': self.settings()}
+        if objects:
+            report['objects'] = object_counts()
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ])
+            if self.baseline is not None:
+                stats = snapshot.compare_to(self.baseline, 'lineno')
+            else:
+                stats = snapshot.statistics('lineno')
+            report['tracemalloc'] = {
+                'traced_bytes': current, 'peak_bytes': peak,
+                # Growth since the previous report (or since tracing started)
+                'top': [{'where': str(stat.traceback), 'size': stat.size,
+                         'size_diff': getattr(stat, 'size_diff', stat.size),
+                         'count_diff': getattr(stat, 'count_diff', stat.count)} for stat in stats[:top]],
+            }
+            self.baseline = snapshot
+        return report
+
+def soak(turns, samples):
+    """Run turns through the stub bot and print one JSON line of RSS and history per sample"""
+    import woocommerce_bot as bot
+
+    messages = ["Do you ship abroad?", "Where is my order?", "I'm looking for a cotton shirt",
+                "How do returns work?", "What payment methods do you accept?"]
+    every = max(1, turns // samples)
+    start_time = time.perf_counter()
+    for number in range(1, turns + 1):
+        bot.process_query(f"{messages[number % len(messages)]} ({number})", [],
+                          session_id=f"soak-{number % 50}")
+        if number % every == 0:
+            gc.collect()
+            held = bot.team_guard.history()
+            print(json.dumps({'turn': number, 'rss': rss_bytes(), 'seconds': time.perf_counter() - start_time,
+                              'runs': sum(agent['runs'] for agent in held.values()),
+                              'recycles': bot.team_guard.recycles}), flush=True)
+
+def run_soak(turns, samples):
+    """Soak the stub bot with the history policies off, then on, each in a fresh process"""
+    variants = [
+        ('unbounded', {'AGENT_MAX_RUNS': '0', 'AGENT_RECYCLE_TURNS': '0', 'AGENT_RECYCLE_RSS_MB': '0'}),
+        ('guarded', {}),
+    ]
+    print(f"{turns} stub turns per variant, RSS sampled {samples} times")
+    growth = {}
+    for label, overrides in variants:
+        env = {**os.environ, 'BOT_STUB_MODEL': '1', 'BOT_STUB_LATENCY': '0', 'TRANSCRIPT_DIR': '',
+               'DIRECT_ORDER_RENDERING': '0', 'LOG_LEVEL': 'WARNING', **overrides}
+        output = subprocess.run([sys.executable, __file__, '--soak-run', str(turns), '--samples', str(samples)],
+                                env=env, capture_output=True, text=True, check=True).stdout
+        points = [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+        print(f"{label}:")
+        for point in points:
+            print(f"  turn {point['turn']:>7}: RSS {point['rss'] / 1e6:7.1f} MB, {point['runs']:>7} runs held, "
+                  f"{point['recycles']} recycles, {point['seconds']:6.1f}s")
+        # Growth over the second half, once caches and the allocator have warmed up
+        middle, last = points[len(points) // 2], points[-1]
+        growth[label] = (last['rss'] - middle['rss']) / (last['turn'] - middle['turn'])
+    for label, per_turn in growth.items():
+        print(f"{label}: {per_turn:.0f} bytes of RSS per turn over the second half")
+    return growth
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test: RSS of the stub bot with and without the memory policies")
+    parser.add_argument('--turns', type=int, default=50000)
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--soak-run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.soak_run:
+        soak(args.soak_run, args.samples)
+    else:
+        growth = run_soak(args.turns, args.samples)
+        if growth['guarded'] > SOAK_MAX_GROWTH_PER_TURN:
+            sys.exit(f"RSS not bounded: {growth['guarded']:.0f} bytes per turn with the policies on")
+
+if __name__ == "__main__":
+    main()
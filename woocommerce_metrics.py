@@ -0,0 +1,134 @@
+import json
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Number of recent observations kept per series for rolling statistics
+WINDOW_SIZE = 500
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+def increment(name, value=1, labels=None):
+    """Add to a monotonically increasing counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, labels=None):
+    """Set a gauge to its current value"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, value, labels=None):
+    """Record an observation (latency, token count, ...) in a rolling window"""
+    key = _key(name, labels)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = {'count': 0, 'sum': 0.0, 'window': deque(maxlen=WINDOW_SIZE)}
+        series['count'] += 1
+        series['sum'] += value
+        series['window'].append(value)
+
+def percentile(name, fraction, labels=None, default=None):
+    """Percentile of the rolling window of a series"""
+    with _lock:
+        series = _histograms.get(_key(name, labels))
+        values = sorted(series['window']) if series else []
+    if not values:
+        return default
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def _summarize(series):
+    values = sorted(series['window'])
+    summary = {'count': series['count'], 'sum': round(series['sum'], 6)}
+    if values:
+        summary['mean'] = round(sum(values) / len(values), 6)
+        summary['p50'] = values[len(values) // 2]
+        summary['p95'] = values[min(len(values) - 1, int(0.95 * len(values)))]
+        summary['max'] = values[-1]
+    return summary
+
+def _label_text(labels):
+    return ','.join(f'{name}={value}' for name, value in labels)
+
+def snapshot():
+    """Return all metrics as a JSON-serializable dict"""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: _summarize(series) for key, series in _histograms.items()}
+    result = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for section, items in (('counters', counters), ('gauges', gauges), ('histograms', histograms)):
+        for (name, labels), value in sorted(items.items(), key=lambda item: (item[0][0], item[0][1])):
+            result[section].setdefault(name, {})[_label_text(labels)] = value
+    return result
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format"""
+    def format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((key, _summarize(series)) for key, series in _histograms.items())
+    for (name, labels), value in counters:
+        lines.append(f"woocommerce_bot_{name}_total{format_labels(labels)} {value}")
+    for (name, labels), value in gauges:
+        lines.append(f"woocommerce_bot_{name}{format_labels(labels)} {value}")
+    for (name, labels), summary in histograms:
+        for quantile in ('p50', 'p95'):
+            if quantile in summary:
+                quantile_label = (('quantile', '0.5' if quantile == 'p50' else '0.95'),)
+                lines.append(f"woocommerce_bot_{name}{format_labels(labels, quantile_label)} {summary[quantile]}")
+        lines.append(f"woocommerce_bot_{name}_count{format_labels(labels)} {summary['count']}")
+        lines.append(f"woocommerce_bot_{name}_sum{format_labels(labels)} {summary['sum']}")
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Clear all metrics"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve /metrics (Prometheus text) and /metrics.json"""
+
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body = json.dumps(snapshot(), indent=2, default=str).encode('utf-8')
+            content_type = 'application/json'
+        elif self.path.startswith('/metrics'):
+            body = render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep scrapes out of the console
+        pass
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Start the metrics HTTP endpoint in a background thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
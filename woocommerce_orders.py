@@ -0,0 +1,197 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import woocommerce_db
+import woocommerce_metrics as metrics
+
+# Start order lookups as soon as a message mentions an email or order number
+PREFETCH_ORDERS = os.getenv("PREFETCH_ORDERS", "1").lower() in ("1", "true", "yes")
+# Unused prefetched results are dropped after this many seconds
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "30"))
+
+# WooCommerce order statuses: customer-facing label and explanation
+STATUS_MAPPING = {
+    'wc-pending': ('Pending payment', "We've received your order but are still waiting for the payment to go through."),
+    'wc-processing': ('Processing', "Your payment was received and we're preparing your order for shipping."),
+    'wc-on-hold': ('On hold', "Your order is on hold, usually while we confirm the payment. We'll update you soon."),
+    'wc-completed': ('Completed', "Your order has been fulfilled and shipped. It's on its way or already delivered."),
+    'wc-cancelled': ('Cancelled', "This order was cancelled. If that's unexpected, please contact our support team."),
+    'wc-refunded': ('Refunded', "This order was refunded. The money goes back to your original payment method."),
+    'wc-failed': ('Failed', "The payment for this order failed. You can place the order again or contact support."),
+}
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+ORDER_ID_PATTERN = re.compile(r"(?:\border\s*(?:#|no\.?|number|id)?\s*:?\s*#?|#)\s*(\d{2,})\b", re.IGNORECASE)
+STATUS_PATTERN = re.compile(
+    r"\b(status|where(?:'s| is)|track|tracking|check|update on|shipped|arrive|arriving|delivered)\b", re.IGNORECASE
+)
+# Anything beyond a plain lookup (changes, complaints, explanations) still goes to the agents
+OTHER_INTENT_PATTERN = re.compile(
+    r"\b(cancel|return|refund|change|modify|exchange|complain|damaged|wrong|missing|invoice|why|address|"
+    r"product|buy|price|and|also|other)\b",
+    re.IGNORECASE
+)
+
+@dataclass
+class OrderStatus:
+    """One order as returned by the order status lookup"""
+    order_id: int
+    status_code: str
+    order_date: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    total: Optional[str]
+
+    @property
+    def status(self):
+        return STATUS_MAPPING.get(self.status_code, (self.status_code, None))[0]
+
+    @property
+    def explanation(self):
+        return STATUS_MAPPING.get(self.status_code, (None, None))[1]
+
+    def to_dict(self):
+        return dict(asdict(self), status=self.status, explanation=self.explanation)
+
+def fetch_orders(email=None, order_id=None):
+    """Look up the latest orders for an email and/or order ID"""
+    query, params = woocommerce_db.order_status_query(email, order_id)
+    # Read-only lookup: served by a replica when DB_READ_REPLICAS is configured
+    rows = woocommerce_db.read_query('get_order_status', query, params, dictionary=True)
+    return [
+        OrderStatus(
+            order_id=row['order_id'],
+            status_code=row['order_status'],
+            order_date=row['order_date'].strftime('%Y-%m-%d %H:%M:%S') if row['order_date'] else None,
+            first_name=row.get('first_name'),
+            last_name=row.get('last_name'),
+            total=row.get('total'),
+        )
+        for row in rows
+    ]
+
+def format_order_status(orders, email=None, order_id=None):
+    """Tool output handed to the order status agent"""
+    if not orders:
+        if order_id:
+            return f"No order found with ID {order_id}."
+        return f"No orders found for email {email}."
+
+    result = ["Here are the order details:"]
+    for order in orders:
+        result.append(f"Order #{order.order_id}")
+        result.append(f"Date: {order.order_date or 'N/A'}")
+        result.append(f"Customer: {order.first_name or ''} {order.last_name or ''}")
+        result.append(f"Total: ${order.total or 'N/A'}")
+        result.append(f"Status: {order.status}")
+        result.append("---")
+    return "\n".join(result)
+
+def render_order_reply(orders, email=None, order_id=None):
+    """Customer-facing answer rendered straight from the lookup, without a model pass"""
+    if not orders:
+        if order_id:
+            return (f"I couldn't find an order with ID {order_id}. Please double-check the number, "
+                    "or share the email address you used at checkout.")
+        return (f"I couldn't find any orders for {email}. Please check the address, "
+                "or share your order number instead.")
+
+    if len(orders) == 1:
+        lines = [f"Here's the latest on order #{orders[0].order_id}:", ""]
+    else:
+        lines = [f"Here are your {len(orders)} most recent orders:", ""]
+    for order in orders:
+        placed = f" (placed {order.order_date[:10]})" if order.order_date else ""
+        lines.append(f"**Order #{order.order_id}**{placed}")
+        lines.append(f"- Status: **{order.status}**" + (f" - {order.explanation}" if order.explanation else ""))
+        if order.total:
+            lines.append(f"- Total: ${order.total}")
+        lines.append("")
+    lines.append("Is there anything else I can help you with?")
+    return "\n".join(lines)
+
+def extract_order_identifiers(message):
+    """Pull an email address and/or order number out of a message"""
+    email_match = EMAIL_PATTERN.search(message or '')
+    order_match = ORDER_ID_PATTERN.search(message or '')
+    return (email_match.group(0) if email_match else None, order_match.group(1) if order_match else None)
+
+def route_order_status(message, max_length=200):
+    """Return (email, order_id) when the message is confidently a plain status lookup, else None"""
+    if not message or len(message) > max_length:
+        return None
+    email, order_id = extract_order_identifiers(message)
+    if not email and not order_id:
+        return None
+    # Strip the identifiers so words inside them don't count as other intents
+    remainder = EMAIL_PATTERN.sub(' ', message)
+    if not STATUS_PATTERN.search(remainder) or OTHER_INTENT_PATTERN.search(remainder):
+        return None
+    return email, order_id
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="order-prefetch")
+_prefetch_lock = threading.Lock()
+_prefetched = {}
+
+def _prefetch_key(email, order_id):
+    # The same normalization on both sides, so "#123" and "123" or a capitalized email still match
+    return ((email or '').strip().lower() or None, str(order_id).strip().lstrip('#') if order_id else None)
+
+def _timed_fetch(email, order_id):
+    start_time = time.perf_counter()
+    orders = fetch_orders(email, order_id)
+    return orders, time.perf_counter() - start_time
+
+def _expire_prefetched(now):
+    for key in [key for key, entry in _prefetched.items() if entry['expires'] <= now]:
+        del _prefetched[key]
+        metrics.increment('order_prefetch_unused')
+
+def prefetch_orders(message):
+    """Start the likely get_order_status lookup in the background while the model is thinking"""
+    if not PREFETCH_ORDERS:
+        return None
+    email, order_id = extract_order_identifiers(message)
+    if not email and not order_id:
+        return None
+    key = _prefetch_key(email, order_id)
+    now = time.monotonic()
+    with _prefetch_lock:
+        _expire_prefetched(now)
+        if key in _prefetched:
+            return key
+        _prefetched[key] = {
+            'future': _prefetch_executor.submit(_timed_fetch, email, order_id),
+            'expires': now + PREFETCH_TTL,
+        }
+    metrics.increment('order_prefetch_started')
+    return key
+
+def take_prefetched(email, order_id):
+    """Return prefetched orders for exactly these arguments, or None if nothing usable was prefetched"""
+    key = _prefetch_key(email, order_id)
+    with _prefetch_lock:
+        entry = _prefetched.pop(key, None)
+    if entry is not None and entry['expires'] <= time.monotonic():
+        # Older than PREFETCH_TTL but not swept yet: the order may have changed since
+        metrics.increment('order_prefetch_unused')
+        entry = None
+    if entry is None:
+        metrics.increment('order_prefetch_misses')
+        return None
+    waited_from = time.perf_counter()
+    try:
+        orders, fetch_seconds = entry['future'].result()
+    except Exception:
+        # A failed prefetch is retried by the tool itself
+        metrics.increment('order_prefetch_errors')
+        return None
+    waited = time.perf_counter() - waited_from
+    metrics.increment('order_prefetch_hits')
+    metrics.increment('order_prefetch_seconds_saved', max(0.0, fetch_seconds - waited))
+    return orders
@@ -0,0 +1,222 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+
+# Saved store pages (shipping, returns, privacy...) and the knowledge file built from them
+KNOWLEDGE_PAGES_DIR = os.getenv("KNOWLEDGE_PAGES_DIR", "pages")
+KNOWLEDGE_PAGES_FILE = os.getenv("KNOWLEDGE_PAGES_FILE", "policy_pages.csv")
+# Sections longer than this are split at paragraph boundaries
+CHUNK_CHARS = 800
+
+# Page furniture that never holds policy text
+NOISE_TAGS = ['script', 'style', 'noscript', 'nav', 'header', 'footer', 'form', 'aside', 'svg', 'iframe']
+HEADING_TAGS = ['h1', 'h2', 'h3', 'h4']
+BLOCK_TAGS = ['p', 'li', 'td', 'th', 'dd', 'dt', 'blockquote', 'pre']
+
+def _clean(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+def _split(paragraphs, limit=CHUNK_CHARS):
+    """Group paragraphs into chunks of at most `limit` characters (a longer paragraph stays whole)"""
+    chunks, current = [], []
+    for paragraph in paragraphs:
+        if current and len(' '.join(current)) + len(paragraph) + 1 > limit:
+            chunks.append(' '.join(current))
+            current = []
+        current.append(paragraph)
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+def parse_page(path):
+    """Turn one saved HTML page into FAQ-style (question, answer) chunks, one or more per section"""
+    with open(path, 'rb') as file:
+        soup = BeautifulSoup(file.read(), 'html.parser')
+    for tag in soup(NOISE_TAGS):
+        tag.decompose()
+    # WordPress themes put the page body in <main>/<article>; fall back to the whole body
+    root = soup.find('main') or soup.find('article') or soup.body or soup
+    title_tag = soup.find('h1') or soup.title
+    page_title = _clean(title_tag.get_text(' ')) if title_tag else os.path.splitext(os.path.basename(path))[0]
+
+    sections = []
+    heading, paragraphs = page_title, []
+    for element in root.find_all(HEADING_TAGS + BLOCK_TAGS):
+        if element.name in HEADING_TAGS:
+            if paragraphs:
+                sections.append((heading, paragraphs))
+            text = _clean(element.get_text(' '))
+            heading = text if element.name == 'h1' or text == page_title else f"{page_title}: {text}"
+            paragraphs = []
+        elif not element.find_parent(BLOCK_TAGS):
+            # Nested blocks (a <p> inside an <li>) are already part of their parent's text
+            text = _clean(element.get_text(' '))
+            if text:
+                paragraphs.append(text)
+    if paragraphs:
+        sections.append((heading, paragraphs))
+    return [(heading, chunk) for heading, paragraphs in sections for chunk in _split(paragraphs)]
+
+def page_hash(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+class PageIngester:
+    """Keep a knowledge file (same tab-separated format as faq.csv) in line with a directory of pages.
+
+    A manifest next to the output remembers each page's content hash and chunks, so
+    only new or edited pages are parsed again; those are parsed in a process pool.
+    Unchanged chunks keep their exact text, so the FAQ reloader and the vector
+    store skip them by content hash as well.
+    """
+
+    def __init__(self, directory=KNOWLEDGE_PAGES_DIR, output=KNOWLEDGE_PAGES_FILE, workers=None):
+        self.directory = directory
+        self.output = output
+        self.manifest_path = f"{output}.manifest.json"
+        self.workers = workers or os.cpu_count()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def ingest(self):
+        """Parse changed pages, rewrite the knowledge file if anything changed and return a report"""
+        start_time = time.perf_counter()
+        manifest = self._load_manifest()
+        names = sorted(name for name in os.listdir(self.directory) if name.lower().endswith(('.html', '.htm')))
+        hashes = {name: page_hash(os.path.join(self.directory, name)) for name in names}
+        changed = [name for name in names if manifest.get(name, {}).get('hash') != hashes[name]]
+        removed = [name for name in manifest if name not in hashes]
+
+        if changed:
+            paths = [os.path.join(self.directory, name) for name in changed]
+            if len(changed) == 1 or self.workers == 1:
+                parsed = [parse_page(path) for path in paths]
+            else:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(changed))) as executor:
+                    chunksize = max(1, len(changed) // (4 * self.workers))
+                    parsed = list(executor.map(parse_page, paths, chunksize=chunksize))
+            for name, chunks in zip(changed, parsed):
+                manifest[name] = {'hash': hashes[name], 'chunks': [list(chunk) for chunk in chunks]}
+        for name in removed:
+            del manifest[name]
+        parse_seconds = time.perf_counter() - start_time
+
+        if changed or removed or not os.path.exists(self.output):
+            self._write(names, manifest)
+        chunk_count = sum(len(manifest[name]['chunks']) for name in names)
+        return {
+            'pages': len(names),
+            'parsed': len(changed),
+            'removed': len(removed),
+            'chunks': chunk_count,
+            'seconds': time.perf_counter() - start_time,
+            'pages_per_second': len(changed) / parse_seconds if changed and parse_seconds else 0.0,
+        }
+
+    def _write(self, names, manifest):
+        # Readers (the FAQ reloader) only ever see a complete file
+        temp_path = f"{self.output}.tmp"
+        with open(temp_path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, delimiter='\t')
+            writer.writerow(['question', 'answer'])
+            for name in names:
+                writer.writerows(manifest[name]['chunks'])
+        os.replace(temp_path, self.output)
+        with open(f"{self.manifest_path}.tmp", 'w') as file:
+            json.dump(manifest, file)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+SYNTHETIC_PAGE = """<!DOCTYPE html>
+<html><head><title>{title} - Store</title><script>var tracking = {number};</script></head>
+<body><header><nav><a href="/">Home</a><a href="/shop/">Shop</a></nav></header>
+<main><article><h1>{title}</h1>
+{sections}
+</article></main><footer><p>Copyright Store</p></footer></body></html>
+"""
+
+def generate_synthetic(directory, pages, sections=6):
+    os.makedirs(directory, exist_ok=True)
+    for number in range(pages):
+        body = "\n".join(
+            f"<h2>Section {section}</h2>" + "".join(
+                f"<p>Rule {section}.{paragraph} of policy {number}: orders shipped to zone {paragraph} arrive within "
+                f"{section + paragraph} business days and can be returned within {10 + section} days.</p>"
+                for paragraph in range(4)
+            ) + f"<ul><li>Exception {section}a for policy {number}</li><li>Exception {section}b</li></ul>"
+            for section in range(sections)
+        )
+        with open(os.path.join(directory, f"policy-{number}.html"), 'w', encoding='utf-8') as file:
+            file.write(SYNTHETIC_PAGE.format(title=f"Policy {number}", number=number, sections=body))
+
+def run_benchmark(pages, workers):
+    from woocommerce_faq_reload import FaqReloader
+    from woocommerce_vector_store import LocalVectorStore
+
+    directory = tempfile.mkdtemp(prefix='pages_benchmark_')
+    try:
+        pages_dir = os.path.join(directory, 'pages')
+        faq_file = os.path.join(directory, 'faq.csv')
+        output = os.path.join(directory, 'policy_pages.csv')
+        shutil.copy('faq.csv', faq_file)
+        generate_synthetic(pages_dir, pages)
+
+        for label, worker_count in [('1 process', 1), (f'{workers} processes', workers)]:
+            for name in os.listdir(directory):
+                if name.startswith('policy_pages.csv'):
+                    os.remove(os.path.join(directory, name))
+            report = PageIngester(pages_dir, output, worker_count).ingest()
+            print(f"full ingest, {label:>12}: {report['pages']} pages -> {report['chunks']} chunks in "
+                  f"{report['seconds']:.2f}s ({report['pages_per_second']:.0f} pages/s)")
+
+        reloader = FaqReloader(faq_file, vector_store=LocalVectorStore(os.path.join(directory, 'vectors')),
+                               extra_paths=[output])
+        print(f"initial index: {len(reloader.current.data)} entries")
+
+        edited = os.path.join(pages_dir, 'policy-0.html')
+        with open(edited, encoding='utf-8') as file:
+            html = file.read()
+        with open(edited, 'w', encoding='utf-8') as file:
+            file.write(html.replace('arrive within 1 business days', 'arrive within 2 business days'))
+
+        start_time = time.perf_counter()
+        report = PageIngester(pages_dir, output, workers).ingest()
+        ingested = time.perf_counter()
+        reloader.check()
+        reindexed = time.perf_counter()
+        print(f"single-page edit: ingest {(ingested - start_time) * 1000:.0f}ms ({report['parsed']} page parsed), "
+              f"re-index {(reindexed - ingested) * 1000:.0f}ms, total {(reindexed - start_time) * 1000:.0f}ms")
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn saved store pages into knowledge chunks for the FAQ agent")
+    parser.add_argument('--pages', default=KNOWLEDGE_PAGES_DIR, help="Directory of saved .html pages")
+    parser.add_argument('--output', default=KNOWLEDGE_PAGES_FILE, help="Tab-separated knowledge file to write")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Parser processes")
+    parser.add_argument('--benchmark', type=int, metavar='PAGES', help="Ingest PAGES synthetic pages and time an edit")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark, args.workers)
+        return
+    report = PageIngester(args.pages, args.output, args.workers).ingest()
+    print(f"{report['pages']} pages ({report['parsed']} parsed, {report['removed']} removed) -> "
+          f"{report['chunks']} chunks in {args.output}, {report['seconds']:.2f}s "
+          f"({report['pages_per_second']:.0f} pages/s)")
+
+if __name__ == "__main__":
+    main()
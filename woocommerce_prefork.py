@@ -0,0 +1,298 @@
+import argparse
+import importlib
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import uvicorn
+from dotenv import load_dotenv
+
+import woocommerce_facets
+from woocommerce_faq_reload import FaqReloader
+from woocommerce_faq_store import generate_synthetic
+from woocommerce_pages import KNOWLEDGE_PAGES_FILE
+from woocommerce_vector_store import create_vector_store
+
+load_dotenv()
+
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", str(os.cpu_count() or 1)))
+# How often the launcher logs per-worker memory and throughput (0 disables the report)
+PREFORK_REPORT_SECONDS = float(os.getenv("PREFORK_REPORT_SECONDS", "30"))
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_KEEP_ALIVE = int(os.getenv("API_KEEP_ALIVE", "30"))
+FAQ_RELOAD_SECONDS = float(os.getenv("FAQ_RELOAD_SECONDS", "5"))
+# Files the launcher publishes and the workers map; FAQ_SNAPSHOT/FAQ_EMBEDDINGS override them
+PREFORK_FAQ_SNAPSHOT = os.getenv("FAQ_SNAPSHOT") or "faq.snapshot"
+PREFORK_FAQ_EMBEDDINGS = os.getenv("FAQ_EMBEDDINGS") or "faq_embeddings"
+
+logger = logging.getLogger("woocommerce_prefork")
+
+def memory_usage(pid):
+    """RSS of a process split into pages shared with other processes and its own (bytes).
+
+    Pss charges each shared page 1/N to each of the N processes mapping it, so
+    summing Pss over the workers gives their real combined footprint.
+    """
+    usage = {'rss': 0, 'pss': 0, 'shared': 0, 'private': 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            fields = dict(line.split(':', 1) for line in file if ':' in line and not line.startswith(' '))
+    except FileNotFoundError:
+        return usage
+    kilobytes = {name: int(value.split()[0]) * 1024 for name, value in fields.items() if value.strip().endswith('kB')}
+    usage['rss'] = kilobytes.get('Rss', 0)
+    usage['pss'] = kilobytes.get('Pss', 0)
+    usage['shared'] = kilobytes.get('Shared_Clean', 0) + kilobytes.get('Shared_Dirty', 0)
+    usage['private'] = kilobytes.get('Private_Clean', 0) + kilobytes.get('Private_Dirty', 0)
+    return usage
+
+def process_tree(pid):
+    """A process and all its descendants (Linux)"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as file:
+            children = [int(child) for child in file.read().split()]
+    except FileNotFoundError:
+        children = []
+    return [pid] + [descendant for child in children for descendant in process_tree(child)]
+
+def build_shared(faq_path='faq.csv'):
+    """Parse the FAQ and write the snapshot and vectors once, in the launcher"""
+    reloader = FaqReloader(faq_path, snapshot_path=PREFORK_FAQ_SNAPSHOT,
+                           vector_store=create_vector_store(PREFORK_FAQ_EMBEDDINGS),
+                           extra_paths=[KNOWLEDGE_PAGES_FILE])
+    # The product facet index lives in NumPy arrays; built before forking, the workers share
+    # its pages copy-on-write until their own incremental refresh replaces an array
+    if os.getenv("BOT_STUB_MODEL", "0").lower() not in ("1", "true", "yes"):
+        try:
+            woocommerce_facets.refresh()
+        except Exception as e:
+            logger.warning("Facet index not preloaded, workers will build it on first use: %s", e)
+    return reloader
+
+def run_worker(number, listener, counters):
+    """Body of a forked worker: serve the API on the inherited socket, never return"""
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_DFL)
+    status = 0
+    try:
+        import woocommerce_api
+
+        @woocommerce_api.app.middleware("http")
+        async def count_requests(request, call_next):
+            response = await call_next(request)
+            # Only this worker writes its slot, from the event loop thread
+            counters[number] += 1
+            return response
+
+        config = uvicorn.Config(woocommerce_api.app, timeout_keep_alive=API_KEEP_ALIVE,
+                                log_level=os.getenv("LOG_LEVEL", "info").lower())
+        uvicorn.Server(config).run(sockets=[listener])
+    except BaseException:
+        logger.exception("Worker %d crashed", number)
+        status = 1
+    finally:
+        # Skip the parent's atexit handlers and inherited connection cleanup
+        os._exit(status)
+
+class Launcher:
+    """Bind the API socket, build the shared FAQ files, then fork and supervise N workers.
+
+    Workers map the FAQ snapshot and vectors read-only, so the page cache holds
+    one copy for all of them. The launcher alone watches faq.csv; a change is
+    written to new files that replace the old ones atomically, and every worker
+    re-maps them on its next poll.
+
+    The workers are forked, and forked again when they die, by a supervisor
+    process that the launcher forks before it starts the reloader thread. The
+    supervisor never starts a thread, so no worker can inherit a lock (logging,
+    the metrics registry) that another thread held at the moment of the fork.
+    """
+
+    def __init__(self, workers=PREFORK_WORKERS, host=API_HOST, port=API_PORT, report_seconds=PREFORK_REPORT_SECONDS):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.report_seconds = report_seconds
+        self.pids = {}
+        self.supervisor = None
+        self.stopping = False
+        # Requests served and current pid per worker, in shared memory that survives the fork
+        self.counters = multiprocessing.RawArray('q', workers)
+        self.worker_pids = multiprocessing.RawArray('q', workers)
+
+    def _bind(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(2048)
+        listener.set_inheritable(True)
+        return listener
+
+    def _spawn(self, number):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(number, self.listener, self.counters)
+        self.pids[pid] = number
+        self.worker_pids[number] = pid
+        logger.info("Worker %d started (pid %d)", number, pid)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _reap(self):
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            number = self.pids.pop(pid, None)
+            if number is not None and not self.stopping:
+                logger.warning("Worker %d (pid %d) exited with status %d, restarting", number, pid, status)
+                self._spawn(number)
+
+    def _supervise(self):
+        """Body of the supervisor: fork the workers, replace those that exit, never return"""
+        status = 0
+        try:
+            for number in range(self.workers):
+                self._spawn(number)
+            while not self.stopping:
+                time.sleep(0.5)
+                self._reap()
+            for pid in self.pids:
+                os.kill(pid, signal.SIGTERM)
+            for pid in list(self.pids):
+                os.waitpid(pid, 0)
+            logger.info("All workers stopped")
+        except BaseException:
+            logger.exception("Worker supervisor crashed")
+            status = 1
+        finally:
+            os._exit(status)
+
+    def report(self, previous_counts, elapsed):
+        """Log memory and requests/s per worker; returns the current request counts"""
+        counts = list(self.counters)
+        total_rate = 0.0
+        totals = {'rss': 0, 'pss': 0}
+        pids = [(number, pid) for number, pid in enumerate(self.worker_pids) if pid]
+        for number, pid in pids:
+            usage = memory_usage(pid)
+            rate = (counts[number] - previous_counts[number]) / elapsed if elapsed else 0.0
+            total_rate += rate
+            totals['rss'] += usage['rss']
+            totals['pss'] += usage['pss']
+            logger.info("worker %d pid %d: rss %.0f MB (shared %.0f MB, private %.0f MB), pss %.0f MB, %.1f req/s",
+                        number, pid, usage['rss'] / 1e6, usage['shared'] / 1e6, usage['private'] / 1e6,
+                        usage['pss'] / 1e6, rate)
+        logger.info("%d workers: %.1f req/s total, rss sum %.0f MB, pss sum %.0f MB",
+                    len(pids), total_rate, totals['rss'] / 1e6, totals['pss'] / 1e6)
+        return counts
+
+    def run(self):
+        self.listener = self._bind()
+        reloader = build_shared()
+        logger.info("Shared FAQ files ready: %d entries in %s", reloader.current.entry_count, PREFORK_FAQ_SNAPSHOT)
+        os.environ.update(FAQ_SNAPSHOT=PREFORK_FAQ_SNAPSHOT, FAQ_EMBEDDINGS=PREFORK_FAQ_EMBEDDINGS,
+                          FAQ_FOLLOW_SNAPSHOT="1")
+        # Import the app (agno, FastAPI, the bot module) once here; the workers share those pages
+        # copy-on-write instead of each importing its own copy. Importing starts no threads.
+        importlib.import_module("woocommerce_api")
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        # Forked while this process is still single-threaded; all worker forks happen in there
+        self.supervisor = os.fork()
+        if self.supervisor == 0:
+            self._supervise()
+        logger.info("Worker supervisor started (pid %d)", self.supervisor)
+
+        reloader.start(FAQ_RELOAD_SECONDS)
+        counts = list(self.counters)
+        last_report = time.monotonic()
+        while not self.stopping:
+            time.sleep(0.5)
+            pid, status = os.waitpid(self.supervisor, os.WNOHANG)
+            if pid:
+                logger.error("Worker supervisor (pid %d) exited with status %d, shutting down", pid, status)
+                self.supervisor = None
+                break
+            now = time.monotonic()
+            if self.report_seconds and now - last_report >= self.report_seconds:
+                counts = self.report(counts, now - last_report)
+                last_report = now
+
+        reloader.stop()
+        if self.supervisor:
+            os.kill(self.supervisor, signal.SIGTERM)
+            os.waitpid(self.supervisor, 0)
+
+def run_benchmark(workers, faq_rows, clients, seconds, stub_latency, port):
+    """Serve a synthetic FAQ with uvicorn workers (each parses its own copy) and with the prefork launcher"""
+    from woocommerce_api import drive_load, wait_until_up
+
+    directory = tempfile.mkdtemp(prefix='prefork_benchmark_')
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        generate_synthetic(os.path.join(directory, 'faq.csv'), faq_rows)
+        messages = [f"How do I handle request type {number} for product line {number % 97}?" for number in range(50)]
+        env = dict(os.environ, BOT_STUB_MODEL='1', BOT_STUB_LATENCY=str(stub_latency), SESSION_RATE_PER_MINUTE='0',
+                   LOG_LEVEL='warning', PREFORK_REPORT_SECONDS='0', PYTHONPATH=here,
+                   FAQ_SNAPSHOT=os.path.join(directory, 'faq.snapshot'),
+                   FAQ_EMBEDDINGS=os.path.join(directory, 'faq_embeddings'))
+        url = f"http://127.0.0.1:{port}"
+        print(f"{faq_rows} FAQ rows, {workers} workers, stub latency {stub_latency * 1000:.0f}ms, "
+              f"{clients} clients, {seconds}s per run")
+        runs = [
+            ('uvicorn workers', [sys.executable, os.path.join(here, 'woocommerce_api.py'),
+                                 '--port', str(port), '--workers', str(workers)],
+             # Without the launcher every worker parses faq.csv into its own copy
+             {'FAQ_SNAPSHOT': '', 'FAQ_EMBEDDINGS': ''}),
+            ('prefork + mmap', [sys.executable, os.path.join(here, 'woocommerce_prefork.py'),
+                                '--port', str(port), '--workers', str(workers)], {}),
+        ]
+        for label, command, overrides in runs:
+            run_env = {name: value for name, value in dict(env, **overrides).items() if value != ''}
+            server = subprocess.Popen(command, env=run_env, cwd=directory)
+            try:
+                wait_until_up(url, timeout=300)
+                latencies, errors, wall = drive_load(url, clients, seconds, messages)
+                # Supervisor, workers and helpers alike: the Pss sum is what the whole server costs
+                usages = [memory_usage(pid) for pid in process_tree(server.pid)]
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{label:>16}: {len(latencies) / wall:7.1f} req/s, {errors} rejected; "
+                  f"pss sum {sum(usage['pss'] for usage in usages) / 1e6:.0f} MB over {len(usages)} processes (rss "
+                  + ", ".join(f"{usage['rss'] / 1e6:.0f}" for usage in usages) + " MB)")
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the chat API from forked workers sharing memory-mapped FAQ files")
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--workers', type=int, default=PREFORK_WORKERS)
+    parser.add_argument('--benchmark', type=int, metavar='FAQ_ROWS',
+                        help="Compare memory and throughput with plain uvicorn workers on a synthetic FAQ")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--stub-latency', type=float, default=0.05)
+    args = parser.parse_args()
+    if args.benchmark:
+        run_benchmark(args.workers, args.benchmark, args.clients, args.seconds, args.stub_latency, args.port)
+    else:
+        logging.basicConfig(level=os.getenv("LOG_LEVEL", "info").upper(), format="%(asctime)s %(name)s %(message)s")
+        Launcher(args.workers, args.host, args.port).run()
+
+if __name__ == "__main__":
+    main()
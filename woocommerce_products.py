@@ -0,0 +1,58 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+import woocommerce_db
+
+load_dotenv()
+
+WC_URL = os.getenv("WC_URL")
+
+STOCK_STATUS_LABELS = {
+    'instock': 'In stock',
+    'outofstock': 'Out of stock',
+    'onbackorder': 'Available on backorder',
+}
+
+@dataclass
+class Product:
+    """A product search hit enriched with its price, stock status and SKU"""
+    product_id: int
+    title: str
+    slug: str
+    price: Optional[str] = None
+    stock_status: Optional[str] = None
+    sku: Optional[str] = None
+
+    @property
+    def link(self):
+        return f"{WC_URL}/product/{self.slug}/"
+
+    @property
+    def stock(self):
+        return STOCK_STATUS_LABELS.get(self.stock_status, self.stock_status)
+
+def find_products(product_name):
+    """Search published products by title; price, stock status and SKU come back in the same query"""
+    query, params = woocommerce_db.product_search_query(product_name)
+    rows = woocommerce_db.read_query('search_products', query, params)
+    return [Product(product_id=row[0], title=row[1], slug=row[2], price=row[3], stock_status=row[4], sku=row[5])
+            for row in rows]
+
+def format_products(products, product_name):
+    """Tool output handed to the product search agent"""
+    if not products:
+        return f"No products found with the name '{product_name}'."
+    result = ["Here are the products that match your search:"]
+    for product in products:
+        result.append(f"Product: {product.title}")
+        result.append(f"Price: ${product.price}" if product.price else "Price: N/A")
+        if product.stock:
+            result.append(f"Stock: {product.stock}")
+        if product.sku:
+            result.append(f"SKU: {product.sku}")
+        result.append(f"Link: {product.link}")
+        result.append("---")
+    return "\n".join(result)
@@ -0,0 +1,213 @@
+import argparse
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import woocommerce_metrics as metrics
+
+load_dotenv()
+
+# Share of turns profiled (0 disables profiling, 1 profiles every turn); selection is by trace id
+PROFILE_FRACTION = float(os.getenv("PROFILE_FRACTION", "0"))
+# Profiles of turns faster than this are thrown away
+PROFILE_MIN_SECONDS = float(os.getenv("PROFILE_MIN_SECONDS", "5"))
+# Stack sampling interval
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+logger = logging.getLogger("woocommerce_profiling")
+
+# The profile of the turn being handled; copied into the model worker threads with the rest of the context
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+def _frame_label(frame):
+    code = frame.f_code
+    # The function's first line, so samples anywhere in a function add up to one frame
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def collapsed_stack(frame):
+    """Root-first frames joined by ';', as in Brendan Gregg's collapsed stack format"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame).replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+class TurnProfile:
+    """Stack samples of the threads working on one turn"""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        # thread ident -> root label (the request thread, or the worker of a model call)
+        self.threads = {}
+        self.samples = Counter()
+        self.started = time.perf_counter()
+
+class SamplingProfiler:
+    """Statistical profiler for selected chat turns.
+
+    While at least one selected turn is running, a sampler thread reads the stacks
+    of that turn's threads every `interval` seconds: the thread running
+    process_query, plus any thread that runs part of the turn through run_tracked()
+    (the ResilientCaller workers that make the model calls). Turns that finish
+    under `min_seconds` are discarded. The rest are written to
+    `<directory>/<time>-<trace id>.folded` as collapsed stacks, which speedscope,
+    flamegraph.pl and inferno load as they are.
+
+    fraction, min_seconds and interval may be changed while the bot is running.
+    """
+
+    def __init__(self, fraction=PROFILE_FRACTION, min_seconds=PROFILE_MIN_SECONDS,
+                 interval=PROFILE_INTERVAL_MS / 1000, directory=PROFILE_DIR):
+        self.fraction = fraction
+        self.min_seconds = min_seconds
+        self.interval = interval
+        self.directory = directory
+        self.active = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def settings(self):
+        return {'fraction': self.fraction, 'min_seconds': self.min_seconds,
+                'interval_ms': self.interval * 1000, 'directory': self.directory}
+
+    def configure(self, fraction=None, min_seconds=None, interval_ms=None):
+        if fraction is not None:
+            if not 0 <= fraction <= 1:
+                raise ValueError("fraction must be between 0 and 1")
+            self.fraction = fraction
+        if min_seconds is not None:
+            self.min_seconds = max(0.0, min_seconds)
+        if interval_ms is not None:
+            self.interval = max(0.001, interval_ms / 1000)
+        logger.info("profiling settings: %s", self.settings())
+        return self.settings()
+
+    def selected(self, trace_id):
+        """Whether a turn is profiled; by trace id, so every process agrees on the same turns"""
+        return self.fraction > 0 and int(trace_id[:8], 16) < self.fraction * 0x100000000
+
+    def _ensure_sampler(self):
+        # Started on first use, and again after a fork
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._sample_loop, name='profile-sampler', daemon=True)
+            self.thread.start()
+
+    def _sample_loop(self):
+        while True:
+            with self.lock:
+                profiles = list(self.active.values())
+            if not profiles:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                for ident, root in list(profile.threads.items()):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.samples[f"{root};{collapsed_stack(frame)}"] += 1
+            del frames
+            time.sleep(self.interval)
+
+    @contextmanager
+    def profile_turn(self, trace_id, stats=None):
+        """Profile the enclosed turn if it is selected; a kept profile's path goes into stats['profile']"""
+        if not self.selected(trace_id):
+            yield None
+            return
+        profile = TurnProfile(trace_id)
+        profile.threads[threading.get_ident()] = 'request'
+        token = current_profile.set(profile)
+        with self.lock:
+            self._ensure_sampler()
+            self.active[trace_id] = profile
+        self.wake.set()
+        try:
+            yield profile
+        finally:
+            with self.lock:
+                self.active.pop(trace_id, None)
+            current_profile.reset(token)
+            elapsed = time.perf_counter() - profile.started
+            if elapsed >= self.min_seconds and profile.samples:
+                path = self._write(profile, elapsed)
+                if stats is not None and path:
+                    stats['profile'] = path
+            else:
+                metrics.increment('profiles_discarded')
+
+    def _write(self, profile, elapsed):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+            path = os.path.join(self.directory, f"{stamp}-{profile.trace_id}.folded")
+            with open(path, 'w', encoding='utf-8') as file:
+                for stack, count in sorted(profile.samples.items()):
+                    file.write(f"{stack} {count}\n")
+        except OSError as e:
+            logger.error("Writing the profile of turn %s failed: %s", profile.trace_id, e)
+            return None
+        metrics.increment('profiles_captured')
+        logger.info("turn %s took %.1fs, profile written to %s (%d samples)",
+                    profile.trace_id, elapsed, path, sum(profile.samples.values()))
+        return path
+
+profiler = SamplingProfiler()
+
+def run_tracked(function, *args):
+    """Call function(*args), sampling this thread as part of the current turn's profile, if any.
+
+    Meant for work handed to other threads with a copied context, such as ResilientCaller attempts.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return function(*args)
+    ident = threading.get_ident()
+    profile.threads[ident] = threading.current_thread().name
+    try:
+        return function(*args)
+    finally:
+        profile.threads.pop(ident, None)
+
+def _busy_turn(seconds):
+    """Stand-in for a slow turn: some Python work in a worker thread, as a model call would do, then a wait"""
+    def attempt():
+        deadline = time.perf_counter() + seconds / 2
+        total = 0
+        while time.perf_counter() < deadline:
+            total += sum(i * i for i in range(1000))
+        return total
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='demo-call') as executor:
+        result = executor.submit(contextvars.copy_context().run, run_tracked, attempt).result()
+    time.sleep(seconds / 2)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture one profiled slow turn to check the setup")
+    parser.add_argument('--seconds', type=float, default=1.0, help="Length of the demo turn")
+    parser.add_argument('--directory', default=PROFILE_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    demo = SamplingProfiler(fraction=1, min_seconds=0, directory=args.directory)
+    stats = {}
+    with demo.profile_turn('0' * 32, stats):
+        _busy_turn(args.seconds)
+    print(f"profile written to {stats.get('profile')}; open it in https://www.speedscope.app or run "
+          f"flamegraph.pl {stats.get('profile')} > flame.svg")
+
+if __name__ == "__main__":
+    main()
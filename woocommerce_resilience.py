@@ -0,0 +1,154 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import woocommerce_metrics as metrics
+from woocommerce_profiling import run_tracked
+
+logger = logging.getLogger("woocommerce_resilience")
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker rejects a call without trying it"""
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when no attempt finished before the call deadline"""
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures, half-open after a cool-down, closed again on success"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_in_flight = False
+        self.lock = threading.Lock()
+        self._publish('closed')
+
+    def _publish(self, state):
+        self.state = state
+        metrics.set_gauge('circuit_open', 1 if state == 'open' else 0, {'circuit': self.name})
+
+    def allow(self):
+        """Return True if a call may go through; only one probe is let through while half-open"""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._publish('half_open')
+            if self.state == 'half_open' and not self.half_open_in_flight:
+                self.half_open_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.half_open_in_flight = False
+            if self.state != 'closed':
+                logger.info("circuit %s closed", self.name)
+            self._publish('closed')
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.half_open_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning("circuit %s opened after %d failures", self.name, self.failures)
+                    metrics.increment('circuit_trips', labels={'circuit': self.name})
+                self.opened_at = time.monotonic()
+                self._publish('open')
+
+class ResilientCaller:
+    """Run a blocking call with an overall deadline, budget-aware retries and optional hedging.
+
+    attempt(number) is called for every try; attempts after the first should use
+    independent state (e.g. a fresh agent) since a slow attempt keeps running in
+    its worker thread after it has been abandoned.
+    """
+
+    def __init__(self, name, timeout=60.0, max_attempts=2, hedge=False, hedge_percentile=0.95,
+                 hedge_min_delay=1.0, breaker=None, max_workers=16):
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-call")
+
+    def _submit(self, attempt, number):
+        # Carry context variables (session, trace, profile) into the worker thread
+        context = contextvars.copy_context()
+        started = time.perf_counter()
+        future = self.executor.submit(context.run, run_tracked, attempt, number)
+        future.started = started
+        future.attempt = number
+        return future
+
+    def _hedge_delay(self):
+        observed = metrics.percentile('call_seconds', self.hedge_percentile, {'call': self.name})
+        return max(self.hedge_min_delay, observed) if observed is not None else None
+
+    def _typical_latency(self):
+        return metrics.percentile('call_seconds', 0.5, {'call': self.name}, default=0.0)
+
+    def call(self, attempt):
+        if self.breaker is not None and not self.breaker.allow():
+            metrics.increment('call_rejected', labels={'call': self.name})
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        deadline = time.monotonic() + self.timeout
+        attempts_made = 1
+        pending = {self._submit(attempt, attempts_made)}
+        hedged = False
+        last_error = None
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_for = remaining
+            hedge_delay = self._hedge_delay() if self.hedge and not hedged and attempts_made < self.max_attempts else None
+            if hedge_delay is not None:
+                oldest = min(future.started for future in pending)
+                wait_for = min(remaining, max(0.0, oldest + hedge_delay - time.perf_counter()))
+
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    metrics.observe('call_seconds', time.perf_counter() - future.started, {'call': self.name})
+                    if future.attempt > 1:
+                        metrics.increment('call_recovered', labels={'call': self.name, 'by': 'hedge' if hedged else 'retry'})
+                    if self.breaker is not None:
+                        self.breaker.record_success()
+                    return future.result()
+                last_error = error
+                metrics.increment('call_errors', labels={'call': self.name})
+                logger.warning("%s attempt %d failed: %s", self.name, future.attempt, error)
+
+            if pending and not done and hedge_delay is not None:
+                # The in-flight attempt is slower than usual: race a duplicate against it
+                hedged = True
+                attempts_made += 1
+                metrics.increment('call_hedges', labels={'call': self.name})
+                pending.add(self._submit(attempt, attempts_made))
+            elif not pending and attempts_made < self.max_attempts:
+                # Only retry if a typical call still fits in the remaining budget
+                if deadline - time.monotonic() > self._typical_latency():
+                    attempts_made += 1
+                    metrics.increment('call_retries', labels={'call': self.name})
+                    pending.add(self._submit(attempt, attempts_made))
+
+        if self.breaker is not None:
+            self.breaker.record_failure()
+        if pending:
+            metrics.increment('call_timeouts', labels={'call': self.name})
+            raise DeadlineExceededError(f"{self.name} did not finish within {self.timeout}s")
+        raise last_error
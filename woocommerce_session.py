@@ -0,0 +1,184 @@
+import argparse
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import woocommerce_metrics as metrics
+from woocommerce_orders import extract_order_identifiers
+
+# How long a customer's identifiers and orders are remembered after the last use
+SESSION_CONTEXT_TTL = float(os.getenv("SESSION_CONTEXT_TTL", "900"))
+SESSION_CONTEXT_MAX_SESSIONS = int(os.getenv("SESSION_CONTEXT_MAX_SESSIONS", "5000"))
+# Per-session cap on remembered orders; the oldest lookups are forgotten first
+SESSION_CONTEXT_MAX_ORDERS = int(os.getenv("SESSION_CONTEXT_MAX_ORDERS", "20"))
+# Remembered order lookups older than this are looked up again, however active the session is
+SESSION_ORDERS_MAX_AGE = float(os.getenv("SESSION_ORDERS_MAX_AGE", "60"))
+
+# Chat session of the turn being processed; copied into the model worker threads
+current_session = contextvars.ContextVar("current_session", default=None)
+
+@dataclass
+class CustomerContext:
+    """What we already know about the customer in one chat session"""
+    email: str = None
+    order_id: str = None
+    # (email, order_id) lookup -> (monotonic time looked up, list of OrderStatus), oldest first
+    lookups: OrderedDict = field(default_factory=OrderedDict)
+    expires: float = 0.0
+
+    def order_count(self):
+        return sum(len(orders) for _, orders in self.lookups.values())
+
+def _lookup_key(email, order_id):
+    return ((email or '').strip().lower() or None, str(order_id).strip().lstrip('#') if order_id else None)
+
+class SessionStore:
+    """Per-session customer context with expiry, an LRU cap on sessions and a cap on orders per session.
+
+    The session expiry slides with every use, but each remembered lookup also has a
+    fixed `max_order_age`, so an order status is never served older than that.
+    """
+
+    def __init__(self, ttl=SESSION_CONTEXT_TTL, max_sessions=SESSION_CONTEXT_MAX_SESSIONS,
+                 max_orders=SESSION_CONTEXT_MAX_ORDERS, max_order_age=SESSION_ORDERS_MAX_AGE):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_orders = max_orders
+        self.max_order_age = max_order_age
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get(self, session_id, create=False):
+        now = time.monotonic()
+        context = self.sessions.pop(session_id, None)
+        if context is not None and context.expires <= now:
+            metrics.increment('session_context_expired')
+            context = None
+        if context is None:
+            if not create:
+                return None
+            context = CustomerContext()
+        context.expires = now + self.ttl
+        self.sessions[session_id] = context
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            metrics.increment('session_context_evicted')
+        metrics.set_gauge('session_context_sessions', len(self.sessions))
+        return context
+
+    def identifiers(self, session_id):
+        """Return the remembered (email, order_id) for a session"""
+        if session_id is None:
+            return None, None
+        with self.lock:
+            context = self._get(session_id)
+            return (context.email, context.order_id) if context else (None, None)
+
+    def note_message(self, session_id, message):
+        """Remember any email address or order number the customer typed"""
+        email, order_id = extract_order_identifiers(message)
+        if session_id is None or not (email or order_id):
+            return
+        with self.lock:
+            context = self._get(session_id, create=True)
+            if email:
+                context.email = email
+            if order_id:
+                context.order_id = order_id
+
+    def remember_orders(self, session_id, email, order_id, orders):
+        if session_id is None:
+            return
+        with self.lock:
+            context = self._get(session_id, create=True)
+            context.email = email or context.email
+            context.order_id = order_id or context.order_id
+            key = _lookup_key(email, order_id)
+            context.lookups.pop(key, None)
+            context.lookups[key] = (time.monotonic(), list(orders))
+            while len(context.lookups) > 1 and context.order_count() > self.max_orders:
+                context.lookups.popitem(last=False)
+
+    def cached_orders(self, session_id, email, order_id):
+        """Answer a lookup from what the session already resolved, or return None"""
+        if session_id is None:
+            return None
+        key = _lookup_key(email, order_id)
+        with self.lock:
+            context = self._get(session_id)
+            if context is None:
+                return None
+            oldest = time.monotonic() - self.max_order_age
+            for stale in [lookup for lookup, (looked_up, _) in context.lookups.items() if looked_up < oldest]:
+                del context.lookups[stale]
+                metrics.increment('session_orders_expired')
+            if key in context.lookups:
+                return context.lookups[key][1]
+            if key[1] is not None:
+                # An order from an earlier email lookup answers a lookup by its number
+                for (lookup_email, _), (_, orders) in context.lookups.items():
+                    matches = [order for order in orders if str(order.order_id) == key[1]]
+                    if matches and (key[0] is None or key[0] == lookup_email):
+                        return matches
+        return None
+
+    def clear(self, session_id=None):
+        with self.lock:
+            if session_id is None:
+                self.sessions.clear()
+            else:
+                self.sessions.pop(session_id, None)
+
+session_store = SessionStore()
+
+@contextmanager
+def session_scope(session_id):
+    """Make session_id the current session for the duration of a turn"""
+    token = current_session.set(session_id)
+    try:
+        yield
+    finally:
+        current_session.reset(token)
+
+# Turns of a scripted follow-up conversation: (customer message, tool arguments the model would use)
+SCRIPTED_CONVERSATION = [
+    ("Hi, my email is {email}, what's happening with my orders?", {'email': '{email}'}),
+    ("When was the latest one placed?", {'email': '{email}'}),
+    ("And the other one?", {}),
+    ("What's the total on order #{order_id}?", {'order_id': '{order_id}'}),
+    ("Has it shipped yet?", {'email': '{email}', 'order_id': '{order_id}'}),
+]
+
+def replay_conversation(email, order_id, use_store):
+    """Replay the scripted conversation through the order tool and return the database queries it made"""
+    import woocommerce_bot
+
+    session_id = 'replay' if use_store else None
+    if session_id is not None:
+        session_store.clear(session_id)
+    before = metrics.snapshot()['counters'].get('db_queries', {}).get('query=get_order_status', 0)
+    with session_scope(session_id):
+        for message, arguments in SCRIPTED_CONVERSATION:
+            message = message.format(email=email, order_id=order_id)
+            arguments = {name: value.format(email=email, order_id=order_id) for name, value in arguments.items()}
+            session_store.note_message(session_id, message)
+            woocommerce_bot.get_order_status(**arguments)
+    after = metrics.snapshot()['counters'].get('db_queries', {}).get('query=get_order_status', 0)
+    return int(after - before)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare order lookups over a scripted multi-turn conversation")
+    parser.add_argument('--email', required=True, help="Customer email with a few orders in the shop database")
+    parser.add_argument('--order-id', required=True, help="One of that customer's order numbers")
+    args = parser.parse_args()
+
+    for name, use_store in [('without session context', False), ('with session context', True)]:
+        queries = replay_conversation(args.email, args.order_id, use_store)
+        print(f"{name:>24}: {queries} order queries over {len(SCRIPTED_CONVERSATION)} turns")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+# Layout: header, JSON description, then each array's raw bytes at an aligned offset
+SNAPSHOT_MAGIC = b'WCSN'
+FORMAT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sIQ')
+ALIGNMENT = 64
+
+logger = logging.getLogger("woocommerce_snapshots")
+
+@dataclass
+class Snapshot:
+    """A loaded index snapshot; arrays are read-only views into the mapped file"""
+    kind: str
+    schema: int
+    # How far the sources were read when the snapshot was taken (max post_modified, content digest...)
+    watermark: object
+    meta: dict
+    arrays: dict
+    created: float
+
+def _aligned(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def save_snapshot(path, kind, schema, watermark, arrays, meta=None):
+    """Write arrays plus a JSON-serializable watermark and meta to one file, replaced atomically.
+
+    `schema` is the version of the structure stored under `kind`; bump it whenever
+    the arrays or their meaning change, and older snapshots are ignored on load.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout, position = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position}
+        position = _aligned(position + array.nbytes)
+    description = json.dumps({
+        'kind': kind, 'schema': schema, 'watermark': watermark, 'meta': meta or {},
+        'created': time.time(), 'arrays': layout,
+    }).encode('utf-8')
+    data_start = _aligned(SNAPSHOT_HEADER.size + len(description))
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, FORMAT_VERSION, len(description)))
+        file.write(description)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]['offset'])
+            file.write(array.tobytes())
+        file.truncate(data_start + position)
+    os.replace(temp_path, path)
+
+def load_snapshot(path, kind, schema):
+    """Map a snapshot written by save_snapshot; None when it is missing or of another kind or schema"""
+    try:
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        # ValueError: empty file
+        return None
+    magic, format_version, description_size = SNAPSHOT_HEADER.unpack_from(mapped, 0)
+    if magic != SNAPSHOT_MAGIC or format_version != FORMAT_VERSION:
+        logger.warning("Ignoring %s: not a version %d snapshot file", path, FORMAT_VERSION)
+        return None
+    description = json.loads(mapped[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + description_size])
+    if description['kind'] != kind or description['schema'] != schema:
+        logger.warning("Ignoring %s: %s schema %s, expected %s schema %d",
+                       path, description['kind'], description['schema'], kind, schema)
+        return None
+    data_start = _aligned(SNAPSHOT_HEADER.size + description_size)
+    arrays = {}
+    for name, layout in description['arrays'].items():
+        dtype = np.dtype(layout['dtype'])
+        count = int(np.prod(layout['shape']))
+        arrays[name] = np.frombuffer(mapped, dtype=dtype, count=count,
+                                     offset=data_start + layout['offset']).reshape(layout['shape'])
+    return Snapshot(kind, schema, description['watermark'], description['meta'], arrays, description['created'])
+
+def pack_strings(values):
+    """(uint8 buffer, int64 offsets) for a list of strings; string i is buffer[offsets[i]:offsets[i + 1]]"""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def unpack_strings(buffer, offsets):
+    data = buffer.tobytes()
+    bounds = offsets.tolist()
+    return [data[bounds[i]:bounds[i + 1]].decode('utf-8') for i in range(len(bounds) - 1)]
+
+def _timed(function):
+    start_time = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start_time
+
+def run_benchmark(faq_rows, products, directory):
+    """Cold (rebuild from sources) vs warm (load snapshot, catch up) startup of the FAQ and facet indexes"""
+    from datetime import timedelta
+
+    from woocommerce_facets import FacetIndex, generate_synthetic as generate_catalog
+    from woocommerce_faq_reload import FaqReloader
+    from woocommerce_faq_store import generate_synthetic as generate_faq
+    from woocommerce_vector_store import LocalVectorStore
+
+    directory = tempfile.mkdtemp(prefix='snapshot_benchmark_', dir=directory)
+    try:
+        faq_file = os.path.join(directory, 'faq.csv')
+        snapshot_path = os.path.join(directory, 'faq.snapshot')
+        generate_faq(faq_file, faq_rows)
+
+        def start_faq():
+            return FaqReloader(faq_file, snapshot_path=snapshot_path,
+                               vector_store=LocalVectorStore(os.path.join(directory, 'faq_embeddings')))
+
+        print(f"FAQ: {faq_rows} rows (snapshot, lexical index and embeddings)")
+        _, cold = _timed(start_faq)
+        _, warm = _timed(start_faq)
+        with open(faq_file, 'a', encoding='utf-8') as file:
+            file.write("How do I change my delivery address?\tOpen the order and choose Edit address.\n")
+        reloader, caught_up = _timed(start_faq)
+        print(f"{'cold start':>24}: {cold:7.2f}s")
+        print(f"{'warm start':>24}: {warm:7.2f}s")
+        print(f"{'warm, 1 row edited':>24}: {caught_up:7.2f}s ({len(reloader.current.data)} entries)")
+
+        products_rows, terms_by_id, meta_by_id = generate_catalog(products)
+        facet_path = os.path.join(directory, 'facets.snapshot')
+        print(f"Facets: {products} products (catalog read from memory; a real cold start also reads it all from MySQL)")
+        index = FacetIndex()
+        _, cold = _timed(lambda: index.apply_changes(products_rows, terms_by_id, meta_by_id))
+        _, saved = _timed(lambda: index.save(facet_path))
+        # Changes made while the process was down: everything after the watermark
+        changed = [(product_id, title, slug, status, modified + timedelta(hours=1))
+                   for product_id, title, slug, status, modified in products_rows[:min(1000, products)]]
+
+        def warm_start():
+            loaded = FacetIndex.load(facet_path)
+            loaded.apply_changes([row for row in changed if row[4] > loaded.watermark], terms_by_id, meta_by_id)
+            return loaded
+
+        loaded, warm = _timed(warm_start)
+        filters = [('category', 'Category 1'), ('material', 'cotton')]
+        assert list(loaded.query(filters, limit=0)) == list(index.query(filters, limit=0))
+        print(f"{'cold build':>24}: {cold:7.2f}s")
+        print(f"{'snapshot write':>24}: {saved:7.2f}s ({os.path.getsize(facet_path) / 1e6:.1f} MB)")
+        print(f"{'warm + ' + str(len(changed)) + ' changes':>24}: {warm:7.2f}s")
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold vs warm startup of the snapshotted indexes")
+    parser.add_argument('--faq-rows', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--directory', default='.', help="Where benchmark files are written")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    run_benchmark(args.faq_rows, args.products, args.directory)
+
+if __name__ == "__main__":
+    main()
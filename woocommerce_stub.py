@@ -0,0 +1,65 @@
+import re
+import time
+from types import SimpleNamespace
+
+from woocommerce_faq_search import FaqIndex
+
+ORDER_PATTERN = re.compile(r"\b(order|orders|status|tracking|shipped)\b", re.IGNORECASE)
+PRODUCT_PATTERN = re.compile(r"\b(product|products|buy|available|stock|looking for)\b", re.IGNORECASE)
+
+def estimate_tokens(text):
+    """Rough token estimate (about four characters per token)"""
+    return max(1, len(text or '') // 4)
+
+class StubAgentTeam:
+    """Offline stand-in for the Gemini agent team used for evaluation and benchmarks.
+
+    It mimics the shape of an agno RunResponse (content, messages, metrics, tools)
+    so the rest of the pipeline runs unchanged, and can inject artificial latency.
+    Like an agno Agent, it keeps every run and message in `memory` for its lifetime.
+    """
+
+    def __init__(self, faq_data, latency=0.0):
+        self.name = "Stub Agent Team"
+        self.team = []
+        self.latency = latency
+        self.faq_index = FaqIndex(faq_data)
+        self.memory = SimpleNamespace(runs=[], messages=[])
+
+    def _assistant_message(self, prompt, content, tool_calls=None):
+        metrics = SimpleNamespace(
+            input_tokens=estimate_tokens(prompt),
+            output_tokens=estimate_tokens(content),
+            total_tokens=estimate_tokens(prompt) + estimate_tokens(content),
+            time=self.latency
+        )
+        return SimpleNamespace(role='assistant', content=content, tool_calls=tool_calls, metrics=metrics)
+
+    def run(self, message, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+
+        tools = []
+        if ORDER_PATTERN.search(message):
+            tools.append({'tool_name': 'transfer_task_to_order_status_agent', 'tool_args': {}})
+            content = "Please share your email address or order ID so I can look up your order."
+        elif PRODUCT_PATTERN.search(message):
+            tools.append({'tool_name': 'transfer_task_to_product_search_agent', 'tool_args': {}})
+            content = "Let me search our catalog for that product."
+        else:
+            content = self.faq_index.top_answer(message) or "I'm not sure about that. Please contact our support team."
+
+        messages = [SimpleNamespace(role='user', content=message, tool_calls=None, metrics=None)]
+        if tools:
+            messages.append(self._assistant_message(message, '', tool_calls=tools))
+        messages.append(self._assistant_message(message, content))
+
+        metrics = {}
+        for assistant in (m for m in messages if m.role == 'assistant'):
+            for key in ('input_tokens', 'output_tokens', 'total_tokens', 'time'):
+                metrics.setdefault(key, []).append(getattr(assistant.metrics, key))
+
+        response = SimpleNamespace(content=content, messages=messages, metrics=metrics, tools=tools, run_id=None)
+        self.memory.messages.extend(messages)
+        self.memory.runs.append(SimpleNamespace(message=messages[0], messages=None, response=response))
+        return response
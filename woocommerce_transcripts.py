@@ -0,0 +1,293 @@
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+import woocommerce_metrics as metrics
+
+load_dotenv()
+
+# Directory of transcript segments; empty disables the transcript log
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", "transcripts")
+# Turns waiting for the writer; beyond this the log sheds (or briefly blocks, see below)
+TRANSCRIPT_QUEUE_SIZE = int(os.getenv("TRANSCRIPT_QUEUE_SIZE", "10000"))
+# How long a reply may wait for room in a full queue before its turn is dropped (0 never waits)
+TRANSCRIPT_BLOCK_SECONDS = float(os.getenv("TRANSCRIPT_BLOCK_SECONDS", "0"))
+# Written turns are fsynced at least this often: the most a crash can lose besides the queue
+TRANSCRIPT_FLUSH_SECONDS = float(os.getenv("TRANSCRIPT_FLUSH_SECONDS", "1"))
+# A segment is closed and gzipped once it reaches this size or age
+TRANSCRIPT_SEGMENT_BYTES = int(os.getenv("TRANSCRIPT_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+TRANSCRIPT_SEGMENT_SECONDS = float(os.getenv("TRANSCRIPT_SEGMENT_SECONDS", "3600"))
+# Most turns per write (and fsync)
+TRANSCRIPT_BATCH = 1000
+
+logger = logging.getLogger("woocommerce_transcripts")
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def compress_segment(path):
+    """Gzip a closed segment next to itself and remove the plain file"""
+    with open(path, 'rb') as source, gzip.open(f"{path}.gz.tmp", 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.replace(f"{path}.gz.tmp", f"{path}.gz")
+    os.remove(path)
+
+class TranscriptSink:
+    """Append-only JSONL log of chat turns, written behind the replies.
+
+    record() only puts the turn on a bounded queue. A writer thread drains it in
+    batches into the active segment (`transcript-<start>-<pid>.jsonl`, one per
+    process) and fsyncs once per batch, at least every `flush_seconds`. Closed
+    segments are gzipped. When the queue is full a turn is dropped and counted
+    (after waiting up to `block_seconds`), so a slow disk never holds up a reply.
+    """
+
+    def __init__(self, directory=TRANSCRIPT_DIR, queue_size=TRANSCRIPT_QUEUE_SIZE, block_seconds=TRANSCRIPT_BLOCK_SECONDS,
+                 flush_seconds=TRANSCRIPT_FLUSH_SECONDS, segment_bytes=TRANSCRIPT_SEGMENT_BYTES,
+                 segment_seconds=TRANSCRIPT_SEGMENT_SECONDS):
+        self.directory = directory
+        self.block_seconds = block_seconds
+        self.flush_seconds = flush_seconds
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.queue_size = queue_size
+        self.queue = None
+        self.file = None
+        self.segment_path = None
+        self.segment_started = 0.0
+        self.pid = None
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def _start(self):
+        # Lazily, and again after a fork: the writer thread doesn't survive it
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            # A queue inherited through fork may have been locked by the parent's writer
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.file = None
+            self.stopping.clear()
+            os.makedirs(self.directory, exist_ok=True)
+            self._compress_orphans()
+            self.thread = threading.Thread(target=self._run, name='transcript-writer', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+            # Set last: other threads skip _start() as soon as they see it
+            self.pid = os.getpid()
+
+    def _compress_orphans(self):
+        """Gzip active segments left behind by processes that are gone"""
+        for path in glob.glob(os.path.join(self.directory, 'transcript-*.jsonl')):
+            pid = int(os.path.basename(path)[:-len('.jsonl')].rsplit('-', 1)[1])
+            if pid != os.getpid() and not _pid_alive(pid):
+                compress_segment(path)
+
+    def record(self, turn):
+        """Queue one turn (a JSON-serializable dict); returns False if it was dropped"""
+        if not self.directory:
+            return False
+        if self.pid != os.getpid():
+            self._start()
+        try:
+            if self.block_seconds > 0:
+                self.queue.put(turn, timeout=self.block_seconds)
+            else:
+                self.queue.put_nowait(turn)
+        except queue.Full:
+            metrics.increment('transcript_dropped')
+            return False
+        metrics.set_gauge('transcript_queue_depth', self.queue.qsize())
+        return True
+
+    def _open_segment(self):
+        self.segment_started = time.time()
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime(self.segment_started))
+        self.segment_path = os.path.join(self.directory, f"transcript-{stamp}{int(self.segment_started * 1000) % 1000:03d}"
+                                                         f"-{os.getpid()}.jsonl")
+        self.file = open(self.segment_path, 'a', encoding='utf-8')
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        compress_segment(self.segment_path)
+        metrics.increment('transcript_segments')
+
+    def _write(self, batch):
+        if self.file is None:
+            self._open_segment()
+        start_time = time.perf_counter()
+        self.file.write(''.join(json.dumps(turn, default=str) + '\n' for turn in batch))
+        self.file.flush()
+        # One fsync for the whole batch
+        os.fsync(self.file.fileno())
+        metrics.observe('transcript_flush_seconds', time.perf_counter() - start_time)
+        metrics.increment('transcript_turns', len(batch))
+        if self.file.tell() >= self.segment_bytes or time.time() - self.segment_started >= self.segment_seconds:
+            self._rotate()
+
+    def _run(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            # Collect until the flush interval is up; whatever arrived goes out in one write
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                if len(batch) >= TRANSCRIPT_BATCH or self.stopping.is_set() and self.queue.empty():
+                    break
+            while len(batch) < TRANSCRIPT_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(batch)
+                except OSError as e:
+                    metrics.increment('transcript_write_errors')
+                    logger.error("Writing %d transcript turns failed: %s", len(batch), e)
+            metrics.set_gauge('transcript_queue_depth', self.queue.qsize())
+            if self.stopping.is_set() and self.queue.empty():
+                return
+
+    def close(self):
+        """Write out what is queued and gzip the active segment"""
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        self.stopping.set()
+        self.thread.join()
+        if self.file is not None:
+            self._rotate()
+
+def segment_paths(directory=TRANSCRIPT_DIR):
+    """Segments oldest first, compressed and active alike"""
+    paths = glob.glob(os.path.join(directory, 'transcript-*.jsonl')) \
+        + glob.glob(os.path.join(directory, 'transcript-*.jsonl.gz'))
+    return sorted(paths, key=lambda path: os.path.basename(path).split('-')[1])
+
+def read_transcripts(directory=TRANSCRIPT_DIR, since=None):
+    """Yield logged turns in segment order, optionally only those at or after `since` (epoch seconds).
+
+    A torn last line (crash mid-write) is skipped.
+    """
+    for path in segment_paths(directory):
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rt', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        turn = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if since is None or turn.get('ts', 0) >= since:
+                        yield turn
+        except (FileNotFoundError, EOFError):
+            # Compressed by its writer while we were listing, or a truncated gzip
+            continue
+
+def summarize(turns):
+    turns = list(turns)
+    latencies = sorted(turn.get('latency', 0.0) for turn in turns)
+    tools = Counter(tool['name'] for turn in turns for tool in turn.get('tools') or [])
+    return {
+        'turns': len(turns),
+        'sessions': len({turn.get('session_id') for turn in turns}),
+        'paths': Counter(turn.get('path') for turn in turns),
+        'agents': Counter(agent for turn in turns for agent in turn.get('agents') or []),
+        'tools': tools,
+        'errors': sum(1 for turn in turns if turn.get('error')),
+        'latency_p50': statistics.median(latencies) if latencies else 0.0,
+        'latency_p95': latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        'tokens': sum((turn.get('tokens') or {}).get('total_tokens', 0) for turn in turns),
+    }
+
+def print_report(summary):
+    print(f"{summary['turns']} turns in {summary['sessions']} sessions, {summary['errors']} errors, "
+          f"latency p50 {summary['latency_p50']:.2f}s p95 {summary['latency_p95']:.2f}s, {summary['tokens']} tokens")
+    for title in ('paths', 'agents', 'tools'):
+        counts = ', '.join(f"{name}: {count}" for name, count in summary[title].most_common())
+        print(f"{title}: {counts or '-'}")
+
+def run_benchmark(turns):
+    """Time the reply-side cost of logging a turn: direct write + fsync vs queueing for the writer"""
+    directory = tempfile.mkdtemp(prefix='transcript_benchmark_')
+    try:
+        turn = {'ts': time.time(), 'trace_id': '0' * 32, 'session_id': 'benchmark', 'message': 'Where is my order 1234?',
+                'reply': 'Your order #1234 is being processed.' * 4, 'path': 'model', 'agents': ['Order Status Agent'],
+                'tools': [{'name': 'get_order_status', 'args': {'order_id': '1234'}}], 'latency': 1.2,
+                'tokens': {'input_tokens': 900, 'output_tokens': 60, 'total_tokens': 960}}
+        timings = []
+        with open(os.path.join(directory, 'direct.jsonl'), 'a', encoding='utf-8') as file:
+            for _ in range(turns):
+                start_time = time.perf_counter()
+                file.write(json.dumps(turn) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+                timings.append(time.perf_counter() - start_time)
+        timings.sort()
+        print(f"{'synchronous + fsync':>20}: p50 {timings[len(timings) // 2] * 1e6:8.1f}us, "
+              f"p99 {timings[int(0.99 * len(timings))] * 1e6:8.1f}us per turn")
+
+        sink = TranscriptSink(os.path.join(directory, 'sink'), flush_seconds=0.2)
+        timings = []
+        for _ in range(turns):
+            start_time = time.perf_counter()
+            sink.record(turn)
+            timings.append(time.perf_counter() - start_time)
+        close_start = time.perf_counter()
+        sink.close()
+        timings.sort()
+        written = sum(1 for _ in read_transcripts(os.path.join(directory, 'sink')))
+        print(f"{'write-behind queue':>20}: p50 {timings[len(timings) // 2] * 1e6:8.1f}us, "
+              f"p99 {timings[int(0.99 * len(timings))] * 1e6:8.1f}us per turn "
+              f"({written}/{turns} read back, drain {time.perf_counter() - close_start:.2f}s)")
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the chat transcript log")
+    parser.add_argument('--directory', default=TRANSCRIPT_DIR or 'transcripts')
+    parser.add_argument('--hours', type=float, help="Only turns from the last HOURS hours")
+    parser.add_argument('--dump', action='store_true', help="Print the turns as JSON lines instead of a summary")
+    parser.add_argument('--benchmark', type=int, metavar='TURNS', help="Compare synchronous and write-behind logging")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark)
+        return
+    since = time.time() - args.hours * 3600 if args.hours else None
+    turns = read_transcripts(args.directory, since)
+    if args.dump:
+        for turn in turns:
+            print(json.dumps(turn, default=str))
+    else:
+        print_report(summarize(turns))
+
+if __name__ == "__main__":
+    main()